@@ -0,0 +1,284 @@
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pandas as pd
+
+from download_files import PDFDownloader
+
+try:
+    import resource # not available on Windows
+except ImportError:
+    resource = None
+
+class MockPdfServer:
+    def __init__(self, latency: float = 0.0, bandwidth: int = None, error_rate: float = 0.0, redirect_rate: float = 0.0,
+                 chunked: bool = False, sizes=(50_000, 2_000_000), seed: int = 0):
+        self.latency = latency # seconds before the response headers are sent
+        self.bandwidth = bandwidth # bytes per second per connection, None for unlimited
+        self.error_rate = error_rate # share of requests answered with 503
+        self.redirect_rate = redirect_rate # share of requests answered with a 302 to the same file
+        self.chunked = chunked # send bodies with Transfer-Encoding: chunked instead of Content-Length
+        self.sizes = sizes # (min, max) bytes; file sizes are log-uniform in between
+        self.seed = seed
+        self.server = None
+        self.thread = None
+
+    def size_of(self, name: str) -> int:
+        """
+        Return the size of the mock file `name`; the same name always gets the same size.
+        """
+        rng = random.Random(f"{self.seed}-{name}")
+        low, high = self.sizes
+        return int(low * (high / low) ** rng.random()) if high > low else low
+
+    def body_of(self, name: str) -> bytes:
+        """
+        Return the content of the mock file `name`: a PDF header, padding and an EOF marker.
+        """
+        size = self.size_of(name)
+        return b"%PDF-1.4\n" + b"0" * max(0, size - 16) + b"\n%%EOF\n"
+
+    def start(self) -> str:
+        """
+        Start the server on a free local port in a background thread and return its base URL.
+        """
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, so connection pooling shows up in the numbers
+
+            def do_GET(self):
+                rng = random.Random()
+                if mock.latency:
+                    time.sleep(mock.latency)
+                if rng.random() < mock.error_rate:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if "redirected" not in self.path and rng.random() < mock.redirect_rate:
+                    self.send_response(302)
+                    self.send_header("Location", self.path + "?redirected=1")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                body = mock.body_of(self.path.split("?")[0].rsplit("/", 1)[-1])
+                self.send_response(200)
+                self.send_header("Content-Type", "application/pdf")
+                if mock.chunked:
+                    self.send_header("Transfer-Encoding", "chunked")
+                else:
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self._send_body(body)
+
+            def _send_body(self, body: bytes):
+                block = 64 * 1024
+                for start in range(0, len(body), block):
+                    data = body[start:start + block]
+                    if mock.chunked:
+                        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    else:
+                        self.wfile.write(data)
+                    if mock.bandwidth:
+                        time.sleep(len(data) / mock.bandwidth)
+                if mock.chunked:
+                    self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 1024 # the default backlog of 5 drops connections under load and adds 1 s SYN retries
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self) -> None:
+        """
+        Stop the server and close its socket.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+class TimedPDFDownloader(PDFDownloader):
+    # PDFDownloader that records how long every single download attempt took.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def download_pdf(self, url, savepath, info=None, validators=None):
+        start = time.perf_counter()
+        result = super().download_pdf(url, savepath, info, validators)
+        self.latencies.append(time.perf_counter() - start) # list.append is atomic, no lock needed
+        return result
+
+    async def download_pdf_async(self, session, url, savepath, info=None, validators=None):
+        start = time.perf_counter()
+        result = await super().download_pdf_async(session, url, savepath, info, validators)
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Return the `q`-th percentile (0-100) of `values` by linear interpolation, or None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def peak_rss_mb() -> float:
+    """
+    Return the peak resident set size of this process in MB, or None where it cannot be measured.
+
+    The peak never goes down, so it only belongs to one case when that case ran in a process of its own.
+    On Linux it is read from VmHWM, which starts anew with every program; `ru_maxrss` carries the peak of
+    the parent over fork and exec.
+    """
+    with contextlib.suppress(OSError):
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024 # in kB
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if platform.system() == "Darwin" else peak / 1024 # bytes on macOS, KB elsewhere
+
+def run_case(base_url: str, number_of_files: int, engine: str, max_workers: int, **downloader_options) -> dict:
+    """
+    Download `number_of_files` mock files with one engine setting and return its measurements.
+
+    Args:
+        base_url (str): The base URL of a running MockPdfServer.
+        number_of_files (int): The number of files to download.
+        engine (str): "threaded" or "async".
+        max_workers (int): Threads for the threaded engine, concurrent downloads for the async engine.
+        **downloader_options: Extra keyword arguments for PDFDownloader.
+
+    Returns:
+        dict: files/s, MB/s, p50/p95/p99 latency in seconds, peak RSS in MB of the calling process and the counts behind them.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        downloader = TimedPDFDownloader("benchmark", tmp, "Pdf_URL", "Report Html Address", **downloader_options)
+        downloader.dwn_folder.mkdir(parents=True)
+        ids = [f"BR{i}" for i in range(number_of_files)]
+        downloader.df2 = pd.DataFrame({"Pdf_URL": [f"{base_url}/files/{i}.pdf" for i in ids],
+                                       "Report Html Address": [f"{base_url}/files/{i}.pdf" for i in ids]},
+                                      index=pd.Index(ids, name="BRnum"))
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()): # the per-file prints would dominate the timing
+            if engine == "async":
+                downloader.process_downloads_async(number_of_files, max_concurrency=max_workers, per_host_limit=max_workers)
+            else:
+                downloader.process_downloads_threaded(number_of_files, max_workers=max_workers)
+        elapsed = time.perf_counter() - start
+
+        files = [f for f in downloader.dwn_folder.iterdir() if f.suffix == ".pdf"]
+        total_bytes = sum(f.stat().st_size for f in files)
+
+    return {
+        "engine": engine,
+        "max_workers": max_workers,
+        "files": number_of_files,
+        "downloaded": len(files),
+        "attempts": len(downloader.latencies),
+        "seconds": round(elapsed, 4),
+        "files_per_s": round(len(files) / elapsed, 3),
+        "mb_per_s": round(total_bytes / 1024 / 1024 / elapsed, 3),
+        "latency_p50": percentile(downloader.latencies, 50),
+        "latency_p95": percentile(downloader.latencies, 95),
+        "latency_p99": percentile(downloader.latencies, 99),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_isolated(*args, **kwargs) -> dict:
+    """
+    Call `run_case` in a fresh process and return its result, so its peak RSS is not that of an earlier case.
+
+    The process is spawned, not forked, so it does not start with the memory of this one.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, *args, **kwargs).result()
+
+def run_benchmark(number_of_files: int = 200, engines=("threaded", "async"), workers=(4, 16, 64), output=None,
+                  downloader_options: dict = None, **server_options) -> dict:
+    """
+    Start a MockPdfServer and run every engine/worker combination against it, each in a process of its own.
+
+    Args:
+        number_of_files (int): Files downloaded per combination.
+        engines (Iterable[str]): Engines to measure, "threaded" and/or "async".
+        workers (Iterable[int]): Worker counts to measure for every engine.
+        output (str): If given, the results are also written to this JSON file.
+        downloader_options (dict): Extra keyword arguments for PDFDownloader, e.g. pool_maxsize. They are sent to
+            the case's process, so they have to be picklable.
+        **server_options: Keyword arguments for MockPdfServer (latency, bandwidth, error_rate, ...).
+
+    Returns:
+        dict: The server settings, environment and one result per combination.
+    """
+    server = MockPdfServer(**server_options)
+    base_url = server.start()
+    try:
+        results = [run_isolated(base_url, number_of_files, engine, max_workers, **(downloader_options or {}))
+                   for engine in engines for max_workers in workers]
+    finally:
+        server.stop()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server": {"latency": server.latency, "bandwidth": server.bandwidth, "error_rate": server.error_rate,
+                   "redirect_rate": server.redirect_rate, "chunked": server.chunked, "sizes": list(server.sizes)},
+        "results": results,
+    }
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDFDownloader against a local mock PDF server.")
+    parser.add_argument("--files", type=int, default=200, help="files downloaded per run")
+    parser.add_argument("--engines", nargs="+", default=["threaded", "async"], choices=["threaded", "async"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[4, 16, 64])
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before each response")
+    parser.add_argument("--bandwidth", type=int, default=None, help="bytes per second per connection")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--redirect-rate", type=float, default=0.0)
+    parser.add_argument("--chunked", action="store_true")
+    parser.add_argument("--sizes", nargs=2, type=int, default=[50_000, 2_000_000], metavar=("MIN", "MAX"))
+    parser.add_argument("--output", default="bench_output.json", help="JSON file for the results")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.files, args.engines, args.workers, args.output, latency=args.latency,
+                           bandwidth=args.bandwidth, error_rate=args.error_rate, redirect_rate=args.redirect_rate,
+                           chunked=args.chunked, sizes=tuple(args.sizes))
+    for result in report["results"]:
+        print(f"{result['engine']:>8} x{result['max_workers']:<3} {result['files_per_s']:>8.1f} files/s "
+              f"{result['mb_per_s']:>8.1f} MB/s  p50 {result['latency_p50']:.3f}s  p95 {result['latency_p95']:.3f}s  "
+              f"p99 {result['latency_p99']:.3f}s")
+    print(f"Wrote {args.output}")
@@ -0,0 +1,85 @@
+import os
+import shutil
+from pathlib import Path
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = Path(root) # blobs live in <root>/<first two hex digits>/<sha256>.pdf
+
+    def blob_path(self, sha256: str) -> Path:
+        """
+        Return the path of the blob with the given SHA-256.
+        """
+        return self.root / sha256[:2] / f"{sha256}.pdf"
+
+    def add(self, path, sha256: str) -> bool:
+        """
+        Put the content of a downloaded file into the store and make the file a link to its blob.
+
+        If no blob with this hash exists yet, the file itself becomes the blob (a second hardlink, no copy).
+        If one exists, the file is replaced by a link to it, so identical PDFs take up disk space only once.
+
+        Args:
+            path (Path): The downloaded file, e.g. `dwn/<BRnum>.pdf`.
+            sha256 (str): The hex SHA-256 of its content.
+
+        Returns:
+            bool: True if the content was already in the store, i.e. the file was a duplicate.
+
+        Raises:
+            OSError: If the file cannot be linked or copied.
+        """
+        path = Path(path)
+        blob = self.blob_path(sha256)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if not blob.exists():
+            try:
+                os.link(path, blob)
+                return False
+            except FileExistsError:
+                pass # another thread or process stored the same content just now
+            except OSError:
+                shutil.copyfile(path, blob) # no hardlinks on this file system, keep a copy in the store
+                return False
+        if not os.path.samefile(path, blob):
+            self.link(blob, path)
+        return True
+
+    @staticmethod
+    def link(source, target) -> None:
+        """
+        Make `target` a hardlink to `source`, replacing `target` atomically if it exists.
+
+        Falls back to a copy on file systems without hardlinks.
+        """
+        source, target = Path(source), Path(target)
+        tmp_path = target.with_name(target.name + ".link")
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+
+    def prune(self) -> int:
+        """
+        Remove blobs that no downloaded file links to any more, e.g. after the download folder was emptied.
+        On file systems without hardlinks the blobs are copies, which are all removed.
+
+        Returns:
+            int: The number of blobs removed.
+        """
+        removed = 0
+        if not self.root.exists():
+            return removed
+        for folder in os.scandir(self.root):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(".pdf") and entry.stat().st_nlink == 1:
+                    os.remove(entry.path)
+                    removed += 1
+        return removed
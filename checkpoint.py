@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+DONE_RESULTS = ("Downloaded", "Unchanged") # report results that count as done; every other final result counts as failed
+
+class RunCheckpoint:
+    def __init__(self, path, interval: float = 10.0):
+        self.path = Path(path)
+        self.interval = interval # seconds between saves while rows finish
+        self.selected = None # ids the run selected, in download order; None for streamed runs
+        self.done = set()
+        self.failed = set()
+        self.lock = threading.Lock()
+        self._save_lock = threading.Lock() # one save at a time
+        self._last_save = time.monotonic()
+
+    def load(self) -> bool:
+        """
+        Read the checkpoint of an earlier run, so this run only does what that run left pending.
+
+        Returns:
+            bool: True if a checkpoint was found.
+
+        Raises:
+            ValueError: If the file is not a valid checkpoint.
+        """
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return False
+        with self.lock:
+            self.selected = data.get("selected")
+            self.done.update(data.get("done", []))
+            self.failed.update(data.get("failed", []))
+        return True
+
+    def begin(self, selected=None) -> None:
+        """
+        Remember the ids a new run selected. A resumed run keeps the selection of the run it resumes.
+        """
+        with self.lock:
+            if self.selected is None and selected is not None:
+                self.selected = [str(br_number) for br_number in selected]
+
+    def mark(self, br_number, result: str) -> bool:
+        """
+        Record the final result of a row.
+
+        Returns:
+            bool: True if `interval` has passed since the last save, i.e. the caller should save now.
+        """
+        br_number = str(br_number)
+        with self.lock:
+            (self.done if result in DONE_RESULTS else self.failed).add(br_number)
+            (self.failed if result in DONE_RESULTS else self.done).discard(br_number)
+            due = time.monotonic() - self._last_save >= self.interval
+            if due:
+                self._last_save = time.monotonic() # only this caller saves
+        return due
+
+    def is_finished(self, br_number) -> bool:
+        """
+        Return True if the row has a final result, done or failed.
+        """
+        br_number = str(br_number)
+        with self.lock:
+            return br_number in self.done or br_number in self.failed
+
+    def pending(self) -> list:
+        """
+        Return the selected ids without a final result, in download order, or None if the selection is not known.
+        """
+        with self.lock:
+            if self.selected is None:
+                return None
+            return [br_number for br_number in self.selected if br_number not in self.done and br_number not in self.failed]
+
+    def save(self) -> None:
+        """
+        Write the done, failed and pending ids to the checkpoint file.
+
+        The file is written next to its final name and renamed into place, so a crash never leaves half of it.
+        """
+        with self._save_lock:
+            pending = self.pending()
+            with self.lock:
+                data = {"updated": time.strftime("%Y-%m-%dT%H:%M:%S"), "complete": pending == [],
+                        "selected": self.selected, "done": sorted(self.done), "failed": sorted(self.failed), "pending": pending}
+                self._last_save = time.monotonic()
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(tmp_path, self.path)
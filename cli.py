@@ -0,0 +1,293 @@
+import argparse
+import sys
+from pathlib import Path
+
+# Only the standard library is imported here, so --help, --dry-run and bad arguments answer at once.
+# pandas, requests and the downloader are imported by `run`, when there is something to download.
+
+ENGINES = ("threaded", "async", "sharded", "stream")
+ORDERS = ("list", "smallest", "largest") # values of --order; "list" keeps the order of the list
+CONFIG_FILE = "pdfdownloader.toml" # read from the working directory when --config is not given
+PLAN_FILE = "preflight.csv" # where --preflight saves its plan in the output folder
+MB = 2 ** 20
+GB = 2 ** 30
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Return the parser of the command line. Every option can also be set in a profile, by its long name.
+    """
+    parser = argparse.ArgumentParser(prog="pdfdownloader", description="Download the PDFs of a report list.",
+                                     epilog=f"Settings are taken from the command line, then the --profile in the --config file "
+                                            f"(default ./{CONFIG_FILE}), then the top level of that file, then the defaults.")
+    parser.add_argument("--config", help=f"TOML file with settings and [profiles.<name>] tables (default ./{CONFIG_FILE})")
+    parser.add_argument("--profile", help="name of the profile in the config file to use")
+
+    paths = parser.add_argument_group("list and output")
+    paths.add_argument("--list", dest="list_path", help="the report list, .xlsx, .csv or .parquet")
+    paths.add_argument("--output", dest="output_folder", help="folder for the downloads (dwn/), the report, state and metrics")
+    paths.add_argument("--main-col", default="Pdf_URL", help="column with the main URL (default %(default)s)")
+    paths.add_argument("--secondary-col", default="Report Html Address", help="column with the fallback URL (default %(default)s)")
+    paths.add_argument("--id-col", default="BRnum", help="column with the id of a row (default %(default)s)")
+
+    run = parser.add_argument_group("run")
+    run.add_argument("--engine", choices=ENGINES, default="threaded", help="download engine (default %(default)s)")
+    run.add_argument("--files", type=int, default=20, help="number of rows to download, 0 for all (default %(default)s)")
+    run.add_argument("--order", choices=ORDERS, default="list", help="which rows go first (default %(default)s)")
+    run.add_argument("--spread-hosts", action="store_true", help="take the rows round-robin by host")
+    run.add_argument("--incremental", action="store_true", help="re-check downloaded files with ETag/Last-Modified instead of wiping them")
+    run.add_argument("--resume", action="store_true", help="continue the last run where it stopped, using its checkpoint")
+    run.add_argument("--dry-run", action="store_true", help="print what would be done and exit without loading or downloading anything; "
+                                                             f"with --preflight, read the list, probe it and only write {PLAN_FILE}")
+    run.add_argument("--preflight", action="store_true", help="probe every URL with HEAD requests first, save the plan to "
+                                                               f"{PLAN_FILE} in the output folder and download by it")
+    run.add_argument("--plan", help="download by a plan saved by an earlier --preflight instead of probing again")
+    run.add_argument("--preflight-workers", type=int, default=32, help="probes in flight during the preflight (default %(default)s)")
+
+    concurrency = parser.add_argument_group("concurrency")
+    concurrency.add_argument("--workers", type=int, default=8, help="download threads, per process for sharded (default %(default)s)")
+    concurrency.add_argument("--processes", type=int, help="processes of the sharded engine (default: one per CPU)")
+    concurrency.add_argument("--max-concurrency", type=int, default=100, help="downloads in flight in the async engine (default %(default)s)")
+    concurrency.add_argument("--per-host", type=int, default=4, help="downloads in flight per host (default %(default)s)")
+    concurrency.add_argument("--host-rate", type=float, default=2.0, help="requests per second per host (default %(default)s)")
+
+    limits = parser.add_argument_group("limits")
+    limits.add_argument("--retries", type=int, default=3, help="attempts per URL for transient failures (default %(default)s)")
+    limits.add_argument("--retry-budget", type=int, default=1000, help="retries of the whole run at most (default %(default)s)")
+    limits.add_argument("--max-mb-per-second", type=float, default=20.0, help="bandwidth of all downloads, 0 for no cap (default %(default)s)")
+    limits.add_argument("--min-free-gb", type=float, default=2.0, help="pause new downloads below this free disk space, 0 to not check (default %(default)s)")
+    limits.add_argument("--resume-free-gb", type=float, default=4.0, help="free disk space needed to start again (default %(default)s)")
+    limits.add_argument("--max-file-mb", type=float, default=500.0, help="skip larger files, 0 for no limit (default %(default)s)")
+
+    features = parser.add_argument_group("features")
+    features.add_argument("--no-validate", dest="validate", action="store_false", help="do not check the downloaded PDFs")
+    features.add_argument("--no-dedup", dest="dedup", action="store_false", help="do not share files between identical URLs and contents")
+    features.add_argument("--no-follow-links", dest="follow_links", action="store_false", help="do not follow PDF links on HTML pages")
+    features.add_argument("--no-metrics", dest="metrics", action="store_false", help="do not write metrics.jsonl and metrics.prom")
+    return parser
+
+def load_profile(path, name: str = None) -> dict:
+    """
+    Read the settings of a TOML config file: its top-level keys, overridden by those of [profiles.<name>].
+
+    Keys are the long option names, with dashes or underscores, e.g. `max-file-mb = 100` or `list = "reports.xlsx"`.
+
+    Args:
+        path (Path): The config file.
+        name (str): The profile to use, None for the top-level keys only.
+
+    Returns:
+        dict: The settings, with underscores in the keys.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        KeyError: If the profile is not in the file.
+        ImportError: If neither tomllib (Python 3.11+) nor tomli is available.
+    """
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        import tomli as tomllib # optional, only needed for config files before Python 3.11
+
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    profiles = data.pop("profiles", {})
+    settings = dict(data)
+    if name is not None:
+        if name not in profiles:
+            raise KeyError(f"No profile {name!r} in {path}, it has {sorted(profiles) or 'none'}")
+        settings.update(profiles[name])
+    return {key.replace("-", "_"): value for key, value in settings.items()}
+
+def parse_settings(argv=None) -> argparse.Namespace:
+    """
+    Return the settings of a run from the command line and the profile it names.
+
+    The config file and profile are read first and become the parser's defaults, so every option given on
+    the command line still wins over them.
+
+    Args:
+        argv (list[str]): The arguments, default `sys.argv[1:]`.
+
+    Returns:
+        Namespace: The settings.
+    """
+    parser = build_parser()
+    known, _ = parser.parse_known_args(argv)
+    config = Path(known.config) if known.config else Path(CONFIG_FILE)
+    if known.config or config.exists() or known.profile:
+        try:
+            profile = load_profile(config, known.profile)
+        except (OSError, KeyError, ImportError, ValueError) as e: # tomllib.TOMLDecodeError is a ValueError
+            parser.error(f"Cannot use config {config}: {e}")
+        aliases = {"list": "list_path", "output": "output_folder"}
+        profile = {aliases.get(key, key): value for key, value in profile.items()}
+        dests = {action.dest for action in parser._actions} - {"help", "config", "profile"}
+        unknown = sorted(set(profile) - dests)
+        if unknown:
+            parser.error(f"Unknown settings in {config}: {', '.join(unknown)}")
+        parser.set_defaults(**profile)
+
+    settings = parser.parse_args(argv)
+    for action in parser._actions: # argparse only checks choices on the command line, not in the defaults a profile set
+        value = getattr(settings, action.dest, None)
+        if action.choices is not None and value is not None and value not in action.choices:
+            parser.error(f"Invalid {action.dest} {value!r} in {config}, choose from {', '.join(map(str, action.choices))}")
+    if not settings.list_path or not settings.output_folder:
+        parser.error("--list and --output are required, on the command line or in a profile")
+    if (settings.preflight or settings.plan) and settings.engine == "stream":
+        parser.error("--preflight and --plan need the whole list, they do not work with --engine stream")
+    return settings
+
+def describe(settings: argparse.Namespace) -> str:
+    """
+    Return a short description of the run the settings start, for --dry-run.
+    """
+    rows = "all rows" if not settings.files else f"{settings.files} rows"
+    if settings.engine == "sharded":
+        engine = f"sharded, {settings.processes or 'one per CPU'} processes x {settings.workers} threads"
+    elif settings.engine == "async":
+        engine = f"async, {settings.max_concurrency} in flight"
+    else:
+        engine = f"{settings.engine}, {settings.workers} threads"
+    if settings.resume:
+        start = "resume the last run from its checkpoint"
+    elif settings.incremental:
+        start = "re-check downloaded files, keep the report of new rows only"
+    else:
+        start = "clean the report and delete the old downloads in the background"
+    if settings.preflight:
+        start = f"probe the URLs and save the plan to {PLAN_FILE}, then " + start
+    elif settings.plan:
+        start = f"skip dead URLs and order the rows by the plan {settings.plan}, then " + start
+    return "\n".join([
+        f"List:    {settings.list_path}{'' if Path(settings.list_path).exists() else ' (not found)'}",
+        f"Output:  {settings.output_folder}",
+        f"Columns: {settings.id_col}, {settings.main_col}, fallback {settings.secondary_col}",
+        f"Rows:    {rows} in {settings.order} order{', spread over hosts' if settings.spread_hosts else ''}",
+        f"Engine:  {engine}, {settings.per_host} per host at {settings.host_rate} requests/s",
+        f"Limits:  {settings.retries} attempts, {settings.max_mb_per_second or 'unlimited'} MB/s, "
+        f"pause below {settings.min_free_gb or 0} GB free, files up to {settings.max_file_mb or 'any'} MB",
+        f"Start:   {start}",
+    ])
+
+def run(settings: argparse.Namespace) -> int:
+    """
+    Download the list with the given settings.
+
+    With --preflight, the URLs of the rows are probed first and the downloads follow the plan (see `Preflight`);
+    with --dry-run as well, the run ends after the plan was printed and saved to the output folder; no download
+    folder, state store, report, checkpoint or metrics file is created or changed.
+
+    Returns:
+        int: The exit status, 0 once the run has finished or was stopped gracefully.
+    """
+    from blob_store import BlobStore
+    from checkpoint import RunCheckpoint
+    from download_files import PDFDownloader
+    from download_governor import DownloadGovernor
+    from download_order import DownloadOrder
+    from metrics import Metrics, JsonLinesExporter, PrometheusTextExporter
+    from pdf_validator import PdfValidator
+    from preflight import Preflight
+    from prepare import PreparePdfDownloader
+    from report_writer import ReportWriter
+    from retry_policy import RetryPolicy
+    from scheduler import HostScheduler
+
+    output_folder = Path(settings.output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True) # a dry run writes its plan here, and nothing else
+    number_of_files = settings.files or None
+    order = None
+    if settings.order != "list" or settings.spread_hosts:
+        order = DownloadOrder(size=None if settings.order == "list" else settings.order, spread_hosts=settings.spread_hosts)
+    governor = DownloadGovernor(max_bytes_per_second=settings.max_mb_per_second * MB or None,
+                                min_free_bytes=int(settings.min_free_gb * GB) or None,
+                                resume_free_bytes=int(settings.resume_free_gb * GB) or None,
+                                max_file_size=int(settings.max_file_mb * MB) or None)
+
+    # Metrics: one JSON line per event, and a Prometheus text file refreshed every 10 seconds
+    metrics = None
+    if settings.metrics and not settings.dry_run:
+        metrics = Metrics([JsonLinesExporter(output_folder / "metrics.jsonl"), PrometheusTextExporter(output_folder / "metrics.prom")])
+    report_writer = ReportWriter(metrics=metrics)
+
+    prepare = PreparePdfDownloader(settings.list_path, output_folder, settings.main_col, settings.secondary_col,
+                                   id_col=settings.id_col, metrics=metrics)
+    if settings.dry_run:
+        exist = prepare.find_downloaded_ids() # creates no dwn folder and no state store
+    else:
+        exist = prepare.prepare_folders_and_find_pdf_duplicates()
+    exist = [] if settings.incremental else exist # incremental runs revisit downloaded rows
+    df = df2 = plan = None
+    if settings.engine != "stream":
+        df, df2 = prepare.load_and_filter_excel_data(exist)
+
+    # Preflight: HEAD probes of both URL columns, a plan of dead rows, first columns and sizes
+    if settings.preflight and df2 is not None:
+        rows = df2 if order is not None or settings.resume else df2.iloc[:number_of_files] # an order or checkpoint may pick any row
+        preflight = Preflight(workers=settings.preflight_workers, scheduler=HostScheduler(rate=settings.host_rate, max_concurrency=settings.per_host))
+        plan = Preflight.plan(preflight.probe(rows, [settings.main_col, settings.secondary_col]), settings.main_col, settings.secondary_col)
+        Preflight.save(plan, output_folder / PLAN_FILE)
+        Preflight.summarize(plan, settings.main_col)
+    elif settings.plan:
+        plan = Preflight.load(settings.plan)
+    if settings.dry_run:
+        return 0
+
+    # Checkpoint of done, failed and pending rows, saved every 10 seconds and when the run ends or is stopped
+    checkpoint = RunCheckpoint(output_folder / "checkpoint.json")
+    if settings.resume:
+        checkpoint.load()
+        for name, result in ReportWriter.read_results(output_folder).items(): # rows reported after the last save
+            checkpoint.mark(name, result)
+    else:
+        report_writer.clean_report_file(output_folder=output_folder)
+
+    downloader = PDFDownloader(settings.list_path, output_folder, settings.main_col, settings.secondary_col, id_col=settings.id_col,
+                               report_writer=report_writer, pool_maxsize=settings.workers,
+                               max_retries=0, # no immediate adapter retries; the retry policy is the only retry layer, with backoff and budget
+                               state_store=prepare.state_store, incremental=settings.incremental,
+                               scheduler=HostScheduler(rate=settings.host_rate, max_concurrency=settings.per_host),
+                               retry_policy=RetryPolicy(max_attempts=settings.retries, run_budget=settings.retry_budget),
+                               follow_pdf_links=settings.follow_links, metrics=metrics,
+                               validator=PdfValidator(workers=2, queue_size=64) if settings.validate else None,
+                               blob_store=BlobStore(output_folder / "blobs") if settings.dedup else None,
+                               dedup_urls=settings.dedup, order=order, governor=governor, checkpoint=checkpoint,
+                               plan=plan)
+
+    if not settings.incremental and not settings.resume:
+        downloader.delete_downloaded_files(background=True) # downloads start while the old files are deleted
+
+    try:
+        if settings.engine == "stream":
+            downloader.process_download_stream(prepare.iter_filtered_batches(exist), number_of_files, max_workers=settings.workers)
+        else:
+            downloader.df, downloader.df2 = df, df2
+            if settings.engine == "sharded":
+                downloader.process_downloads_sharded(number_of_files, processes=settings.processes, max_workers=settings.workers)
+            elif settings.engine == "async":
+                downloader.process_downloads_async(number_of_files, max_concurrency=settings.max_concurrency, per_host_limit=settings.per_host)
+            else:
+                downloader.process_downloads_threaded(number_of_files, max_workers=settings.workers)
+            downloader.summarize_downloads(number_of_files)
+    finally:
+        if metrics is not None:
+            metrics.close()
+        if prepare.state_store is not None:
+            prepare.state_store.close()
+    return 0
+
+def main(argv=None) -> int:
+    """
+    Entry point of `python cli.py` and `python download_files.py`.
+    """
+    settings = parse_settings(argv)
+    if settings.dry_run:
+        print("Dry run, nothing is downloaded.")
+        print(describe(settings))
+        if not settings.preflight:
+            return 0 # nothing was imported or read
+    return run(settings)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,62 @@
+if __name__ == "__main__": # the command line lives in cli.py; hand over before pandas and requests are imported
+    from cli import main
+    raise SystemExit(main())
+
+import asyncio
+import contextlib
+import errno
 import threading
 import traceback
+import numpy as np
 import pandas as pd
 import requests
 from pathlib import Path
-import glob
 import os
+import shutil
 import time
 import concurrent.futures
+import hashlib
+import heapq
+import itertools
+from collections import deque
+import re
+import signal
+import zlib
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
 
 from prepare import PreparePdfDownloader
 from report_writer import ReportWriter
+from state_store import DownloadStateStore, DONE_STATUSES
+from scheduler import HostScheduler
+from retry_policy import RetryPolicy
+from pdf_validator import PdfValidator
+from blob_store import BlobStore
+from download_governor import DownloadGovernor
+from result_store import ResultStore
+from metrics import TIMED_POOL_CLASSES, aiohttp_trace_config, connection_timings, reset_connection_timings
+
+PDF_MAGIC = b"%PDF-"
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+PDF_LINK_PATTERN = re.compile(rb"""href\s*=\s*["']([^"'#]+?\.pdf(?:\?[^"'#]*)?)["']""", re.IGNORECASE)
+SNIFF_BYTES = 1024 # the PDF header has to start within the first 1024 bytes
+HTML_SCAN_BYTES = 512 * 1024 # how much of an HTML page is searched for a PDF link
+MIN_CHUNK_SIZE = 256 * 1024 # read size for small files and bodies of unknown length
+MAX_CHUNK_SIZE = 4 * 1024 * 1024 # read size for large files
+PREALLOCATE_BYTES = 1024 * 1024 # files at least this large get their disk space reserved up front
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM) # signals that stop a run gracefully
+POLL_SECONDS = 0.5 # how often the dispatcher looks for a stop request while it waits
+CANCELLED = "Cancelled: the run was stopped" # error of a download aborted by a stop; the row stays pending
+DELETE_BATCH = 500 # files one delete task removes
+DELETING_SUFFIX = ".deleting-" # download folders renamed aside for background deletion are called dwn.deleting-<time>-<pid>
 
 class PDFDownloader:
-    def __init__(self, list_path, output_folder, main_col, secondary_col, id_col="BRnum"): # constructor
+    def __init__(self, list_path, output_folder, main_col, secondary_col, id_col="BRnum", report_writer=None,
+                 pool_connections: int = 10, pool_maxsize: int = 10, max_retries=0, state_store=None,
+                 incremental: bool = False, scheduler=None, retry_policy=None, follow_pdf_links: bool = False,
+                 metrics=None, validator=None, blob_store=None, dedup_urls: bool = False, order=None,
+                 governor=None, checkpoint=None, shutdown_timeout: float = 30.0, plan=None): # constructor
         self.list_path = list_path
         self.output_folder = Path(output_folder)
         self.dwn_folder = self.output_folder / "dwn"
@@ -21,18 +65,440 @@ class PDFDownloader:
         self.id_col = id_col
         self.df = None
         self.df2 = None
+        self.report_writer = report_writer if report_writer is not None else ReportWriter()
+        self.state_store = state_store # DownloadStateStore that records the outcome of every download, if any
+        self.incremental = incremental # re-fetch already downloaded files conditionally with their stored validators
+        self.scheduler = scheduler # HostScheduler that rate limits and adapts concurrency per host, if any
+        self.retry_policy = retry_policy # RetryPolicy for transient failures, None for no retries
+        self.follow_pdf_links = follow_pdf_links # download the first PDF linked from an HTML page instead of giving up
+        self.metrics = metrics # Metrics that records timings, bytes, retries, errors and queue depth, if any
+        self.validator = validator # PdfValidator that checks every downloaded file and extracts its metadata, if any
+        self.blob_store = blob_store # BlobStore that keeps identical PDFs once, with <BRnum>.pdf as hardlinks, if any
+        self.dedup_urls = dedup_urls # download a URL shared by several rows only once and link the other rows to it
+        self.order = order # DownloadOrder that selects and sorts the rows to download, None for the first rows in list order
+        self.selected_ids = None # ids the last run selected through `order`, in download order
+        self.governor = governor # DownloadGovernor that caps bandwidth, file size and pauses on a full disk, if any
+        self.checkpoint = checkpoint # RunCheckpoint that records which rows are done, failed or pending, if any
+        self.shutdown_timeout = shutdown_timeout # seconds running downloads may take to finish after a stop request
+        self.plan = plan # DataFrame of `Preflight.plan`: dead rows are skipped and each row starts with its planned column, if any
+        self._stop = threading.Event() # set by a stop request: no new rows are started
+        self._cancel = threading.Event() # set when the running downloads have to be aborted too
+        self._stop_deadline = None
+        self._checkpoint_due = False # set by a finished row when the checkpoint's interval has passed, see `_save_checkpoint_if_due`
+        self.cleanup_thread = None # thread deleting an old download folder after `delete_downloaded_files(background=True)`
+        self.results = None # ResultStore the rows of the current run record their outcome in, written to df2 when the run ends
+        self.report_rows = [] # (BRnum, result, error, extra, url, stats) of finished rows, collected here when there is no report writer
+        self.pool_connections = pool_connections # number of hosts each session keeps a connection pool for
+        self.pool_maxsize = pool_maxsize # number of keep-alive connections kept per host
+        self.max_retries = max_retries # int or urllib3 Retry passed to the HTTPAdapter
+        self._local = threading.local() # holds one pooled session per worker thread
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def _get_session(self) -> requests.Session:
+        """
+        Return the pooled session of the calling thread, creating it on first use.
+
+        Each worker thread gets its own `requests.Session`, so both the main and the secondary
+        URL attempt of a row reuse the same keep-alive connections instead of paying a new TCP and
+        TLS handshake for every file.
+
+        Returns:
+            requests.Session: The session owned by the calling thread.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                    pool_maxsize=self.pool_maxsize,
+                                                    max_retries=self.max_retries)
+            if self.metrics is not None:
+                adapter.poolmanager.pool_classes_by_scheme = TIMED_POOL_CLASSES # new connections record their DNS and connect time
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def close_sessions(self) -> None:
+        """
+        Close every pooled session created by the worker threads and release their connections.
+        """
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+        self._local = threading.local()
+
+    def request_stop(self, cancel: bool = False) -> None:
+        """
+        Stop the running engine: no new row is started, and the running downloads get `shutdown_timeout`
+        seconds to finish before they are aborted. With `cancel`, they are aborted right away.
+
+        Aborted downloads keep their partial file, and their rows are neither reported nor checkpointed as
+        finished, so a resumed run continues them.
+        """
+        if not self._stop.is_set():
+            self._stop_deadline = time.monotonic() + self.shutdown_timeout
+            self._stop.set()
+        if cancel:
+            self._cancel.set()
+
+    def _cancelled(self) -> bool:
+        """
+        Return True if the running downloads have to be aborted, because of a cancel or a passed stop deadline.
+        """
+        if not self._cancel.is_set() and self._stop.is_set() and time.monotonic() >= self._stop_deadline:
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    @contextlib.contextmanager
+    def _stop_on_signals(self):
+        """
+        Turn SIGINT (Ctrl-C) and SIGTERM into a graceful stop while an engine runs; a second signal cancels the
+        running downloads. Signal handlers can only be installed from the main thread, elsewhere only
+        `request_stop` stops the run.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        def handle(signum, frame):
+            if self._stop.is_set():
+                print("Cancelling the running downloads")
+                self.request_stop(cancel=True)
+            else:
+                print(f"Stopping: no new downloads, the running ones get {self.shutdown_timeout:.0f} s to finish. Press Ctrl-C again to cancel them")
+                self.request_stop()
+
+        previous = {signum: signal.signal(signum, handle) for signum in STOP_SIGNALS}
+        try:
+            yield
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _checkpoint_row(self, br_number, result: str) -> None:
+        """
+        Mark a finished row in the checkpoint. When its interval has passed, the checkpoint is only flagged as due;
+        the engine's dispatcher saves it (see `_save_checkpoint_if_due`), so no download worker waits for the disk.
+        """
+        if self.checkpoint is not None and self.checkpoint.mark(br_number, result):
+            self._checkpoint_due = True
+
+    def _save_checkpoint_if_due(self) -> None:
+        """
+        Save the checkpoint if a finished row flagged it as due. Called by the dispatchers of the threaded,
+        streaming and sharded engines; the async engine runs `_save_checkpoint` on an executor thread instead.
+        """
+        if self._checkpoint_due:
+            self._checkpoint_due = False
+            self._save_checkpoint()
+
+    def _save_checkpoint(self) -> None:
+        """
+        Save the checkpoint, after the report has caught up with it, so every row the checkpoint calls
+        finished is in the report.
+        """
+        if self.checkpoint is None:
+            return
+        if self.report_writer is not None:
+            self.report_writer.flush()
+        try:
+            self.checkpoint.save()
+        except OSError as e:
+            print(f"Could not save the checkpoint: {e}")
+
+    def _end_run(self) -> None:
+        """
+        Write the outcomes of the run into `df2`, save the final checkpoint of the run and tell how to continue
+        it if it was stopped. The stop request is cleared, so the next run starts normally.
+        """
+        if self.results is not None and self.df2 is not None:
+            self.results.materialize(self.df2, self.main_col, self.secondary_col) # one write per column for the whole run
+        self.results = None
+        self._checkpoint_due = False
+        self._save_checkpoint()
+        if self._stop.is_set():
+            pending = self.checkpoint.pending() if self.checkpoint is not None else None
+            left = f"{len(pending)} rows are" if pending is not None else "Some rows are"
+            print(f"Stopped. {left} still pending" + (", run again with --resume to continue" if self.checkpoint is not None else ""))
+        self._stop.clear()
+        self._cancel.clear()
+
+    @staticmethod
+    def _part_path(savepath: Path) -> Path:
+        """
+        Return the path of the partial file a download into `savepath` is streamed into.
+        """
+        return savepath.with_name(savepath.name + ".part")
+
+    def _resume_offset(self, url: str, savepath: Path) -> int:
+        """
+        Return how many bytes of an earlier, interrupted download of `url` into `savepath` can be resumed.
+
+        The partial file is only resumed when it was started from the same URL, which is recorded in a
+        small `.part.url` marker next to it. Otherwise the download has to start again from byte zero.
+
+        Args:
+            url (str): the URL that is about to be downloaded
+            savepath (Path): the final path of the PDF file
+
+        Returns:
+            int: The number of bytes already on disk, or 0 if the download must start over.
+        """
+        part_path = self._part_path(savepath)
+        marker = part_path.with_name(part_path.name + ".url")
+        try:
+            if marker.read_text(encoding="utf-8") == url:
+                return part_path.stat().st_size
+        except OSError:
+            pass # no partial file, or no marker for it
+        return 0
+
+    def _open_part(self, url: str, savepath: Path, offset: int):
+        """
+        Open the partial file of `savepath` for writing at `offset`, or truncate it when `offset` is 0.
+
+        The file is not opened in append mode, so writes land at the current position even when the file
+        has been preallocated beyond it.
+        """
+        part_path = self._part_path(savepath)
+        if offset == 0:
+            part_path.with_name(part_path.name + ".url").write_text(url, encoding="utf-8")
+            return open(part_path, "wb")
+        f = open(part_path, "r+b")
+        f.seek(offset)
+        return f
+
+    def _preallocate(self, f, url: str, savepath: Path, offset: int, total: int) -> bool:
+        """
+        Reserve the disk space of a download of known size with `posix_fallocate`, where the OS supports it.
+
+        Preallocation avoids fragmenting large files and fails early when the disk is full. It also makes the
+        partial file as large as the finished one, so its URL marker is flagged until `_release_preallocation`
+        cuts the file back to the bytes really written; a partial file left flagged by a crash is not resumed.
+
+        Returns:
+            bool: True if the space was reserved.
+        """
+        if not hasattr(os, "posix_fallocate") or total - offset < PREALLOCATE_BYTES:
+            return False
+        marker = self._part_path(savepath).with_name(self._part_path(savepath).name + ".url")
+        marker.write_text(url + "\npreallocated", encoding="utf-8") # _resume_offset only trusts a marker that is exactly the URL
+        try:
+            os.posix_fallocate(f.fileno(), offset, total - offset)
+        except OSError:
+            marker.write_text(url, encoding="utf-8") # e.g. a file system without fallocate, write without it
+            return False
+        return True
+
+    def _release_preallocation(self, f, url: str, savepath: Path, size: int) -> None:
+        """
+        Cut a preallocated partial file back to the `size` bytes written and make it resumable again.
+        """
+        f.truncate(size)
+        marker = self._part_path(savepath).with_name(self._part_path(savepath).name + ".url")
+        marker.write_text(url, encoding="utf-8")
+
+    @staticmethod
+    def _chunk_size(length: int) -> int:
+        """
+        Return the read size for a body of `length` bytes: about a sixteenth of it, between 256 KB and 4 MB.
+        """
+        size = MIN_CHUNK_SIZE
+        while size < MAX_CHUNK_SIZE and size * 16 < (length or 0):
+            size *= 2
+        return size
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _body_errors():
+        """
+        Raise urllib3 errors from reading `response.raw` as the requests exceptions `iter_content` would raise.
+        """
+        try:
+            yield
+        except ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        except DecodeError as e:
+            raise requests.exceptions.ContentDecodingError(e)
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ConnectionError(e)
+
+    def _buffer(self, size: int) -> memoryview:
+        """
+        Return a `size`-byte view of the read buffer of the calling thread, which is reused for every download.
+        """
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or len(buffer) < size:
+            buffer = bytearray(size)
+            self._local.buffer = buffer
+        return memoryview(buffer)[:size]
+
+    def _finish_part(self, savepath: Path) -> None:
+        """
+        Atomically move a completed partial file into place and remove its URL marker.
+        """
+        part_path = self._part_path(savepath)
+        os.replace(part_path, savepath)
+        try:
+            os.remove(part_path.with_name(part_path.name + ".url"))
+        except FileNotFoundError:
+            pass
+
+    def _discard_part(self, savepath: Path) -> None:
+        """
+        Remove the partial file of `savepath` and its URL marker, if they exist.
+        """
+        part_path = self._part_path(savepath)
+        for path in (part_path, part_path.with_name(part_path.name + ".url")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _too_large(self, size: int) -> bool:
+        """
+        Return True if the governor rejects a file of `size` bytes.
+        """
+        return self.governor is not None and self.governor.too_large(size)
+
+    @staticmethod
+    def _range_matches(content_range: str, offset: int) -> bool:
+        """
+        Check that a `Content-Range` header (e.g. "bytes 100-199/200") starts at `offset`.
+        """
+        try:
+            return int(content_range.split()[1].split("-")[0]) == offset
+        except (AttributeError, IndexError, ValueError):
+            return False
+
+    def _hash_part(self, savepath: Path, offset: int):
+        """
+        Return a SHA-256 hasher seeded with the first `offset` bytes of the partial file of `savepath`.
+        """
+        hasher = hashlib.sha256()
+        if offset:
+            with open(self._part_path(savepath), "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(block)
+        return hasher
+
+    def _validators_for(self, br_number, url: str, savepath: Path) -> dict:
+        """
+        Return the stored `ETag`/`Last-Modified` validators of a row for a conditional request.
+
+        Validators are only used in incremental mode, when the file is still on disk and was
+        downloaded from the same URL.
 
-    
-    def download_pdf(self, url: str, savepath: Path) -> tuple[bool, str]:
+        Args:
+            br_number: The id of the row.
+            url (str): The URL that is about to be downloaded.
+            savepath (Path): The path of the downloaded file.
+
+        Returns:
+            dict: {"etag": ..., "last_modified": ...}, or None if the file has to be downloaded unconditionally.
+        """
+        if not self.incremental or self.state_store is None or not savepath.exists():
+            return None
+        state = self.state_store.get(str(br_number))
+        if state is None or state["url"] != url or state["status"] not in DONE_STATUSES:
+            return None
+        if not state["etag"] and not state["last_modified"]:
+            return None
+        return {"etag": state["etag"], "last_modified": state["last_modified"]}
+
+    def _record_state(self, br_number, result: str, url: str, info: dict, error: str = "") -> None:
+        """
+        Record the outcome of a row in the state store, if the downloader has one.
+
+        A row that was not modified since the last run keeps the size, hash and validators
+        stored for it, only its status changes to "unchanged".
+
+        Args:
+            br_number: The id of the row.
+            result (str): The report result of the row ("Downloaded", "Unchanged", "Not a PDF", "Corrupt PDF" or "Not downloaded").
+            url (str): The URL of the last attempt.
+            info (dict): The metadata `download_pdf` collected during the last attempt.
+            error (str): The error message of a failed row.
+        """
+        if self.state_store is None:
+            return
+        if result == "Unchanged":
+            previous = self.state_store.get(str(br_number)) or {}
+            info = {**{k: previous.get(k) for k in ("size", "sha256", "etag", "last_modified", "pages", "title", "producer")},
+                    **{k: v for k, v in info.items() if v is not None}}
+        status = {"Downloaded": "downloaded", "Unchanged": "unchanged", "Not a PDF": "not_pdf", "Corrupt PDF": "corrupt"}.get(result, "failed")
+        self.state_store.record(str(br_number), status, url=url, size=info.get("size"), sha256=info.get("sha256"),
+                                etag=info.get("etag"), last_modified=info.get("last_modified"),
+                                http_status=info.get("http_status"), error=error, pages=info.get("pages"),
+                                title=info.get("title"), producer=info.get("producer"))
+
+    @staticmethod
+    def _request_headers(offset: int, validators: dict) -> dict:
+        """
+        Build the extra request headers for resuming at `offset` and for a conditional request.
+        """
+        headers = {}
+        if offset:
+            headers.update({"Range": f"bytes={offset}-", "Accept-Encoding": "identity"})
+        elif validators: # a partial download is never conditional, it is finished first
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        return headers or None
+
+    @staticmethod
+    def _content_type(headers) -> str:
+        """
+        Return the media type of a `Content-Type` header without its parameters, lower-cased.
+        """
+        return (headers.get("content-type") or "").split(";")[0].strip().lower()
+
+    @staticmethod
+    def _find_pdf_link(html: bytes, base_url: str) -> str:
+        """
+        Return the absolute URL of the first link to a .pdf in an HTML page, or None if there is none.
+        """
+        match = PDF_LINK_PATTERN.search(html)
+        if match is None:
+            return None
+        return urljoin(base_url, match.group(1).decode("utf-8", errors="ignore").strip())
+
+    def download_pdf(self, url: str, savepath: Path, info: dict = None, validators: dict = None) -> tuple[bool, str]:
         """
         Download a PDF file from a URL and save it to a specified path.
 
-        This method attempts to make a GET request to the provided URL. If the request is successful (HTTP status code 200),
-        it writes the content to the specified save path. If the request fails, it returns an error message.
+        This method attempts to make a GET request to the provided URL through the pooled session of the calling thread.
+        If the request is successful (HTTP status code 200), it writes the content to the specified save path.
+        If the request fails, it returns an error message.
+
+        The content is streamed into `<savepath>.part` and only renamed to `savepath` once the whole file has
+        arrived, so an interrupted transfer never looks like a finished PDF. If a partial file from an earlier
+        attempt at the same URL exists, the download is resumed with a `Range` request; servers that ignore the
+        range answer with 200 and the file is downloaded again from the start.
+
+        When `validators` are given, the request is made conditional with `If-None-Match`/`If-Modified-Since`.
+        A 304 response leaves the existing file untouched, counts as a success and sets `info["not_modified"]`.
+        Every attempt also puts its timings into `info`: "dns" and "connect" when a new connection was opened,
+        "ttfb" until the response headers arrived, "transfer" for the body, and the "bytes" it received.
+        On failure `info["retryable"]` tells transient failures (timeouts, connection and chunked-encoding errors,
+        incomplete bodies, 408/429/5xx) apart from permanent ones (e.g. 404, invalid URLs, disk errors).
+
+        Before anything is written, the response is checked to really be a PDF: a body without `%PDF-` in its
+        first SNIFF_BYTES aborts the download and sets `info["not_pdf"]`, whatever the `Content-Type` says. When
+        `follow_pdf_links` is on, HTML pages are read further and their first link to a .pdf file, if any, is
+        returned in `info["pdf_link"]`.
 
         Args:
             url (str): the URL of the PDF file to download
             savepath (Path): the path where the PDF file should be saved
+            info (dict): optional dict that is filled with the HTTP status, size, SHA-256 and the
+                `ETag`/`Last-Modified` validators of the download, for the state store
+            validators (dict): optional {"etag": ..., "last_modified": ...} from an earlier download of the same URL
 
         Returns:
           Tuple: (success: bool, error_message: str).
@@ -47,46 +513,596 @@ class PDFDownloader:
             Exception: For any other unexpected errors.
 
         """
+        info = {} if info is None else info
+        if self._cancelled():
+            info.update(cancelled=True, retryable=False)
+            return False, CANCELLED
         try:
-            response = requests.get(url, stream=True, timeout=10) # make a GET request
+            savepath = Path(savepath)
+            offset = self._resume_offset(url, savepath)
+            headers = self._request_headers(offset, validators)
+
+            reset_connection_timings()
+            with self._get_session().get(url, stream=True, timeout=10, headers=headers) as response: # make a GET request, the connection goes back to the pool on exit
+                transfer_start = time.perf_counter()
+                info["http_status"] = response.status_code
+                info["ttfb"] = response.elapsed.total_seconds() # time until the response headers arrived
+                info.update(connection_timings()) # empty if a pooled connection was reused
 
-            if response.status_code != 200:
-                return False, f"Failed to download: {response.status_code} - {response.reason}"
+                if response.status_code == 304 and validators: # unchanged since the last run, keep the file we have
+                    info["not_modified"] = True
+                    return True, ""
 
-            total = int(response.headers.get('content-length', 0)) # total file size to download in bytes
-            downloaded = 0
+                if offset and (response.status_code == 416 or (response.status_code == 206 and not self._range_matches(response.headers.get("content-range"), offset))):
+                    os.remove(self._part_path(savepath)) # the partial file does not fit the remote file any more, start over
+                    return self.download_pdf(url, savepath, info, validators)
+                if response.status_code not in (200, 206) or (response.status_code == 206 and not offset):
+                    info["retryable"] = RetryPolicy.is_retryable_status(response.status_code)
+                    return False, f"Failed to download: {response.status_code} - {response.reason}"
+                if response.status_code == 200:
+                    offset = 0 # the server ignored the range, start over
 
-            with open(savepath, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192): # downloads 8KB chunks
-                    if chunk:  # filter out keep-alive chunks
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        print(f"Downloaded {downloaded}/{total} bytes", end="\r")
+                total = offset + int(response.headers.get('content-length', 0)) # total file size to download in bytes
+                if self._too_large(total):
+                    info["retryable"] = False
+                    return False, f"File too large: {total} bytes, the limit is {self.governor.max_file_size}"
+                downloaded = offset
+                info["bytes"] = 0
+                response.raw.decode_content = True # undo gzip/deflate like iter_content would
+                head = b""
+
+                if not offset: # a resumed download was checked when it started
+                    content_type = self._content_type(response.headers)
+                    with self._body_errors():
+                        head = response.raw.read(SNIFF_BYTES)
+                    if PDF_MAGIC not in head: # the body decides, a PDF sent as text/html is still a PDF
+                        info.update(not_pdf=True, retryable=False)
+                        if self.follow_pdf_links and (content_type in HTML_CONTENT_TYPES or head.lstrip()[:1] == b"<"):
+                            with self._body_errors():
+                                head += response.raw.read(HTML_SCAN_BYTES - len(head)) # only read further to find a link
+                            info["pdf_link"] = self._find_pdf_link(head, response.url)
+                        return False, f"Not a PDF: {content_type or 'no content type'}"
+
+                hasher = self._hash_part(savepath, offset)
+
+                buffer = self._buffer(self._chunk_size(total - offset))
+                with self._open_part(url, savepath, offset) as f:
+                    preallocated = self._preallocate(f, url, savepath, offset, total)
+                    try:
+                        f.write(head)
+                        hasher.update(head)
+                        downloaded += len(head)
+                        with self._body_errors():
+                            while True:
+                                n = response.raw.readinto(buffer) # large reads into one reused buffer, no bytes object per chunk
+                                if not n:
+                                    break
+                                f.write(buffer[:n])
+                                hasher.update(buffer[:n])
+                                downloaded += n
+                                if self.governor is not None:
+                                    if self.governor.too_large(downloaded): # no or a wrong Content-Length
+                                        break
+                                    self.governor.throttle(n)
+                                if self._cancelled():
+                                    info["cancelled"] = True
+                                    break
+                    finally:
+                        if preallocated:
+                            self._release_preallocation(f, url, savepath, downloaded)
+                info.update(bytes=downloaded - offset, transfer=time.perf_counter() - transfer_start)
+
+                if info.get("cancelled"):
+                    info["retryable"] = False
+                    return False, CANCELLED # the partial file is kept for the resumed run
+
+                if self._too_large(downloaded):
+                    self._discard_part(savepath)
+                    info["retryable"] = False
+                    return False, f"File too large: more than {self.governor.max_file_size} bytes"
+
+                if total > offset and downloaded < total:
+                    info["retryable"] = True # the partial file is kept, the retry resumes it
+                    return False, f"Incomplete download: {downloaded}/{total} bytes"
+                self._finish_part(savepath)
+                info.update(size=downloaded, sha256=hasher.hexdigest(),
+                            etag=response.headers.get("etag"), last_modified=response.headers.get("last-modified"))
 
             return True, ""
 
         except requests.exceptions.Timeout as te:
+            info["retryable"] = True
             return False, f"Request timed out: {str(te)}"
         except requests.exceptions.ConnectionError as ce:
+            info["retryable"] = True
             return False, f"Connection error: {str(ce)}"
         except requests.exceptions.HTTPError as he:
+            info["retryable"] = he.response is not None and RetryPolicy.is_retryable_status(he.response.status_code)
             return False, f"HTTP error: {str(he)}"
         except requests.exceptions.ChunkedEncodingError as ce:
+            info["retryable"] = True
             return False, f"Chunked encoding error: {str(ce)}"
         except IOError as ioe:
+            info["retryable"] = self._disk_full(ioe)
             return False, f"I/O error: {str(ioe)}"
         except requests.exceptions.RequestException as re:
             return False, f"Request error: {str(re)}"
         except Exception as e:
             return False, f"Unexpected error: {str(e)}"
 
+    def _disk_full(self, error: OSError) -> bool:
+        """
+        Return True for a disk-full error while the governor watches free space, so the download is retried
+        (and resumed) once the governor lets downloads start again; other I/O errors are permanent.
+        """
+        return error.errno == errno.ENOSPC and self.governor is not None and self.governor.min_free_bytes is not None
+
+    def _fetch(self, url: str, savepath: Path, info: dict, validators: dict = None, follow_link: bool = True) -> tuple[bool, str]:
+        """
+        Call `download_pdf`, holding a slot of the URL's host in the scheduler if the downloader has one.
+
+        The scheduler is told how long the server took to answer and whether it throttled or timed out,
+        so it can adapt the host's concurrency. If the URL turned out to be an HTML page that links to a PDF
+        and `follow_pdf_links` is on, the linked PDF is downloaded instead and `info["url"]` is set to it.
+        Every request is recorded in the metrics, if the downloader has them.
+        """
+        if self.scheduler is None:
+            success, error = self.download_pdf(url, savepath, info, validators)
+        else:
+            host = self.scheduler.host_of(url)
+            self.scheduler.acquire(host)
+            start = time.perf_counter()
+            success, error = False, ""
+            try:
+                success, error = self.download_pdf(url, savepath, info, validators)
+            finally: # an exception must not keep the host's slot
+                self.scheduler.release(host, info.get("ttfb", time.perf_counter() - start), info.get("http_status"),
+                                       timed_out=error.startswith("Request timed out"))
+        if self.metrics is not None:
+            self.metrics.record_attempt(Path(savepath).stem, url, info, success, error)
+
+        link = info.get("pdf_link")
+        if not success and link and link != url and follow_link and self.follow_pdf_links:
+            print(f"Following PDF link {link} found on {url}")
+            link_info = {}
+            if self._fetch(link, savepath, link_info, follow_link=False)[0]:
+                info.clear()
+                info.update(link_info, url=link)
+                return True, ""
+        return success, error
+
+    def _should_retry(self, br_number, url: str, info: dict, attempt: int) -> bool:
+        """
+        Return True if a failed attempt is transient and the retry policy allows another one.
+        """
+        retry = self.retry_policy is not None and info.get("retryable", False) and self.retry_policy.allow(attempt)
+        if retry and self.metrics is not None:
+            self.metrics.record_retry(br_number, url, attempt)
+        return retry
+
+    def _finish_row(self, br_number, result: str, url: str, info: dict, error: str) -> tuple[str, str, dict]:
+        """
+        Record the final outcome of a row in the state store, the result store and the metrics, and queue it for the report.
+
+        With a validator, the report row also carries the page count, title and producer of the PDF.
+        With a blob store, a downloaded file is moved into it and replaced by a hardlink.
+        """
+        if info.get("not_modified"):
+            result = "Unchanged" # the server answered 304 to the conditional request
+        elif info.get("not_pdf") and result == "Not downloaded":
+            result = "Not a PDF" # the last URL answered with an HTML page or another non-PDF body
+        if result == "Downloaded" and self.blob_store is not None and info.get("sha256"):
+            self._add_blob(br_number, info)
+        self._record_state(br_number, result, info.get("url", url), info, error)
+        extra = tuple(info.get(key) or "" for key in ("pages", "title", "producer")) if self.validator is not None else ()
+        seconds = (info.get("ttfb") or 0.0) + (info.get("transfer") or 0.0) if "ttfb" in info else None
+        stats = (info.get("http_status"), info.get("size") or info.get("bytes"), seconds)
+        if self.results is not None:
+            self.results.record(br_number, result, url, error, *stats) # its own slot, no lock and no DataFrame write
+        if self.report_writer is not None:
+            self.report_writer.submit(str(br_number), result, extra) # only queues the row, the writer thread does the I/O
+        else:
+            self.report_rows.append((str(br_number), result, error, extra, url, stats)) # a shard process, the parent writes the report
+        if self.metrics is not None:
+            self.metrics.record_file(br_number, result, info.get("url", url), error)
+        self._checkpoint_row(br_number, result) # after the report row was queued, see `_save_checkpoint`
+        return result, error, None
+
+    def _add_blob(self, br_number, info: dict) -> None:
+        """
+        Move the file of a downloaded row into the blob store; a duplicate of an earlier file only costs a link.
+        """
+        try:
+            duplicate = self.blob_store.add(self.dwn_folder / f"{br_number}.pdf", info["sha256"])
+        except OSError as e:
+            print(f"Could not add {br_number} to the blob store: {e}") # the file itself is fine, keep it as it is
+            return
+        if duplicate and self.metrics is not None:
+            self.metrics.inc("duplicate_files_total")
+            self.metrics.inc("duplicate_bytes_total", info.get("size") or 0)
+
+    @staticmethod
+    def _normalize_url(url) -> str:
+        """
+        Return a URL in a form that is the same for spellings of it that fetch the same resource.
+
+        The scheme and host are lower-cased, default ports, fragments and surrounding whitespace are dropped
+        and an empty path becomes "/". The path and query are kept as they are, since servers may treat them
+        case-sensitively.
+        """
+        try:
+            parts = urlsplit(str(url).strip())
+            host = (parts.hostname or "").lower()
+            if parts.port is not None and (parts.scheme.lower(), parts.port) not in (("http", 80), ("https", 443)):
+                host = f"{host}:{parts.port}"
+            return urlunsplit((parts.scheme.lower(), host, parts.path or "/", parts.query, ""))
+        except ValueError:
+            return str(url).strip()
+
+    def _copy_row(self, leader: str, row: tuple) -> tuple[str, str, dict]:
+        """
+        Finish a row whose main URL another row (`leader`) already downloaded, by linking to the leader's file.
+        """
+        br_number, url_main, _ = row
+        source = self.dwn_folder / f"{leader}.pdf"
+        state = self.state_store.get(str(leader)) if self.state_store is not None else None
+        info = {k: state[k] for k in ("size", "sha256", "etag", "last_modified", "pages", "title", "producer")} if state else {}
+        try:
+            info.setdefault("size", source.stat().st_size)
+            BlobStore.link(source, self.dwn_folder / f"{br_number}.pdf")
+        except OSError as e:
+            return self._finish_row(br_number, "Not downloaded", url_main, {}, f"I/O error: {e}")
+        print(f"{br_number} has the same URL as {leader}, linked to its file")
+        if self.metrics is not None:
+            self.metrics.inc("deduplicated_urls_total")
+        return self._finish_row(br_number, "Downloaded", url_main, info, "")
+
+    def _downloaded(self, br_number, url: str, info: dict, main_error: str, job: dict) -> tuple[str, str, dict]:
+        """
+        Finish a row whose file was downloaded, or hand it back as a validation job if the downloader has a validator.
+        """
+        if self.validator is None or info.get("not_modified"): # an unchanged file was validated when it was downloaded
+            return self._finish_row(br_number, "Downloaded", url, info, main_error)
+        return "Validate", main_error, {"stage": "validate", "url": url, "info": info, "main_error": main_error,
+                                        "requeues": job.get("requeues", 0)}
+
+    def _after_validation(self, br_number, job: dict, verdict: dict) -> tuple[str, str, dict]:
+        """
+        Finish a validated row, or requeue it when its file turned out to be corrupt.
+
+        A valid file is recorded as "Downloaded" with its page count, title and producer; a warning of the
+        validator, such as a wrong startxref offset that PyPDF2 repaired, is only printed. A corrupt or truncated
+        file is deleted and, while the validator allows more requeues, handed back as a job that downloads the
+        row again from its main URL; after that it is recorded as "Corrupt PDF".
+
+        Args:
+            br_number: The id of the row.
+            job (dict): The validation job returned by `download_row`.
+            verdict (dict): The result of `PdfValidator.validate`.
+
+        Returns:
+            Tuple: (result: str, error_message: str, job: dict), like `download_row`; the result is "Retry" for a requeued row.
+        """
+        info = {**job["info"], **{key: verdict[key] for key in ("pages", "title", "producer")}}
+        if verdict["valid"]:
+            if verdict.get("warning"):
+                print(f"{br_number} is readable, but {verdict['warning']}")
+            return self._finish_row(br_number, "Downloaded", job["url"], info, job["main_error"])
+
+        error = f"Corrupt PDF: {verdict['error']}"
+        try:
+            os.remove(self.dwn_folder / f"{br_number}.pdf") # never leave a corrupt file that looks like a download
+        except FileNotFoundError:
+            pass
+        if self.metrics is not None:
+            self.metrics.inc("corrupt_total")
+        if job["requeues"] < self.validator.max_requeues:
+            print(f"{br_number} is corrupt ({verdict['error']}), downloading it again")
+            return "Retry", error, {"stage": "main", "attempt": 1, "main_error": "", "requeues": job["requeues"] + 1}
+        return self._finish_row(br_number, "Corrupt PDF", job["url"], info, error)
+
+    def download_row(self, br_number, url_main: str, url_secondary: str, job: dict = None) -> tuple[str, str, dict]:
+        """
+        Download the PDF of one row, falling back to the secondary URL if the main URL fails.
+
+        The outcome is recorded in the state store and queued for the report. This is the unit of
+        work of the threaded engines; it does not touch the DataFrame, so it can also be fed rows
+        straight from `PreparePdfDownloader.iter_filtered_batches`.
+
+        A transient failure is not retried in place. If the retry policy allows it, the row is handed back
+        as a retry job instead, which the engine queues again after the backoff delay, so a worker never
+        sleeps. A URL that fails permanently, or runs out of retries, falls through to the next stage.
+        With a validator, a downloaded file is handed back as a validation job instead of being recorded,
+        and the engine finishes the row with `_after_validation`.
+
+        Args:
+            br_number: The id of the row.
+            url_main (str): The URL from the main column.
+            url_secondary (str): The URL from the secondary column, None if there is none worth trying (see `_planned_rows`).
+            job (dict): The retry job returned by an earlier call for this row, None for the first attempt.
+
+        Returns:
+            Tuple: (result: str, error_message: str, job: dict). The result is "Downloaded", "Unchanged",
+            "Not a PDF", "Not downloaded", "Retry" or "Validate"; only "Retry" and "Validate" come with a job.
+            After a stop request it is "Cancelled" for a row that was not started or was aborted; such a row
+            is not recorded anywhere. The error message is the one of the
+            main URL if only the secondary URL worked, and the one of the secondary URL if both failed.
+        """
+        job = job or {"stage": "main", "attempt": 1, "main_error": "", "requeues": 0}
+        savefile = self.dwn_folder / f"{br_number}.pdf"
+        if self._stop.is_set():
+            return "Cancelled", CANCELLED, None # not started before the stop, left pending
+
+        if job["stage"] == "main":
+            print(f"Downloading {br_number} from {url_main} ...")
+            info = {}
+            success, error = self._fetch(url_main, savefile, info, self._validators_for(br_number, url_main, savefile))
+            if success:
+                return self._downloaded(br_number, url_main, info, "", job) # main download succeeded
+            if info.get("cancelled"):
+                return "Cancelled", error, None
+            if self._should_retry(br_number, url_main, info, job["attempt"]):
+                return "Retry", error, {**job, "attempt": job["attempt"] + 1}
+            if url_secondary is None:
+                return self._finish_row(br_number, "Not downloaded", url_main, info, error) # no fallback left
+            job = {**job, "stage": "secondary", "attempt": 1, "main_error": error}
+
+        info = {}
+        success2, error2 = self._fetch(url_secondary, savefile, info, self._validators_for(br_number, url_secondary, savefile))
+        if success2:
+            return self._downloaded(br_number, url_secondary, info, job["main_error"], job) # secondary download succeeded
+        if info.get("cancelled"):
+            return "Cancelled", error2, None
+        if self._should_retry(br_number, url_secondary, info, job["attempt"]):
+            return "Retry", error2, {**job, "attempt": job["attempt"] + 1}
+        return self._finish_row(br_number, "Not downloaded", url_secondary, info, error2) # both downloads failed
+
+    def _run_rows(self, rows, max_workers: int, max_pending: int = None, on_done=None) -> int:
+        """
+        Run `download_row` for every row on a thread pool, with retries deferred to the back of the queue.
+
+        At most `max_pending` rows are submitted at a time, so `rows` can be a lazy iterator. A row that comes
+        back as a retry job waits in a delay queue for its backoff and is then submitted again; due retries are
+        submitted before new rows.
+
+        With a validator, downloaded files are validated on a separate pool of `validator.workers` threads while
+        the downloads go on. No new rows are started while `validator.queue_size` files wait for validation,
+        and rows whose file turned out corrupt are queued again like retries.
+        With a governor, no row or retry is started while the disk is short of free space.
+
+        After a stop request (see `request_stop`) no row or retry is started any more; the dispatcher waits for
+        the running rows, which are aborted once the shutdown timeout has passed, and returns. Rows that were
+        not finished are left pending.
+
+        With `dedup_urls`, a row whose normalized main URL is already being downloaded by another row waits for
+        that row instead of being submitted. If the other row got its file from that URL, the waiting row is linked
+        to it without a request; otherwise it is downloaded normally.
+
+        Args:
+            rows (Iterable[tuple]): (BRnum, main_url, secondary_url) rows.
+            max_workers (int): Maximum number of threads for concurrent downloads.
+            max_pending (int): Maximum number of rows submitted but not finished. Default is 2 * max_workers.
+            on_done (Callable): Called on this thread as on_done(br_number, result, error) when a row is final.
+
+        Returns:
+            int: The number of rows processed.
+        """
+        rows = iter(rows)
+        max_pending = max_pending or 2 * max_workers
+        max_validating = self.validator.queue_size if self.validator is not None else 0
+        delayed = [] # heap of (ready_at, sequence, row, job)
+        sequence = itertools.count()
+        futures = {}
+        validating = {} # validation future -> (row, job)
+        url_leaders = {} # normalized main URL -> BRnum of the row downloading it
+        waiting = {} # normalized main URL -> rows waiting for its leader
+        fetched_urls = {} # normalized main URL -> BRnum of the row that downloaded it
+        exhausted = False
+        processed = 0
+
+        def complete(row, result, error):
+            nonlocal processed
+            processed += 1
+            if on_done is not None:
+                on_done(row[0], result, error)
+            if not self.dedup_urls:
+                return
+            key = self._normalize_url(row[1])
+            if url_leaders.get(key) != row[0]:
+                return
+            del url_leaders[key]
+            if result == "Downloaded" and not error: # the main URL worked
+                fetched_urls[key] = row[0]
+            for follower in waiting.pop(key, []):
+                if key in fetched_urls:
+                    complete(follower, *self._copy_row(row[0], follower)[:2])
+                else:
+                    heapq.heappush(delayed, (time.monotonic(), next(sequence), follower, None)) # download it after all
+
+        def download_task(row, job):
+            try:
+                return self.download_row(*row, job=job)
+            except Exception as e:
+                print(f"Unexpected error for {row[0]}: {traceback.format_exc()}")
+                return self._finish_row(row[0], "Not downloaded", None, {}, f"Unexpected error: {e}")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.validator.workers if self.validator else 1) as validation_pool: # starts no thread unless a file is validated
+            while True:
+                self._save_checkpoint_if_due() # the report flush and the checkpoint write happen here, not on the workers
+                stopping = self._stop.is_set()
+                if stopping:
+                    self._cancelled() # aborts the running downloads once the deadline has passed
+                paused = self.governor is not None and not self.governor.has_space(self.dwn_folder)
+                while not stopping and not paused and len(futures) < max_pending and (self.validator is None or len(validating) < max_validating):
+                    if delayed and delayed[0][0] <= time.monotonic():
+                        _, _, row, job = heapq.heappop(delayed)
+                    elif not exhausted:
+                        row = next(rows, None)
+                        if row is None:
+                            exhausted = True
+                            continue
+                        job = None
+                        if self.dedup_urls:
+                            key = self._normalize_url(row[1])
+                            if key in fetched_urls:
+                                complete(row, *self._copy_row(fetched_urls[key], row)[:2])
+                                continue
+                            if key in url_leaders:
+                                waiting.setdefault(key, []).append(row)
+                                continue
+                            url_leaders[key] = row[0]
+                    else:
+                        break
+                    futures[executor.submit(download_task, row, job)] = row
+                if self.metrics is not None:
+                    self.metrics.set_gauge("queue_depth", len(futures)) # rows submitted but not finished
+                    self.metrics.set_gauge("retry_queue_depth", len(delayed)) # rows waiting for their backoff
+                    self.metrics.set_gauge("validation_queue_depth", len(validating)) # files waiting for validation
+
+                if not futures and not validating and (stopping or (not delayed and exhausted)):
+                    break
+                timeout = max(0.0, delayed[0][0] - time.monotonic()) if delayed else None
+                if paused:
+                    timeout = min(timeout, self.governor.check_interval) if timeout is not None else self.governor.check_interval
+                timeout = min(timeout, POLL_SECONDS) if timeout is not None else POLL_SECONDS # notice a stop request
+                if not futures and not validating:
+                    time.sleep(timeout) # only retries are left and none is due yet, or the disk is full
+                    continue
+
+                done, _ = concurrent.futures.wait([*futures, *validating], timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in validating:
+                        row, job = validating.pop(future)
+                        try:
+                            verdict = future.result()
+                        except Exception as e:
+                            verdict = {"valid": False, "error": f"validation failed: {e}", "warning": "", "pages": None, "title": None, "producer": None}
+                        result, error, job = self._after_validation(row[0], job, verdict)
+                    else:
+                        row = futures.pop(future)
+                        result, error, job = future.result()
+                        if result == "Cancelled":
+                            continue # stays pending
+                        if result == "Validate":
+                            validating[validation_pool.submit(self.validator.validate, self.dwn_folder / f"{row[0]}.pdf")] = (row, job)
+                            continue
+                    if job is not None:
+                        delay = self.retry_policy.delay(job["attempt"] - 1) if job["attempt"] > 1 else 0.0 # a requeued corrupt file goes again right away
+                        heapq.heappush(delayed, (time.monotonic() + delay, next(sequence), row, job))
+                        continue
+                    complete(row, result, error)
+        return processed
+
+    def _selected_rows(self, number_of_files: int) -> pd.DataFrame:
+        """
+        Return the rows of `df2` a run downloads: the first `number_of_files` rows, or the rows `order` selects.
+
+        Sizes recorded by earlier runs are taken from the state store when the order sorts by size, and
+        the sizes the preflight saw for the other rows if the downloader has a plan.
+        A result store with a slot for every selected row is set up for the run (see `results`).
+        With a checkpoint, the selection is recorded in it, and rows it already has a final result for are
+        left out. A checkpoint loaded from an earlier run keeps that run's selection and order, so a resumed
+        run continues exactly where it stopped.
+
+        Raises:
+            KeyError: If a column the order needs is missing.
+        """
+        pending = self.checkpoint.pending() if self.checkpoint is not None else None
+        if pending is not None:
+            position = {br_number: i for i, br_number in enumerate(pending)}
+            ids = self.df2.index.astype(str)
+            rows = self.df2[ids.isin(position)]
+            rows = rows.iloc[np.argsort(rows.index.astype(str).map(position).to_numpy(), kind="stable")]
+        elif self.order is None:
+            rows = self.df2.iloc[:number_of_files]
+        else:
+            known_sizes = {}
+            if self.order.size is not None and self.plan is not None:
+                sizes = self.plan["size"].dropna()
+                known_sizes.update(zip(sizes.index.astype(str), sizes)) # Content-Length seen by the preflight
+            if self.order.size is not None and self.state_store is not None:
+                known_sizes.update(self.state_store.sizes()) # sizes of files downloaded before win
+            rows = self.order.select(self.df2, number_of_files, self.main_col, known_sizes)
+            self.selected_ids = rows.index
+        if self.checkpoint is not None:
+            self.checkpoint.begin(rows.index)
+            rows = rows.loc[[not self.checkpoint.is_finished(br_number) for br_number in rows.index]]
+        self.results = ResultStore(rows.index, rows[self.main_col].to_numpy())
+        return rows
+
+    def _planned_rows(self, selected: pd.DataFrame) -> tuple[list, list]:
+        """
+        Return the (BRnum, first_url, second_url) rows to download and the rows the plan found dead.
+
+        Without a plan every row starts with its main URL. With one, a row the preflight found better served
+        by its secondary URL starts with that one and falls back to the main URL. A URL the plan marked dead is
+        never requested: it is not a fallback (second_url is None), and a row whose URLs are both gone is
+        returned as (BRnum, secondary_url, error) for `_skip_dead`, so it costs no request.
+
+        Raises:
+            KeyError: If a URL column is missing.
+        """
+        rows = list(zip(selected.index, selected[self.main_col], selected[self.secondary_col]))
+        if self.plan is None:
+            return rows, []
+        no_flags = pd.Series(False, index=self.plan.index)
+        plan = dict(zip(self.plan.index.astype(str), zip(self.plan["first"], self.plan["dead"], self.plan["status"],
+                                                         self.plan.get("main_dead", no_flags), self.plan.get("secondary_dead", no_flags))))
+        planned, dead = [], []
+        for br_number, url_main, url_secondary in rows:
+            first, is_dead, status, main_dead, secondary_dead = plan.get(str(br_number), (self.main_col, False, 0, False, False))
+            if is_dead:
+                dead.append((br_number, url_secondary, f"Failed to download: {status or 'no URL'} (preflight)"))
+            elif first == self.secondary_col:
+                planned.append((br_number, url_secondary, None if main_dead else url_main))
+            else:
+                planned.append((br_number, url_main, None if secondary_dead else url_secondary))
+        return planned, dead
+
+    def _skip_dead(self, dead: list) -> None:
+        """
+        Finish the rows of `_planned_rows` whose URLs are dead as "Not downloaded", without a request.
+        """
+        for br_number, url, error in dead:
+            self._finish_row(br_number, "Not downloaded", url, {}, error)
+        if dead:
+            print(f"Skipped {len(dead)} rows whose URLs the preflight found dead")
+
+    def _report_columns(self) -> tuple:
+        """
+        Return the report columns after Name and Result: the PDF metadata if files are validated, none otherwise.
+        """
+        return ("Pages", "Title", "Producer") if self.validator is not None else ()
+
+    def _observe_run(self, engine: str, seconds: float) -> None:
+        """
+        Record the duration of a whole run and flush the metrics exporters, if the downloader has metrics.
+        """
+        if self.metrics is not None:
+            self.metrics.observe("run_seconds", seconds, engine=engine)
+            self.metrics.flush()
+
     def process_downloads_threaded(self, number_of_files: int = 10, max_workers: int = 4) -> None:
         """
         Download multiple PDF files concurrently using multithreading.
 
         Attempts to download up to `number_of_files` PDFs from the DataFrame using ThreadPoolExecutor.
         If the download from the main URL fails, it retries with the secondary URL.
-        Errors are recorded in the DataFrame.
+        The outcome of every row is recorded in a result store (see `ResultStore`) and written into the
+        DataFrame once the run ends: the error, result, used column, HTTP status, bytes and seconds columns.
+        With a retry policy, transient failures are retried with backoff after the other rows have been queued.
+        With a scheduler, the rows are interleaved by the host of their main URL and every request waits for
+        a slot of its host, so throttling hosts get fewer requests and idle hosts get more.
+        With an order, the rows it selects are started in its order instead, and the scheduler only paces them.
+        With a plan (see `Preflight`), rows whose URLs are dead are reported without a request, and every row
+        starts with the column the plan picked for it.
+        In incremental mode, files already on disk are re-fetched conditionally and reported as "Unchanged"
+        when the server answers 304 Not Modified.
+        With a validator, every downloaded file is checked and its page count, title and producer go into the
+        state store and the report; corrupt files are downloaded again and finally reported as "Corrupt PDF".
+        Ctrl-C or SIGTERM stops the run gracefully (see `request_stop`); with a checkpoint, the done, failed and
+        pending rows are saved periodically and at the end, and a run with a loaded checkpoint resumes it.
 
         Args:
             number_of_files (int): Number of files to attempt downloading.
@@ -96,59 +1112,588 @@ class PDFDownloader:
             Total time taken and number of files processed.
 
         Raises:
-            KeyError: If required columns are missing in the DataFrame.
-            Exception: For any other unexpected errors during the download process.
+            AttributeError: If the DataFrame is not loaded.
         """
         start_time = time.perf_counter()
-        lock = threading.Lock() # Ensure thread-safe write operations. by locking a section of code to be executed by only one thread at a time.
 
-        def download_task(br_number):
-            try:
-                savefile = self.dwn_folder / f"{br_number}.pdf"
-                url_main = self.df2.at[br_number, self.main_col]
-                url_secondary = self.df2.at[br_number, self.secondary_col]
-
-                print(f"Downloading {br_number} from {url_main} ...")
-                success, error = self.download_pdf(url_main, savefile)
-
-                if not success:
-                    with lock:
-                        self.df2.at[br_number, "error"] = error
-
-                    success2, error2 = self.download_pdf(url_secondary, savefile)
-                    if not success2:
-                        with lock:
-                            self.df2.at[br_number, "error"] = error2
-                        result = "Not downloaded" # both downloads failed
-                    else:
-                        result = "Downloaded" # secondary download succeeded
-                else:
-                    result = "Downloaded" # main download succeeded
+        ids = self.df2.index[:number_of_files]
+        try:
+            rows, dead = self._planned_rows(self._selected_rows(number_of_files))
+        except KeyError as e:
+            self.df2.loc[ids, "error"] = f"Missing column: {e}"
+            print(f"KeyError: {e}")
+            return
+        if self.scheduler is not None and self.order is None:
+            order = self.scheduler.interleave(range(len(rows)), [row[1] for row in rows])
+            rows = [rows[i] for i in order]
 
-                with lock: 
-                    report_writer.write_to_report(str(br_number), result, output_folder=self.output_folder) #TODO Include a report_writer object
+        self.report_writer.start(self.output_folder, extra_columns=self._report_columns())
+        try:
+            self._skip_dead(dead)
+            with self._stop_on_signals():
+                self._run_rows(rows, max_workers)
+        finally:
+            self.close_sessions() # the worker threads are gone, so are their sessions
+            self.report_writer.stop() # flush the queued report rows
+            self._end_run()
 
-            except KeyError as e:
-                with lock:
-                    self.df2.at[br_number, "error"] = f"Missing column: {e}"
-                print(f"KeyError for {br_number}: {e}")
-            except Exception as e:
-                with lock:
-                    self.df2.at[br_number, "error"] = f"Unexpected error: {e}"
-                print(f"Unexpected error for {br_number}: {traceback.format_exc()}")
+        end_time = time.perf_counter()
+        self._observe_run("threaded", end_time - start_time)
+        print(f"Downloaded {len(rows)} files using {max_workers} threads in {end_time - start_time:.2f} seconds.")
+
+    def process_download_stream(self, batches, number_of_files: int = None, max_workers: int = 4, max_pending: int = None) -> None:
+        """
+        Download rows as they are read from the list, without loading the whole list first.
+
+        `batches` is an iterable of lists of (BRnum, main_url, secondary_url) tuples, normally
+        `PreparePdfDownloader.iter_filtered_batches`. Rows are handed to the thread pool as soon as they
+        are read, and reading pauses while `max_pending` rows are waiting, so memory use does not grow
+        with the length of the list. Outcomes go to the state store and the report; `df2` is not used.
+        Stopping and checkpoints work as in `process_downloads_threaded`; the checkpoint of a streamed run
+        has no pending list, since the rows are not known in advance, and a resumed run skips the finished rows.
+
+        Args:
+            batches (Iterable[list[tuple]]): Batches of (BRnum, main_url, secondary_url) rows.
+            number_of_files (int): Stop after this many rows. Default is None, which means all rows.
+            max_workers (int): Maximum number of threads for concurrent downloads.
+            max_pending (int): Maximum number of rows read ahead of the workers. Default is 2 * max_workers.
+
+        Prints:
+            Total time taken and number of files processed.
+        """
+        start_time = time.perf_counter()
+        rows = itertools.islice(itertools.chain.from_iterable(batches), number_of_files)
+        if self.checkpoint is not None:
+            rows = (row for row in rows if not self.checkpoint.is_finished(row[0])) # finished before a resume
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor: # Use ThreadPoolExecutor for multithreading
-            executor.map(download_task, self.df2.index[:number_of_files]) #TODO Handle AttributeError for NoneType
+        self.report_writer.start(self.output_folder, extra_columns=self._report_columns())
+        try:
+            with self._stop_on_signals():
+                processed = self._run_rows(rows, max_workers, max_pending)
+        finally:
+            self.close_sessions()
+            self.report_writer.stop()
+            self._end_run()
 
         end_time = time.perf_counter()
-        print(f"Downloaded {min(number_of_files, len(self.df2))} files using {max_workers} threads in {end_time - start_time:.2f} seconds.")
+        self._observe_run("stream", end_time - start_time)
+        print(f"Downloaded {processed} streamed files using {max_workers} threads in {end_time - start_time:.2f} seconds.")
+
+    @staticmethod
+    def _shard_rows(rows: list, shards: int, chunk_size: int) -> list:
+        """
+        Split rows into `shards` shards by a stable hash of their BRnum, and every shard into chunks of `chunk_size` rows.
+
+        The same BRnum always lands in the same shard, whatever the order of the list or the process it runs in.
+        The chunks are returned round-robin over the shards, so rows early in `rows` are also started early.
+        """
+        buckets = [[] for _ in range(shards)]
+        for row in rows:
+            buckets[zlib.crc32(str(row[0]).encode("utf-8")) % shards].append(row)
+        chunks = [[bucket[i:i + chunk_size] for i in range(0, len(bucket), chunk_size)] for bucket in buckets]
+        return [chunk for group in itertools.zip_longest(*chunks) for chunk in group if chunk is not None]
+
+    def _shard_config(self, processes: int, chunks: int, max_workers: int) -> dict:
+        """
+        Return the picklable settings a shard process needs to build its own downloader.
+
+        Locks, connections and sessions cannot cross process boundaries, so the state store is reopened from
+        its path and the scheduler and retry policy are rebuilt from their settings. The scheduler's rate is
+        shared between the processes and the retry budget between the chunks, and so is the governor's bandwidth cap.
+        Metrics stay in this process.
+        """
+        config = {
+            "downloader": {"list_path": self.list_path, "output_folder": str(self.output_folder), "main_col": self.main_col,
+                           "secondary_col": self.secondary_col, "id_col": self.id_col, "pool_connections": self.pool_connections,
+                           "pool_maxsize": self.pool_maxsize, "max_retries": self.max_retries, "incremental": self.incremental,
+                           "follow_pdf_links": self.follow_pdf_links, "dedup_urls": self.dedup_urls},
+            "blob_root": str(self.blob_store.root) if self.blob_store is not None else None,
+            "state_db": str(self.state_store.db_path) if self.state_store is not None else None,
+            "scheduler": None,
+            "retry_policy": None,
+            "validator": None,
+            "governor": None,
+            "max_workers": max_workers,
+        }
+        if self.scheduler is not None:
+            scheduler = self.scheduler
+            config["scheduler"] = {"rate": scheduler.rate / processes, "burst": scheduler.burst,
+                                   "initial_concurrency": scheduler.initial_concurrency, "min_concurrency": scheduler.min_concurrency,
+                                   "max_concurrency": scheduler.max_concurrency, "latency_target": scheduler.latency_target}
+        if self.retry_policy is not None:
+            policy = self.retry_policy
+            budget = None if policy.run_budget is None else max(1, policy.run_budget // max(1, chunks))
+            config["retry_policy"] = {"max_attempts": policy.max_attempts, "run_budget": budget, "base_delay": policy.base_delay,
+                                      "max_delay": policy.max_delay, "jitter": policy.jitter}
+        if self.validator is not None:
+            validator = self.validator
+            config["validator"] = {"workers": validator.workers, "queue_size": validator.queue_size,
+                                   "max_requeues": validator.max_requeues, "tail_bytes": validator.tail_bytes}
+        if self.governor is not None:
+            governor = self.governor
+            config["governor"] = {"max_bytes_per_second": governor.max_bytes_per_second and governor.max_bytes_per_second / processes,
+                                  "burst_bytes": governor.burst_bytes and governor.burst_bytes / processes,
+                                  "min_free_bytes": governor.min_free_bytes, "resume_free_bytes": governor.resume_free_bytes,
+                                  "max_file_size": governor.max_file_size, "check_interval": governor.check_interval}
+        return config
+
+    def _run_chunks(self, chunks: deque, config: dict, processes: int, on_results) -> list:
+        """
+        Run chunks from the left of `chunks` on a new pool of `processes` processes, one chunk per process at a time.
+
+        Args:
+            chunks (deque[list]): The chunks to run; chunks that were not started when the pool broke are left in it.
+            config (dict): The settings from `_shard_config`.
+            processes (int): The number of processes.
+            on_results (Callable): Called on this thread with the results of every finished chunk.
+
+        Returns:
+            list: The chunks that were running when a process died, empty if none did.
+        """
+        futures = {}
+        crashed = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_ignore_stop_signals) as executor:
+            while (chunks and not crashed and not self._stop.is_set()) or futures:
+                while chunks and not crashed and not self._stop.is_set() and len(futures) < processes: # no more than one chunk per process may be blamed for a crash
+                    chunk = chunks.popleft()
+                    futures[executor.submit(_download_chunk, config, chunk)] = chunk
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    chunk = futures.pop(future)
+                    try:
+                        on_results(future.result())
+                    except BrokenProcessPool:
+                        crashed.append(chunk)
+                    except Exception as e:
+                        on_results([(str(row[0]), "Not downloaded", f"Unexpected error: {e}", ()) for row in chunk])
+        return crashed
+
+    def process_downloads_sharded(self, number_of_files: int = 10, processes: int = None, max_workers: int = 4,
+                                  chunk_size: int = None) -> None:
+        """
+        Download multiple PDF files in several processes, each running its own threaded engine.
+
+        The rows are sharded by BRnum and handed to a process pool in chunks. Every process downloads its chunk
+        with `max_workers` threads, including any post-download work `download_row` does, so CPU-heavy work
+        does not compete for one GIL. The results come back to this process, which writes the report through
+        its `ReportWriter`, the outcomes into its result store and the metrics; the state store is shared through SQLite.
+
+        If a process dies (e.g. a PDF crashes a native parser), the chunks that were running are re-run one at a
+        time in a pool of their own, without the rows the state store shows were already downloaded in this run,
+        which are reported from the store; the chunk that crashes again is bisected until the bad row is found, which is
+        reported as "Not downloaded" instead of ending the run. The other chunks continue in a new pool.
+        With an order, the rows it selects are sharded instead of the first rows, and every shard keeps their order.
+        A plan is used as in `process_downloads_threaded`.
+        After a stop request no new chunk is started and the running chunks are finished; the processes ignore
+        Ctrl-C and SIGTERM themselves, so the shutdown timeout does not apply to them. Checkpoints work as in
+        `process_downloads_threaded`.
 
+        Args:
+            number_of_files (int): Number of files to attempt downloading.
+            processes (int): Number of processes. Default is the number of CPUs.
+            max_workers (int): Download threads per process.
+            chunk_size (int): Rows per task. Default is 8 * max_workers.
+
+        Prints:
+            Total time taken and number of files processed.
+        """
+        start_time = time.perf_counter()
+        run_started = time.time() # state store rows updated since then were finished by this run
+        processes = processes or os.cpu_count() or 1
+
+        ids = self.df2.index[:number_of_files]
+        try:
+            rows, dead = self._planned_rows(self._selected_rows(number_of_files))
+        except KeyError as e:
+            self.df2.loc[ids, "error"] = f"Missing column: {e}"
+            print(f"KeyError: {e}")
+            return
+
+        chunks = self._shard_rows(rows, processes, chunk_size or 8 * max_workers)
+        config = self._shard_config(processes, len(chunks), max_workers)
+        queue = deque(chunks)
+        suspects = deque() # chunks that were running when a process died
+
+        def record(results):
+            for br_number, result, error, extra, url, stats in results:
+                self.results.record(br_number, result, url, error, *stats)
+                self.report_writer.submit(br_number, result, extra)
+                if self.metrics is not None:
+                    self.metrics.record_file(br_number, result, None, error)
+                self._checkpoint_row(br_number, result)
+            self._save_checkpoint_if_due() # on this thread, which dispatches the chunks
+
+        self.report_writer.start(self.output_folder, extra_columns=self._report_columns())
+        try:
+            self._skip_dead(dead)
+            with self._stop_on_signals():
+                while (queue or suspects) and not self._stop.is_set():
+                    if not suspects:
+                        suspects.extend(self._run_chunks(queue, config, processes, record))
+                        if suspects:
+                            print(f"A shard process crashed, re-running {sum(len(chunk) for chunk in suspects)} rows one chunk at a time")
+                        continue
+                    chunk, done = self._split_done(suspects.popleft(), run_started)
+                    record(done) # finished by the process that died, the state store already has them
+                    if not chunk:
+                        continue
+                    if not self._run_chunks(deque([chunk]), config, 1, record):
+                        continue # innocent
+                    if len(chunk) > 1: # the crash is somewhere in this chunk, bisect it
+                        suspects.extendleft([chunk[len(chunk) // 2:], chunk[:len(chunk) // 2]])
+                        continue
+                    br_number, url_first, url_second = chunk[0]
+                    print(f"Giving up on {br_number}: it crashes the process that downloads it")
+                    self._finish_row(br_number, "Not downloaded", url_second or url_first, {}, "Worker process crashed")
+        finally:
+            self.report_writer.stop()
+            self._end_run()
+
+        end_time = time.perf_counter()
+        self._observe_run("sharded", end_time - start_time)
+        print(f"Downloaded {len(rows)} files using {processes} processes x {max_workers} threads in {end_time - start_time:.2f} seconds.")
+
+    def _split_done(self, chunk: list, since: float) -> tuple[list, list]:
+        """
+        Split a chunk of a crashed shard process into the rows still to download and those it already finished.
+
+        A row is finished if the state store recorded it with one of DONE_STATUSES after `since`. Without a state
+        store nothing is known and the whole chunk is returned.
+
+        Args:
+            chunk (list): The (BRnum, first URL, second URL) rows of the chunk.
+            since (float): The `time.time()` the run started.
+
+        Returns:
+            tuple: The rows to download again, and report rows like `_download_chunk` returns for the finished ones.
+        """
+        if self.state_store is None:
+            return chunk, []
+        rows, done = [], []
+        for row in chunk:
+            state = self.state_store.get(str(row[0]))
+            if state is None or state["status"] not in DONE_STATUSES or (state["updated_at"] or 0) < since:
+                rows.append(row)
+                continue
+            result = "Unchanged" if state["status"] == "unchanged" else "Downloaded"
+            extra = tuple(state.get(key) or "" for key in ("pages", "title", "producer")) if self.validator is not None else ()
+            done.append((str(row[0]), result, "", extra, state["url"], (state["http_status"], state["size"], None)))
+        return rows, done
 
-    def delete_downloaded_files(self) -> None:
+    async def download_pdf_async(self, session, url: str, savepath: Path, info: dict = None, validators: dict = None) -> tuple[bool, str]:
         """
-        Delete all downloaded PDF files in the download folder.
+        Download a PDF file from a URL with an aiohttp session and save it to a specified path.
+
+        This is the asyncio counterpart of `download_pdf`. It returns the same (success, error_message)
+        tuple and uses the same error message prefixes, so the results can be summarized the same way.
+        Like `download_pdf` it streams into a `.part` file, resumes an interrupted download with a `Range` request
+        and aborts responses that are not PDFs before writing anything. Links found in HTML pages are not followed.
+
+        Args:
+            session (aiohttp.ClientSession): the session used to make the request
+            url (str): the URL of the PDF file to download
+            savepath (Path): the path where the PDF file should be saved
+            info (dict): optional dict that is filled with the same metadata as in `download_pdf`
+            validators (dict): optional validators for a conditional request, as in `download_pdf`
+
+        Returns:
+          Tuple: (success: bool, error_message: str).
+        """
+        import aiohttp
+
+        info = {} if info is None else info
+        try:
+            savepath = Path(savepath)
+            offset = self._resume_offset(url, savepath)
+            headers = self._request_headers(offset, validators)
+
+            start = time.perf_counter()
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=10),
+                                   trace_request_ctx=info) as response: # make a GET request, the trace config fills in DNS and connect time
+                transfer_start = time.perf_counter()
+                info["http_status"] = response.status
+                info["ttfb"] = transfer_start - start
+                if response.status == 304 and validators: # unchanged since the last run, keep the file we have
+                    info["not_modified"] = True
+                    return True, ""
+                if offset and (response.status == 416 or (response.status == 206 and not self._range_matches(response.headers.get("content-range"), offset))):
+                    os.remove(self._part_path(savepath)) # the partial file does not fit the remote file any more, start over
+                    return await self.download_pdf_async(session, url, savepath, info, validators)
+                if response.status not in (200, 206) or (response.status == 206 and not offset):
+                    info["retryable"] = RetryPolicy.is_retryable_status(response.status)
+                    return False, f"Failed to download: {response.status} - {response.reason}"
+                if response.status == 200:
+                    offset = 0 # the server ignored the range, start over
+
+                total = offset + int(response.headers.get('content-length', 0))
+                if self._too_large(total):
+                    info["retryable"] = False
+                    return False, f"File too large: {total} bytes, the limit is {self.governor.max_file_size}"
+                downloaded = offset
+                info["bytes"] = 0
+                head = b""
+
+                if not offset: # same PDF check as in download_pdf
+                    content_type = self._content_type(response.headers)
+                    while len(head) < SNIFF_BYTES and not response.content.at_eof():
+                        head += await response.content.read(SNIFF_BYTES - len(head))
+                    if PDF_MAGIC not in head:
+                        info.update(not_pdf=True, retryable=False)
+                        if self.follow_pdf_links and (content_type in HTML_CONTENT_TYPES or head.lstrip()[:1] == b"<"):
+                            while len(head) < HTML_SCAN_BYTES and not response.content.at_eof():
+                                head += await response.content.read(HTML_SCAN_BYTES - len(head))
+                            info["pdf_link"] = self._find_pdf_link(head, str(response.url))
+                        return False, f"Not a PDF: {content_type or 'no content type'}"
+
+                hasher = self._hash_part(savepath, offset)
+                with self._open_part(url, savepath, offset) as f:
+                    preallocated = self._preallocate(f, url, savepath, offset, total)
+                    try:
+                        f.write(head)
+                        hasher.update(head)
+                        downloaded += len(head)
+                        async for chunk in response.content.iter_chunked(self._chunk_size(total - offset)): # up to 256 KB-4 MB per write
+                            f.write(chunk)
+                            hasher.update(chunk)
+                            downloaded += len(chunk)
+                            if self.governor is not None:
+                                if self.governor.too_large(downloaded):
+                                    break
+                                await asyncio.sleep(self.governor.reserve(len(chunk))) # 0 unless over the bandwidth cap
+                            if self._cancelled():
+                                info["cancelled"] = True
+                                break
+                    finally:
+                        if preallocated:
+                            self._release_preallocation(f, url, savepath, downloaded)
+                info.update(bytes=downloaded - offset, transfer=time.perf_counter() - transfer_start)
+
+            if info.get("cancelled"):
+                info["retryable"] = False
+                return False, CANCELLED
+
+            if self._too_large(downloaded):
+                self._discard_part(savepath)
+                info["retryable"] = False
+                return False, f"File too large: more than {self.governor.max_file_size} bytes"
+            if total > offset and downloaded < total:
+                info["retryable"] = True
+                return False, f"Incomplete download: {downloaded}/{total} bytes"
+            self._finish_part(savepath)
+            info.update(size=downloaded, sha256=hasher.hexdigest(),
+                        etag=response.headers.get("etag"), last_modified=response.headers.get("last-modified"))
+            return True, ""
+
+        except asyncio.TimeoutError as te:
+            info["retryable"] = True
+            return False, f"Request timed out: {str(te)}"
+        except aiohttp.ClientConnectionError as ce:
+            info["retryable"] = True
+            return False, f"Connection error: {str(ce)}"
+        except aiohttp.ClientPayloadError as ce:
+            info["retryable"] = True
+            return False, f"Chunked encoding error: {str(ce)}"
+        except IOError as ioe:
+            info["retryable"] = self._disk_full(ioe)
+            return False, f"I/O error: {str(ioe)}"
+        except (aiohttp.ClientError, ValueError) as re:
+            return False, f"Request error: {str(re)}"
+        except Exception as e:
+            return False, f"Unexpected error: {str(e)}"
+
+    def process_downloads_async(self, number_of_files: int = 10, max_concurrency: int = 100, per_host_limit: int = 8) -> None:
+        """
+        Download multiple PDF files concurrently using asyncio in a single thread.
+
+        Works like `process_downloads_threaded`, but keeps up to `max_concurrency` downloads in flight
+        without a thread per download. No more than `per_host_limit` downloads run against the same host
+        at a time, and a row waiting for a busy host does not take up one of the global slots.
+        If the download from the main URL fails, it retries with the secondary URL.
+        Outcomes are recorded in the result store and written into the DataFrame when the run ends.
+        With a retry policy, transient failures of a URL are retried after a backoff that holds no slot.
+        With a validator, downloaded files are validated on a thread pool while other downloads go on, at most
+        `validator.queue_size` at a time, and corrupt files are downloaded again.
+        With `dedup_urls`, every normalized URL is requested once; other rows that use it wait for that request
+        and are linked to its file.
+        With an order, the rows it selects are started in its order. A plan is used as in `process_downloads_threaded`.
+        Stopping and checkpoints work as in `process_downloads_threaded`.
+
+        Args:
+            number_of_files (int): Number of files to attempt downloading.
+            max_concurrency (int): Maximum number of downloads in flight at the same time.
+            per_host_limit (int): Maximum number of downloads in flight against a single host.
+
+        Prints:
+            Total time taken and number of files processed.
+
+        Raises:
+            ImportError: If aiohttp is not installed.
+        """
+        import aiohttp # only needed by the async engine
+
+        start_time = time.perf_counter()
+        try:
+            rows, dead = self._planned_rows(self._selected_rows(number_of_files))
+        except KeyError as e:
+            self.df2.loc[self.df2.index[:number_of_files], "error"] = f"Missing column: {e}"
+            print(f"KeyError: {e}")
+            return
+
+        async def run():
+            global_slots = asyncio.Semaphore(max_concurrency)
+            host_slots = {}
+            in_flight = 0
+            validation_slots = asyncio.Semaphore(self.validator.queue_size if self.validator else 1)
+            url_fetches = {} # normalized URL -> future of (success, error, info, file) of the first fetch of it
+
+            async def save_checkpoint():
+                if self._checkpoint_due: # the report flush and the checkpoint write run on a thread, not on the event loop
+                    self._checkpoint_due = False
+                    await asyncio.get_running_loop().run_in_executor(None, self._save_checkpoint)
+
+            async def fetch(session, url, savefile, info, validators):
+                if not self.dedup_urls:
+                    return await fetch_url(session, url, savefile, info, validators)
+                key = self._normalize_url(url)
+                if key in url_fetches: # another row fetches or fetched this URL, wait for it instead of requesting it again
+                    success, error, fetched_info, fetched_file = await asyncio.shield(url_fetches[key])
+                    info.update(fetched_info)
+                    if success and fetched_file != savefile:
+                        try:
+                            BlobStore.link(fetched_file, savefile)
+                        except OSError as e:
+                            return False, f"I/O error: {e}"
+                        print(f"{savefile.stem} has the same URL as {fetched_file.stem}, linked to its file")
+                        if self.metrics is not None:
+                            self.metrics.inc("deduplicated_urls_total")
+                    return success, error
+                url_fetches[key] = asyncio.get_running_loop().create_future()
+                outcome = (False, "Unexpected error: fetch did not finish", {}, savefile)
+                try:
+                    success, error = await fetch_url(session, url, savefile, info, validators)
+                    outcome = (success, error, dict(info), savefile)
+                    return success, error
+                finally:
+                    url_fetches[key].set_result(outcome)
+
+            async def fetch_url(session, url, savefile, info, validators):
+                nonlocal in_flight
+                host = urlsplit(str(url)).netloc.lower()
+                if host not in host_slots:
+                    host_slots[host] = asyncio.Semaphore(per_host_limit)
+                attempt = 1
+                while True:
+                    info.clear()
+                    while self.governor is not None and not self.governor.has_space(self.dwn_folder):
+                        await asyncio.sleep(self.governor.check_interval) # disk almost full, wait without a slot
+                    async with host_slots[host]: # wait for the host first, so a busy host does not hold a global slot
+                        async with global_slots:
+                            if self._stop.is_set(): # not started before the stop, left pending
+                                info.update(cancelled=True, retryable=False)
+                                return False, CANCELLED
+                            in_flight += 1
+                            if self.metrics is not None:
+                                self.metrics.set_gauge("queue_depth", in_flight)
+                            try:
+                                success, error = await self.download_pdf_async(session, url, savefile, info, validators)
+                            finally:
+                                in_flight -= 1
+                    if self.metrics is not None:
+                        self.metrics.record_attempt(savefile.stem, url, info, success, error)
+                    if success or not self._should_retry(savefile.stem, url, info, attempt):
+                        return success, error
+                    await asyncio.sleep(self.retry_policy.delay(attempt)) # backoff without holding a slot
+                    attempt += 1
+
+            async def download_task(session, br_number, url_main, url_secondary):
+                try:
+                    savefile = self.dwn_folder / f"{br_number}.pdf"
+
+                    requeues = 0
+                    while True:
+                        print(f"Downloading {br_number} from {url_main} ...")
+                        info = {}
+                        success, error = await fetch(session, url_main, savefile, info, self._validators_for(br_number, url_main, savefile))
+                        used_url = url_main
+                        if info.get("cancelled"):
+                            return # stopped, the row stays pending
+
+                        if not success and url_secondary is None:
+                            result = "Not downloaded" # the plan found the fallback dead
+                        elif not success:
+                            info = {}
+                            success2, error2 = await fetch(session, url_secondary, savefile, info, self._validators_for(br_number, url_secondary, savefile))
+                            used_url = url_secondary
+                            if info.get("cancelled"):
+                                return
+                            if not success2:
+                                error = error2
+                                result = "Not downloaded" # both downloads failed
+                            else:
+                                result = "Downloaded" # secondary download succeeded
+                        else:
+                            result = "Downloaded" # main download succeeded
+
+                        if result != "Downloaded" or self.validator is None or info.get("not_modified"):
+                            self._finish_row(br_number, result, used_url, info, error)
+                            break
+                        async with validation_slots: # the parsing runs on the validation threads, not on the event loop
+                            verdict = await asyncio.get_running_loop().run_in_executor(validation_pool, self.validator.validate, savefile)
+                        result, error, job = self._after_validation(br_number, {"url": used_url, "info": info, "main_error": error,
+                                                                                "requeues": requeues}, verdict)
+                        if job is None:
+                            break
+                        requeues = job["requeues"] # corrupt, download it again
+                        url_fetches.pop(self._normalize_url(used_url), None) # and do not hand the corrupt file to other rows
+
+                except Exception as e:
+                    print(f"Unexpected error for {br_number}: {traceback.format_exc()}")
+                    self._finish_row(br_number, "Not downloaded", None, {}, f"Unexpected error: {e}")
+                await save_checkpoint()
+
+            connector = aiohttp.TCPConnector(limit=max_concurrency, limit_per_host=per_host_limit)
+            trace_configs = [aiohttp_trace_config()] if self.metrics is not None else None
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.validator.workers if self.validator else 1) as validation_pool: # starts no thread unless a file is validated
+                async with aiohttp.ClientSession(connector=connector, trace_configs=trace_configs,
+                                                 read_bufsize=MIN_CHUNK_SIZE) as session: # one pooled session for all downloads; larger reads than the 64 KB default
+                    await asyncio.gather(*(download_task(session, *row) for row in rows)) # started in order
+
+        self.report_writer.start(self.output_folder, extra_columns=self._report_columns())
+        try:
+            self._skip_dead(dead)
+            with self._stop_on_signals():
+                asyncio.run(run())
+        finally:
+            self.report_writer.stop()
+            self._end_run()
+
+        end_time = time.perf_counter()
+        self._observe_run("async", end_time - start_time)
+        print(f"Downloaded {len(rows)} files using asyncio ({max_concurrency} concurrent, {per_host_limit} per host) in {end_time - start_time:.2f} seconds.")
+
+
+    def delete_downloaded_files(self, statuses=None, report_results=None, workers: int = 8, background: bool = False) -> None:
+        """
+        Delete downloaded PDF files in the download folder: all of them, or only those of selected rows.
+
+        The folder is listed once with `os.scandir` and the files are removed in batches on `workers` threads.
         Logs errors for individual files and continues deleting others.
         Prints the number of files deleted and any errors encountered.
+        Deleted files are also removed from the state store, so they are downloaded again on the next run,
+        and blobs no file links to any more are removed from the blob store.
+
+        With `background`, a full reset renames the download folder aside and deletes it on a background
+        thread (`cleanup_thread`), so downloads into the new, empty folder can start right away. Leftovers of
+        a background deletion that was interrupted are deleted with it.
+
+        Args:
+            statuses (Iterable[str]): Only delete the files of rows with one of these state store statuses,
+                e.g. ("failed", "corrupt", "not_pdf").
+            report_results (Iterable[str]): Only delete the files of rows with one of these results in the report,
+                e.g. ("Not downloaded", "Corrupt PDF").
+            workers (int): Threads that remove files.
+            background (bool): Delete everything in the background. Ignored for a selective deletion, whose files
+                could otherwise be removed while they are downloaded again.
 
         Raises:
             PermissionError: If there are permission issues deleting a file.
@@ -157,36 +1702,118 @@ class PDFDownloader:
             Exception: For any other unexpected errors.
         """
         try:
-            dwn_files = glob.glob(str(self.dwn_folder / "*.pdf"))
-            deleted_count = 0
-            for f in dwn_files:
+            selective = statuses is not None or report_results is not None
+            if background and not selective:
+                self._delete_in_background()
+                return
+            if selective:
+                ids = set()
+                if statuses is not None and self.state_store is not None:
+                    ids.update(self.state_store.ids_with_status(statuses))
+                if report_results is not None:
+                    ids.update(name for name, result in ReportWriter.read_results(self.output_folder).items() if result in report_results)
+                names = [f"{br_number}.pdf" for br_number in sorted(ids)]
+            else:
+                with os.scandir(self.dwn_folder) as entries: # one listing, no stat per file
+                    names = [entry.name for entry in entries if entry.name.endswith(".pdf")]
+
+            deleted_ids, missing_ids = self._remove_files(self.dwn_folder, names, workers)
+            if self.state_store is not None:
+                self.state_store.forget(deleted_ids + missing_ids if not selective else [name[:-4] for name in names])
+            if self.blob_store is not None:
+                print(f"Removed {self.blob_store.prune()} unused blobs.")
+
+            if selective:
+                print(f"Deleted {len(deleted_ids)} PDF files of {len(names)} selected rows.")
+            else:
+                print(f"Deleted {len(deleted_ids)} of {len(names)} PDF files.")
+        except Exception as e:
+            print(f"Failed to scan download folder: {e}")
+
+    @staticmethod
+    def _remove_files(folder: Path, names: list, workers: int) -> tuple[list, list]:
+        """
+        Remove the files `names` from `folder` in batches of DELETE_BATCH on `workers` threads.
+
+        Returns:
+            Tuple: (ids of the files removed, ids of the files that did not exist).
+        """
+        def remove_batch(batch):
+            deleted, missing = [], []
+            for name in batch:
                 try:
-                    os.remove(f)
-                    deleted_count += 1
+                    os.remove(os.path.join(folder, name))
+                    deleted.append(name[:-4])
+                except FileNotFoundError:
+                    missing.append(name[:-4])
                 except PermissionError as pe:
-                    print(f"Permission denied when deleting {f}: {pe}")
-                except FileNotFoundError as fnf:
-                    print(f"File not found when deleting {f}: {fnf}")
+                    print(f"Permission denied when deleting {name}: {pe}")
                 except Exception as e:
-                    print(f"Unexpected error deleting {f}: {e}")
+                    print(f"Unexpected error deleting {name}: {e}")
+            return deleted, missing
 
-            print(f"Deleted {deleted_count} of {len(dwn_files)} PDF files.")
-        except Exception as e:
-            print(f"Failed to scan download folder: {e}")
+        deleted_ids, missing_ids = [], []
+        batches = [names[i:i + DELETE_BATCH] for i in range(0, len(names), DELETE_BATCH)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as executor:
+            for deleted, missing in executor.map(remove_batch, batches):
+                deleted_ids.extend(deleted)
+                missing_ids.extend(missing)
+        return deleted_ids, missing_ids
+
+    def _delete_in_background(self) -> None:
+        """
+        Rename the download folder aside, start over with an empty one and delete the old one on `cleanup_thread`.
 
-    def summarize_downloads(self, number_of_files: int = 10) -> list[dict[str, str]]:
+        The rows of the files moved aside are forgotten in the state store right away. Blobs are pruned once
+        the old folder is gone, since its files still link to them until then.
+        """
+        aside = self.dwn_folder.with_name(f"{self.dwn_folder.name}{DELETING_SUFFIX}{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        try:
+            os.replace(self.dwn_folder, aside)
+        except FileNotFoundError:
+            aside = None # nothing downloaded yet
+        self.dwn_folder.mkdir(parents=True, exist_ok=True)
+
+        ids = []
+        if aside is not None:
+            with os.scandir(aside) as entries:
+                ids = [entry.name[:-4] for entry in entries if entry.name.endswith(".pdf")]
+            if self.state_store is not None:
+                self.state_store.forget(ids)
+        folders = sorted(self.dwn_folder.parent.glob(f"{self.dwn_folder.name}{DELETING_SUFFIX}*")) # this one and leftovers
+
+        def delete_folders():
+            for folder in folders:
+                shutil.rmtree(folder, onerror=lambda function, path, exc_info: print(f"Could not delete {path}: {exc_info[1]}"))
+            if self.blob_store is not None:
+                print(f"Removed {self.blob_store.prune()} unused blobs.")
+            print(f"Finished deleting {len(ids)} old PDF files in the background.")
+
+        self.cleanup_thread = threading.Thread(target=delete_folders, name="dwn-cleanup") # not a daemon, so the deletion is finished before exit
+        self.cleanup_thread.start()
+        print(f"Moved {len(ids)} PDF files aside, deleting them in the background.")
+
+    def summarize_downloads(self, number_of_files: int = 10, as_frame: bool = False, verbose: bool = False):
         """
         Summarize the download results for the first `number_of_files` entries in the DataFrame.
 
-        This method checks the download status of the first `number_of_files` entries in the DataFrame.
+        This method checks the download status of the first `number_of_files` entries in the DataFrame,
+        or of the rows the last run selected if the downloader has an order.
         It determines whether each file was successfully downloaded or if there was an error.
         It also identifies which URL column (main or secondary) was used for the download attempt.
 
+        The download folder is listed once with `os.scandir` and the status and used column of all rows are
+        computed with vectorized pandas operations, so no file is stat'ed and no row is visited in Python.
+        The used column is the one the result store recorded; for rows without one, a row with an error
+        message used the secondary column, since the error of the main URL is only kept when it failed.
+
         Args: 
             number_of_files (int): The number of files to summarize.
+            as_frame (bool): If True, return the summary as a DataFrame instead of a list of dicts.
+            verbose (bool): If True, also print one line per file.
 
         Returns:
-            List(Dict): A summary list containing the ID, status, used column, and any error message for each file.
+            List(Dict) or DataFrame: A summary containing the ID, status, used column, and any error message for each file.
 
         Raises:
             AttributeError: If the DataFrame is not loaded.
@@ -194,48 +1821,46 @@ class PDFDownloader:
             KeyError: If expected columns are missing in the DataFrame.
             Exception: For any other unexpected errors.
         """
+        summary = pd.DataFrame(columns=["ID", "Status", "UsedColumn", "Error"])
         try:
             if not hasattr(self, 'df2') or self.df2 is None:
                 raise AttributeError("DataFrame 'df2' is not loaded. Please run load_excel() first.")
 
             if not self.dwn_folder.exists():
                 raise FileNotFoundError(f"Download folder not found: {self.dwn_folder}")
-            
-            summary = []
-            count_main_col = 0
-            count_secondary_col = 0
-            count_failed = 0
-
-            for idx, row in self.df2.iloc[:number_of_files].iterrows(): # Iterate over the first `number_of_files` rows
-                file_path = self.dwn_folder / f"{idx}.pdf"
-                error = row.get("error", "")
-                failed_main = "Failed to download" in str(error)
-
-                if file_path.exists(): # if file exists
-                    status = "Success"
-                    used_col = self.secondary_col if failed_main else self.main_col
-                    error = ""
-
-                    if used_col == self.main_col: 
-                        count_main_col += 1 # if main column was used
-                    else:
-                        count_secondary_col += 1 # if secondary column was used
-                else:
-                    status = "Failed"
-                    used_col = self.secondary_col if failed_main else self.main_col
-                    count_failed += 1 # if download failed
 
-                summary.append({
-                    "ID": idx,
-                    "Status": status,
-                    "UsedColumn": used_col,
-                    "Error": error
-                })
+            with os.scandir(self.dwn_folder) as entries: # one directory listing instead of one stat per row
+                on_disk = {entry.name[:-4] for entry in entries if entry.name.endswith(".pdf")}
+
+            if self.order is not None and self.selected_ids is not None:
+                rows = self.df2.loc[self.selected_ids]
+            else:
+                rows = self.df2.iloc[:number_of_files]
+            exists = rows.index.astype(str).isin(on_disk)
+            if "error" in rows.columns:
+                errors = rows["error"].fillna("").astype(str).to_numpy()
+            else:
+                errors = np.full(len(rows), "", dtype=object)
+            failed_main = errors != ""
+            if "used_column" in rows.columns: # written by the result store; the error only tells for rows of older runs
+                used = rows["used_column"].to_numpy()
+                failed_main = np.where(pd.isna(used), failed_main, used == self.secondary_col)
+
+            summary = pd.DataFrame({
+                "ID": rows.index,
+                "Status": np.select([exists, np.char.startswith(errors.astype(str), "Not a PDF"), np.char.startswith(errors.astype(str), "Corrupt PDF")],
+                                    ["Success", "Not a PDF", "Corrupt PDF"], "Failed"),
+                "UsedColumn": np.where(failed_main, self.secondary_col, self.main_col),
+                "Error": np.where(exists, "", errors),
+            })
 
-            print("\nDownload Summary:")
-            for item in summary:
-                print(f"ID: {item['ID']}, Status: {item['Status']}, Used: {item['UsedColumn']}, Error: {item['Error']}")
+            if verbose:
+                print("\nDownload Summary:")
+                print(summary.to_string(index=False))
 
+            count_main_col = int((exists & ~failed_main).sum())
+            count_secondary_col = int((exists & failed_main).sum())
+            count_failed = int((~exists).sum())
             print(f"Main Col Count: {count_main_col}, Secondary Col Count: {count_secondary_col}, Failed Count: {count_failed}")
 
         except AttributeError as ae:
@@ -247,30 +1872,41 @@ class PDFDownloader:
         except Exception as e:
             print(f"Unexpected error in summarize_downloads: {e}")
 
-        return summary
-
-
-if __name__ == "__main__":
-    list_pth = r"C:\Users\SPAC-O-5\source\repos\PDFDownloader\GRI_2017_2020 (1).xlsx"
-    output_folder = r"C:\Users\SPAC-O-5\source\repos\PDFDownloader\Output"
-    main_col = "Pdf_URL"
-    secondary_col = "Report Html Address"
-    number_of_files = 20
+        return summary if as_frame else summary.to_dict("records")
 
-    # Writer for reports
-    report_writer = ReportWriter()
-    report_writer.clean_report_file(output_folder=output_folder) # Clean report file at start
+def _ignore_stop_signals() -> None:
+    """
+    Shard process initializer: leave Ctrl-C and SIGTERM to the parent process, which stops the run gracefully.
+    """
+    for signum in STOP_SIGNALS:
+        signal.signal(signum, signal.SIG_IGN)
 
-    # Prepare data
-    prepare = PreparePdfDownloader(list_pth, output_folder, main_col, secondary_col)
-    exist = prepare.prepare_folders_and_find_pdf_duplicates()
-    df, df2 = prepare.load_and_filter_excel_data(exist)
+def _download_chunk(config: dict, rows: list) -> list:
+    """
+    Shard process entry point: download `rows` with a downloader built from `config` (see `_shard_config`).
 
-    # Pass prepared data to downloader
-    downloader = PDFDownloader(list_pth, output_folder, main_col, secondary_col)
-    downloader.df = df
-    downloader.df2 = df2
+    Returns:
+        list[tuple]: (BRnum, result, error_message, report_extra, used_url, stats) for every row, see `_finish_row`.
+    """
+    downloader = PDFDownloader(**config["downloader"])
+    downloader.report_writer = None # the rows are collected in report_rows, the parent process writes the report
+    if config["state_db"] is not None:
+        downloader.state_store = DownloadStateStore(config["state_db"])
+    if config["scheduler"] is not None:
+        downloader.scheduler = HostScheduler(**config["scheduler"])
+    if config["retry_policy"] is not None:
+        downloader.retry_policy = RetryPolicy(**config["retry_policy"])
+    if config["validator"] is not None:
+        downloader.validator = PdfValidator(**config["validator"])
+    if config["blob_root"] is not None:
+        downloader.blob_store = BlobStore(config["blob_root"])
+    if config["governor"] is not None:
+        downloader.governor = DownloadGovernor(**config["governor"])
 
-    downloader.delete_downloaded_files()
-    downloader.process_downloads_threaded(number_of_files, max_workers=8)
-    downloader.summarize_downloads(number_of_files)
\ No newline at end of file
+    try:
+        downloader._run_rows(rows, config["max_workers"])
+    finally:
+        downloader.close_sessions()
+        if downloader.state_store is not None:
+            downloader.state_store.close()
+    return downloader.report_rows
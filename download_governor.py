@@ -0,0 +1,82 @@
+import shutil
+import threading
+import time
+
+class DownloadGovernor:
+    def __init__(self, max_bytes_per_second: float = None, burst_bytes: int = None, min_free_bytes: int = None,
+                 resume_free_bytes: int = None, max_file_size: int = None, check_interval: float = 5.0):
+        self.max_bytes_per_second = max_bytes_per_second # bandwidth all downloads share, None for no cap
+        self.burst_bytes = burst_bytes or max_bytes_per_second # bytes that may be read back to back after an idle spell
+        self.min_free_bytes = min_free_bytes # no new download starts while the disk has less free space, None to not check
+        self.resume_free_bytes = max(resume_free_bytes or 0, min_free_bytes or 0) # free space needed before downloads start again
+        self.max_file_size = max_file_size # bytes; larger files are rejected, None for no limit
+        self.check_interval = check_interval # seconds between free space checks while paused
+        self.lock = threading.Lock()
+        self.paused = False
+        self._available = float(self.burst_bytes or 0)
+        self._updated = time.monotonic()
+
+    def reserve(self, nbytes: int) -> float:
+        """
+        Take `nbytes` from the shared bandwidth budget and return how long the caller has to wait for them.
+
+        The budget is a token bucket refilled at `max_bytes_per_second`. It may go into debt, so every
+        caller waits for its own share and the total rate of all downloads stays at the cap.
+
+        Args:
+            nbytes (int): The number of bytes just read.
+
+        Returns:
+            float: Seconds to sleep before reading more, 0 if there is no cap or budget is left.
+        """
+        if not self.max_bytes_per_second:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self._available = min(float(self.burst_bytes), self._available + (now - self._updated) * self.max_bytes_per_second)
+            self._updated = now
+            self._available -= nbytes
+            return 0.0 if self._available >= 0 else -self._available / self.max_bytes_per_second
+
+    def throttle(self, nbytes: int) -> None:
+        """
+        Block the calling thread until `nbytes` fit into the bandwidth cap.
+        """
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    def has_space(self, folder) -> bool:
+        """
+        Return False while new downloads should wait for free space in `folder`.
+
+        Downloads pause when the free space drops below `min_free_bytes` and resume only once it is back
+        above `resume_free_bytes`, so a run does not flap around a single threshold. Pausing and resuming
+        are printed.
+
+        Args:
+            folder (Path): A folder on the volume the files are written to.
+
+        Returns:
+            bool: True if downloads may start.
+        """
+        if self.min_free_bytes is None:
+            return True
+        try:
+            free = shutil.disk_usage(folder).free
+        except OSError:
+            return True # the folder is not there yet, nothing to protect
+        with self.lock:
+            if not self.paused and free < self.min_free_bytes:
+                self.paused = True
+                print(f"Only {free // 2 ** 20} MB free in {folder}, pausing new downloads until {self.resume_free_bytes // 2 ** 20} MB are free")
+            elif self.paused and free >= self.resume_free_bytes:
+                self.paused = False
+                print(f"{free // 2 ** 20} MB free in {folder}, resuming downloads")
+            return not self.paused
+
+    def too_large(self, size: int) -> bool:
+        """
+        Return True if a file of `size` bytes is over `max_file_size`.
+        """
+        return self.max_file_size is not None and size > self.max_file_size
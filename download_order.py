@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from scheduler import HostScheduler
+
+SIZE_ORDERS = ("smallest", "largest") # values of DownloadOrder.size
+
+class DownloadOrder:
+    def __init__(self, columns=None, ascending=True, size: str = None, size_column: str = None,
+                 spread_hosts: bool = False, ids=None, sample=None, seed: int = 0):
+        if size not in (None, *SIZE_ORDERS):
+            raise ValueError(f"size must be one of {SIZE_ORDERS} or None, not {size!r}")
+        self.columns = [columns] if isinstance(columns, str) else list(columns or []) # sort keys, e.g. ["Pub_Year"]
+        self.ascending = ascending # one bool for all columns or one per column
+        self.size = size # "smallest" first for quick results, "largest" first to shorten the tail, None to ignore sizes
+        self.size_column = size_column # column with a size estimate in bytes, used for rows the state store has no size for
+        self.spread_hosts = spread_hosts # take the sorted rows round-robin by host of their main URL
+        self.ids = ids # only download these BRnums, None for all rows
+        self.sample = sample # draw this many rows (int) or this share of the rows (float) at random, None for all
+        self.seed = seed # the same seed draws the same sample
+
+    def estimate_sizes(self, rows: pd.DataFrame, url_col: str, known_sizes: dict) -> pd.Series:
+        """
+        Return the known or estimated file size of every row, in bytes.
+
+        A size recorded in the state store by an earlier run wins, then the `size_column` of the list.
+        The remaining rows get the median known size of their host, or of all rows if their host has none,
+        and stay NaN if no size is known at all.
+
+        Args:
+            rows (DataFrame): The rows, indexed by BRnum.
+            url_col (str): The column of the URL whose host is used for the estimate.
+            known_sizes (dict): {BRnum: size} of files downloaded before, e.g. `DownloadStateStore.sizes()`.
+
+        Returns:
+            Series: The sizes, indexed like `rows`.
+        """
+        sizes = pd.Series(rows.index.astype(str).map(known_sizes), index=rows.index, dtype=float)
+        if self.size_column is not None:
+            sizes = sizes.fillna(pd.to_numeric(rows[self.size_column], errors="coerce"))
+        if sizes.isna().all() or sizes.notna().all():
+            return sizes
+        hosts = rows[url_col].map(HostScheduler.host_of)
+        sizes = sizes.fillna(sizes.groupby(hosts).transform("median"))
+        return sizes.fillna(sizes.median())
+
+    def select(self, df: pd.DataFrame, number_of_files: int = None, url_col: str = None, known_sizes: dict = None) -> pd.DataFrame:
+        """
+        Return the rows to download, in the order they should be downloaded.
+
+        The rows are first narrowed to `ids` and to a random `sample`, both keeping the order of the list.
+        They are then sorted by `columns` and by size, rows without a size last, and finally spread over
+        their hosts if `spread_hosts` is set. The first `number_of_files` rows of the result are returned.
+
+        Args:
+            df (DataFrame): The list of rows, indexed by BRnum.
+            number_of_files (int): The most rows to return. Default is None, which means all selected rows.
+            url_col (str): The column of the main URL, needed for size estimates and `spread_hosts`.
+            known_sizes (dict): {BRnum: size} of files downloaded before.
+
+        Returns:
+            DataFrame: The selected rows of `df`, in download order.
+
+        Raises:
+            KeyError: If a sort column, the size column or the URL column is missing.
+        """
+        rows = df
+        if self.ids is not None:
+            position = {str(br_number): i for i, br_number in enumerate(self.ids)}
+            rows = rows[rows.index.astype(str).isin(position)]
+            rows = rows.iloc[np.argsort(rows.index.astype(str).map(position).to_numpy(), kind="stable")] # in the order of `ids`
+        if self.sample is not None:
+            n = round(len(rows) * self.sample) if isinstance(self.sample, float) else self.sample
+            picks = np.random.default_rng(self.seed).choice(len(rows), size=min(n, len(rows)), replace=False)
+            rows = rows.iloc[np.sort(picks)]
+
+        keys = list(self.columns)
+        ascending = list(self.ascending) if isinstance(self.ascending, (list, tuple)) else [self.ascending] * len(keys)
+        if self.size is not None:
+            keys.append("_size")
+            ascending.append(self.size == "smallest")
+            rows = rows.assign(_size=self.estimate_sizes(rows, url_col, known_sizes or {}))
+        if keys:
+            rows = rows.sort_values(keys, ascending=ascending, kind="stable", na_position="last")
+            if self.size is not None:
+                rows = rows.drop(columns="_size")
+
+        if self.spread_hosts:
+            rows = rows.iloc[HostScheduler.interleave(range(len(rows)), rows[url_col])]
+        return rows.iloc[:number_of_files]
@@ -0,0 +1,327 @@
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from scheduler import HostScheduler
+
+DURATIONS = ("dns", "connect", "ttfb", "transfer") # per-attempt timings `download_pdf` puts into its info dict
+ERROR_KINDS = (("Failed to download:", "http"), ("Request timed out", "timeout"), ("Connection error", "connection"),
+               ("Chunked encoding error", "chunked"), ("Incomplete download", "incomplete"), ("Not a PDF", "not_pdf"),
+               ("I/O error", "io"), ("Request error", "request"), ("File too large", "too_large")) # error message prefix -> error kind label
+
+_timings = threading.local() # DNS and connect time of the connection the calling thread opened last
+
+def reset_connection_timings() -> None:
+    """
+    Forget the connection timings of the calling thread, before it makes a request.
+    """
+    _timings.values = {}
+
+def connection_timings() -> dict:
+    """
+    Return {"dns": ..., "connect": ...} for the connection the calling thread opened since the last reset,
+    or an empty dict if the request reused a pooled connection.
+    """
+    return getattr(_timings, "values", {})
+
+class _TimedConnectionMixin:
+    # Resolves the host itself, so DNS and TCP connect time can be told apart.
+    def _new_conn(self):
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            address = None # let urllib3 fail with its own NameResolutionError
+        resolved = time.perf_counter()
+        try:
+            if address is not None:
+                self._dns_host = address # TLS still verifies and sends SNI for self.host
+            sock = super()._new_conn()
+        except NewConnectionError:
+            if address is None:
+                raise
+            self._dns_host = host # the first address did not answer, let urllib3 try all of them
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = host
+        _timings.values = {"dns": resolved - start, "connect": time.perf_counter() - resolved}
+        return sock
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+TIMED_POOL_CLASSES = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool} # for PoolManager.pool_classes_by_scheme
+
+def aiohttp_trace_config():
+    """
+    Return an aiohttp TraceConfig that puts the DNS and connect time of new connections into the info
+    dict passed as `trace_request_ctx`, like the timed connections do for requests.
+    """
+    import aiohttp
+
+    async def dns_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def dns_end(session, context, params):
+        if isinstance(context.trace_request_ctx, dict):
+            context.trace_request_ctx["dns"] = time.perf_counter() - context.dns_start
+
+    async def connect_start(session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def connect_end(session, context, params):
+        info = context.trace_request_ctx
+        if isinstance(info, dict):
+            info.setdefault("dns", 0.0) # IP addresses are not resolved
+            info["connect"] = time.perf_counter() - context.connect_start - info["dns"] # aiohttp resolves inside the connect
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(dns_start)
+    trace_config.on_dns_resolvehost_end.append(dns_end)
+    trace_config.on_connection_create_start.append(connect_start)
+    trace_config.on_connection_create_end.append(connect_end)
+    return trace_config
+
+def error_kind(error: str) -> str:
+    """
+    Return a short label for an error message, e.g. "http_404", "timeout" or "not_pdf".
+    """
+    for prefix, kind in ERROR_KINDS:
+        if error.startswith(prefix):
+            if kind == "http":
+                status = error[len(prefix):].split("-")[0].strip()
+                return f"http_{status}" if status.isdigit() else kind
+            return kind
+    return "other"
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+class Metrics:
+    def __init__(self, exporters=None, flush_interval: float = 10.0):
+        self.exporters = list(exporters or []) # callables that receive every event dict
+        self.flush_interval = flush_interval # seconds between periodic exporter flushes
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {} # (name, labels) -> [count, sum, max]
+        self._last_flush = time.monotonic()
+        self._flush_lock = threading.Lock() # exporters write files, one flush at a time
+
+    def add_exporter(self, exporter) -> None:
+        """
+        Register a callback or exporter.
+
+        Any callable that takes one event dict is a valid callback. Exporters may also have a
+        `flush(metrics)` method, called periodically and at the end of a run, and a `close()` method.
+        """
+        self.exporters.append(exporter)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Add `value` to a counter.
+        """
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """
+        Set a gauge to its current value.
+        """
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Add one observation (e.g. a duration in seconds) to a summary that keeps its count, sum and maximum.
+        """
+        key = _key(name, labels)
+        with self.lock:
+            summary = self.summaries.setdefault(key, [0, 0.0, value])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    def emit(self, event: str, **fields) -> None:
+        """
+        Pass an event to every callback and flush the exporters if `flush_interval` has passed.
+
+        A failing callback is reported and skipped, it never fails a download.
+
+        Args:
+            event (str): The kind of event, e.g. "attempt", "file", "retry" or "prepare".
+            **fields: The data of the event. A "time" and an "event" field are added.
+        """
+        record = {"time": time.time(), "event": event, **fields}
+        for exporter in self.exporters:
+            try:
+                exporter(record)
+            except Exception as e:
+                print(f"Metrics exporter {exporter!r} failed: {e}")
+        with self.lock:
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self._last_flush = time.monotonic() # only this thread flushes
+        if due:
+            self.flush()
+
+    def record_attempt(self, br_number, url: str, info: dict, success: bool, error: str = "") -> None:
+        """
+        Record one request: its DNS/connect/TTFB/transfer times, bytes and, for a failure, the error of its host.
+
+        Args:
+            br_number: The id of the row the request was made for.
+            url (str): The requested URL.
+            info (dict): The metadata `download_pdf` collected for the request.
+            success (bool): Whether the request succeeded.
+            error (str): The error message of a failed request.
+        """
+        host = HostScheduler.host_of(url)
+        self.inc("requests_total", host=host)
+        if "dns" in info:
+            self.inc("connections_opened_total", host=host)
+        for name in DURATIONS:
+            if info.get(name) is not None:
+                self.observe(f"{name}_seconds", info[name])
+        if info.get("bytes"):
+            self.inc("bytes_total", info["bytes"], host=host)
+        if not success:
+            self.inc("errors_total", host=host, kind=error_kind(error))
+        self.emit("attempt", id=str(br_number), url=url, host=host, success=success, error=error,
+                  http_status=info.get("http_status"), bytes=info.get("bytes", 0),
+                  **{name: info.get(name) for name in DURATIONS})
+
+    def record_retry(self, br_number, url: str, attempt: int) -> None:
+        """
+        Record that a URL is going to be tried again after its `attempt`-th try failed.
+        """
+        self.inc("retries_total", host=HostScheduler.host_of(url))
+        self.emit("retry", id=str(br_number), url=url, attempt=attempt)
+
+    def record_file(self, br_number, result: str, url: str, error: str = "") -> None:
+        """
+        Record the final result of a row.
+        """
+        self.inc("files_total", result=result)
+        self.emit("file", id=str(br_number), result=result, url=url, error=error)
+
+    def snapshot(self) -> dict:
+        """
+        Return copies of the counters, gauges and summaries, keyed by (name, ((label, value), ...)).
+        """
+        with self.lock:
+            return {"counters": dict(self.counters), "gauges": dict(self.gauges),
+                    "summaries": {key: tuple(value) for key, value in self.summaries.items()}}
+
+    def flush(self) -> None:
+        """
+        Let every exporter with a `flush` method write out the current state.
+        """
+        with self._flush_lock:
+            self._last_flush = time.monotonic()
+            for exporter in self.exporters:
+                if hasattr(exporter, "flush"):
+                    try:
+                        exporter.flush(self)
+                    except Exception as e:
+                        print(f"Metrics exporter {exporter!r} failed to flush: {e}")
+
+    def close(self) -> None:
+        """
+        Flush and close every exporter.
+        """
+        self.flush()
+        for exporter in self.exporters:
+            if hasattr(exporter, "close"):
+                exporter.close()
+
+class JsonLinesExporter:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self._file = None
+
+    def __call__(self, record: dict) -> None:
+        """
+        Append one event to the file as a JSON line.
+        """
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+
+    def flush(self, metrics: Metrics) -> None:
+        """
+        Push the buffered lines to disk.
+        """
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self) -> None:
+        """
+        Close the file.
+        """
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class PrometheusTextExporter:
+    def __init__(self, path, prefix: str = "pdfdownloader"):
+        self.path = Path(path)
+        self.prefix = prefix # prepended to every metric name
+
+    def __call__(self, record: dict) -> None:
+        pass # only the aggregated state is exported, in flush
+
+    def flush(self, metrics: Metrics) -> None:
+        """
+        Write the counters, gauges and summaries in the Prometheus text format, for node_exporter's textfile collector.
+
+        The file is written next to its final name and renamed into place, so a scrape never sees half of it.
+        """
+        snapshot = metrics.snapshot()
+        lines = []
+        for kind, values in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+                lines.extend(f"{self.prefix}_{name}{self._labels(labels)} {value}"
+                             for (metric, labels), value in sorted(values.items()) if metric == name)
+        for name in sorted({name for name, _ in snapshot["summaries"]}):
+            summaries = [(labels, value) for (metric, labels), value in sorted(snapshot["summaries"].items()) if metric == name]
+            lines.append(f"# TYPE {self.prefix}_{name} summary")
+            for labels, (count, total, _) in summaries:
+                lines.append(f"{self.prefix}_{name}_count{self._labels(labels)} {count}")
+                lines.append(f"{self.prefix}_{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"# TYPE {self.prefix}_{name}_max gauge")
+            lines.extend(f"{self.prefix}_{name}_max{self._labels(labels)} {maximum}" for labels, (_, _, maximum) in summaries)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
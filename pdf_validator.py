@@ -0,0 +1,67 @@
+import re
+from pathlib import Path
+
+STARTXREF_PATTERN = re.compile(rb"startxref\s+(\d+)\s+%%EOF")
+XREF_STREAM_PATTERN = re.compile(rb"\s*\d+\s+\d+\s+obj\b") # PDF 1.5+ files may use a cross-reference stream object instead of a table
+
+class PdfValidator:
+    def __init__(self, workers: int = 2, queue_size: int = 64, max_requeues: int = 1, tail_bytes: int = 2048):
+        self.workers = workers # threads that validate files while the downloads go on
+        self.queue_size = queue_size # downloaded files waiting for validation before no new rows are started
+        self.max_requeues = max_requeues # times a corrupt file is downloaded again before it is reported as corrupt
+        self.tail_bytes = tail_bytes # how much of the end of the file is searched for startxref and %%EOF
+
+    def validate(self, path) -> dict:
+        """
+        Check that a downloaded file is a complete, readable PDF and extract its metadata.
+
+        The end of the file must hold a `startxref` offset followed by `%%EOF`, otherwise the file is treated
+        as truncated. The file is then opened with PyPDF2, which has to find at least one page. An offset that
+        does not point at a cross-reference table or stream is only a warning: many real PDFs have a slightly
+        wrong one, and PyPDF2 repairs it.
+
+        Args:
+            path (Path): The PDF file to check.
+
+        Returns:
+            dict: {"valid": bool, "error": str, "warning": str, "pages": int, "title": str, "producer": str}.
+            The error is empty for a valid file and the warning empty for a file without problems; the metadata
+            is None where the file does not have it.
+
+        Raises:
+            ImportError: If PyPDF2 is not installed.
+        """
+        from PyPDF2 import PdfReader # only needed when validating
+
+        result = {"valid": False, "error": "", "warning": "", "pages": None, "title": None, "producer": None}
+        path = Path(path)
+        try:
+            with open(path, "rb") as f:
+                size = path.stat().st_size
+                f.seek(max(0, size - self.tail_bytes))
+                matches = STARTXREF_PATTERN.findall(f.read())
+                if not matches:
+                    result["error"] = "no startxref/%%EOF at the end of the file, it is probably truncated"
+                    return result
+                offset = int(matches[-1])
+                f.seek(offset)
+                head = f.read(32)
+                if offset >= size or not (head.lstrip().startswith(b"xref") or XREF_STREAM_PATTERN.match(head)):
+                    result["warning"] = f"startxref {offset} does not point at a cross-reference table"
+
+                f.seek(0)
+                reader = PdfReader(f, strict=False)
+                result["pages"] = len(reader.pages)
+                metadata = reader.metadata
+                if metadata is not None:
+                    result["title"] = str(metadata.title) if metadata.title else None
+                    result["producer"] = str(metadata.producer) if metadata.producer else None
+            if not result["pages"]:
+                result["error"] = "the document has no pages"
+                return result
+            result["valid"] = True
+        except OSError as ioe:
+            result["error"] = f"could not read the file: {ioe}"
+        except Exception as e: # PyPDF2 raises many different errors for broken files
+            result["error"] = f"unreadable: {type(e).__name__}: {e}"
+        return result
@@ -0,0 +1,218 @@
+import concurrent.futures
+import threading
+
+import numpy as np
+import pandas as pd
+import requests
+
+from scheduler import HostScheduler
+
+DEAD_STATUSES = (404, 410, 451) # answers that mean the file is gone for good; anything else is still tried
+HEAD_FALLBACK_STATUSES = (400, 403, 405, 501) # HEAD answers that servers give for HEAD only, checked again with a GET
+PDF_TYPES = ("application/pdf", "application/x-pdf", "application/octet-stream", "binary/octet-stream") # may hold a PDF
+PROBE_FIELDS = ("status", "final_url", "content_type", "content_length", "error") # columns per URL column of `probe`
+
+class Preflight:
+    def __init__(self, workers: int = 32, timeout: float = 10.0, scheduler=None):
+        self.workers = workers # probes in flight at a time
+        self.timeout = timeout # seconds per request
+        self.scheduler = scheduler # HostScheduler that paces the probes per host, if any
+        self._local = threading.local() # one session per probing thread
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def _session(self) -> requests.Session:
+        """
+        Return the session of the calling thread, creating it on first use.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    @staticmethod
+    def _length(response) -> float:
+        """
+        Return the full size of the resource a response describes, NaN if it does not tell.
+
+        A 206 answer to a one-byte Range request carries the size in Content-Range ("bytes 0-0/<size>").
+        """
+        content_range = response.headers.get("content-range", "")
+        if response.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1].strip()
+            return float(total) if total.isdigit() else np.nan
+        length = response.headers.get("content-length", "")
+        return float(length) if length.isdigit() else np.nan
+
+    def probe_url(self, url) -> dict:
+        """
+        Ask a server about a URL without downloading it.
+
+        A HEAD request is sent first, following redirects. Servers that reject HEAD, or do not tell the size,
+        are asked again with a GET for the first byte only (`Range: bytes=0-0`), whose body is not read.
+
+        Args:
+            url (str): The URL to probe.
+
+        Returns:
+            dict: status (0 if no response), final_url, content_type, content_length (NaN if unknown) and error.
+        """
+        result = {"status": 0, "final_url": "", "content_type": "", "content_length": np.nan, "error": ""}
+        if not isinstance(url, str) or not url.strip():
+            result["error"] = "No URL"
+            return result
+        host = HostScheduler.host_of(url)
+        if self.scheduler is not None:
+            self.scheduler.acquire(host)
+        status = None
+        try:
+            session = self._session()
+            with session.head(url, allow_redirects=True, timeout=self.timeout) as response:
+                status = response.status_code
+                result.update(status=status, final_url=response.url, content_length=self._length(response),
+                              content_type=(response.headers.get("content-type") or "").split(";")[0].strip().lower())
+            if status in HEAD_FALLBACK_STATUSES or (status < 400 and np.isnan(result["content_length"])):
+                with session.get(url, stream=True, timeout=self.timeout, headers={"Range": "bytes=0-0", "Accept-Encoding": "identity"}) as response:
+                    status = response.status_code
+                    result.update(status=status, final_url=response.url, content_length=self._length(response),
+                                  content_type=(response.headers.get("content-type") or "").split(";")[0].strip().lower())
+        except requests.exceptions.Timeout as e:
+            result["error"] = f"Request timed out: {e}"
+        except requests.exceptions.ConnectionError as e:
+            result["error"] = f"Connection error: {e}"
+        except requests.exceptions.RequestException as e:
+            result["error"] = f"Request error: {e}"
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.release(host, 0.0, status, timed_out=result["error"].startswith("Request timed out"))
+        return result
+
+    def probe(self, df: pd.DataFrame, columns) -> pd.DataFrame:
+        """
+        Probe the URLs of every row in `columns` concurrently, each distinct URL once.
+
+        The URLs are probed round-robin by host, so no host gets all the early requests.
+
+        Args:
+            df (DataFrame): The rows, indexed by BRnum, e.g. the filtered `df2` of `PreparePdfDownloader`.
+            columns (list[str]): The URL columns, e.g. [main_col, secondary_col].
+
+        Returns:
+            DataFrame: Indexed like `df`, with <column>_<field> for every column and field of PROBE_FIELDS.
+        """
+        urls = pd.unique(pd.concat([df[column] for column in columns]).dropna().to_numpy())
+        urls = HostScheduler.interleave(list(urls), list(urls))
+        results = {}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for url, result in zip(urls, executor.map(self.probe_url, urls)):
+                    results[url] = result
+        finally:
+            with self._sessions_lock:
+                for session in self._sessions:
+                    session.close()
+                self._sessions.clear()
+            self._local = threading.local()
+
+        missing = self.probe_url(None)
+        probes = pd.DataFrame(index=df.index)
+        for column in columns:
+            found = [results.get(url, missing) if isinstance(url, str) else missing for url in df[column]]
+            for field in PROBE_FIELDS:
+                probes[f"{column}_{field}"] = [result[field] for result in found]
+        return probes
+
+    @staticmethod
+    def plan(probes: pd.DataFrame, main_col: str, secondary_col: str) -> pd.DataFrame:
+        """
+        Turn probes into a plan: which column to try first for every row, its expected size, or that it is dead.
+
+        A URL is dead if it has no URL or answered with one of DEAD_STATUSES. A URL that answered with
+        another error, or not at all, may still work and is kept. The main column goes first unless it is dead or
+        not a PDF while the secondary one looks like a PDF. A row whose two URLs are dead is not downloaded.
+
+        Args:
+            probes (DataFrame): The result of `probe` for [main_col, secondary_col].
+            main_col (str): The main URL column.
+            secondary_col (str): The secondary URL column.
+
+        Returns:
+            DataFrame: Indexed by BRnum, with first (main_col, secondary_col or "" for a dead row), dead,
+            main_dead and secondary_dead, status, size (NaN if unknown) and host of the URL tried first.
+        """
+        def column_state(column):
+            status = probes[f"{column}_status"].to_numpy()
+            dead = np.isin(status, DEAD_STATUSES) | (probes[f"{column}_error"].to_numpy() == "No URL")
+            is_pdf = (status > 0) & (status < 400) & probes[f"{column}_content_type"].isin(PDF_TYPES).to_numpy()
+            return dead, is_pdf
+
+        main_dead, main_pdf = column_state(main_col)
+        secondary_dead, secondary_pdf = column_state(secondary_col)
+        dead = main_dead & secondary_dead
+        secondary_first = ~dead & (main_dead | (~main_pdf & secondary_pdf & ~secondary_dead))
+        pick = lambda field: np.where(secondary_first, probes[f"{secondary_col}_{field}"].to_numpy(), probes[f"{main_col}_{field}"].to_numpy())
+        urls = pick("final_url")
+        return pd.DataFrame({
+            "first": np.where(dead, "", np.where(secondary_first, secondary_col, main_col)),
+            "dead": dead,
+            "main_dead": main_dead,
+            "secondary_dead": secondary_dead,
+            "status": pick("status"),
+            "size": np.where(dead, np.nan, pick("content_length").astype(float)),
+            "host": [HostScheduler.host_of(url) if url else "" for url in urls],
+        }, index=probes.index)
+
+    @staticmethod
+    def summarize(plan: pd.DataFrame, main_col: str, top: int = 10) -> dict:
+        """
+        Print and return what a plan expects of the run: rows, dead rows, expected bytes and the load per host.
+
+        Rows with an unknown size count with the median known size in the expected bytes.
+
+        Args:
+            plan (DataFrame): The result of `plan`.
+            main_col (str): The main URL column, to count the rows that try the secondary one first.
+            top (int): The number of busiest hosts printed.
+
+        Returns:
+            dict: rows, dead, secondary_first, unknown_sizes, expected_bytes and hosts, a DataFrame of the
+            rows and expected bytes per host, busiest first.
+        """
+        alive = plan[~plan["dead"]]
+        sizes = alive["size"].fillna(alive["size"].median()).fillna(0)
+        hosts = pd.DataFrame({"rows": alive.groupby("host").size(), "bytes": sizes.groupby(alive["host"]).sum()})
+        hosts = hosts.sort_values(["rows", "bytes"], ascending=False)
+        summary = {
+            "rows": len(plan),
+            "dead": int(plan["dead"].sum()),
+            "secondary_first": int(((plan["first"] != "") & (plan["first"] != main_col)).sum()),
+            "unknown_sizes": int(alive["size"].isna().sum()),
+            "expected_bytes": int(sizes.sum()),
+            "hosts": hosts,
+        }
+        print(f"Preflight: {summary['rows']} rows, {summary['dead']} dead, {summary['unknown_sizes']} of unknown size, "
+              f"about {summary['expected_bytes'] / 2 ** 20:.1f} MB to download from {len(hosts)} hosts")
+        for host, row in hosts.head(top).iterrows():
+            print(f"  {host or '(no host)'}: {row['rows']} rows, {row['bytes'] / 2 ** 20:.1f} MB")
+        return summary
+
+    @staticmethod
+    def save(plan: pd.DataFrame, path) -> None:
+        """
+        Write a plan to a CSV file, e.g. preflight.csv in the output folder, for a later run to use.
+        """
+        plan.to_csv(path, index_label="BRnum")
+
+    @staticmethod
+    def load(path) -> pd.DataFrame:
+        """
+        Read a plan written by `save`.
+        """
+        plan = pd.read_csv(path, index_col="BRnum", dtype={"BRnum": str, "first": str, "host": str}, keep_default_na=False,
+                           na_values={"size": [""]})
+        for column in ("dead", "main_dead", "secondary_dead"):
+            if column in plan.columns:
+                plan[column] = plan[column].astype(str) == "True"
+        return plan
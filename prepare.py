@@ -1,25 +1,35 @@
 
+import csv
 import pandas as pd
-import glob
 import os
+import sqlite3
+import time
 from pathlib import Path
 
+from state_store import DownloadStateStore, DONE_STATUSES
+
 class PreparePdfDownloader:
-    def __init__(self, list_path, output_folder, main_col, secondary_col, id_col="BRnum"):
+    def __init__(self, list_path, output_folder, main_col, secondary_col, id_col="BRnum", state_store=None, metrics=None):
         self.list_path = list_path
         self.output_folder = Path(output_folder)
         self.dwn_folder = self.output_folder / "dwn"
         self.main_col = main_col
         self.secondary_col = secondary_col
         self.id_col = id_col
+        self.state_store = state_store
+        self.metrics = metrics # Metrics that records how many rows were read and skipped, if any
 
     def prepare_folders_and_find_pdf_duplicates(self) -> list[str]:
         """
         Create output and download folders if they don't exist.
-        Return a list of existing PDF filenames (without extension) in the download folder.
+        Return a list of the ids that are already downloaded.
+
+        The ids are read from the download state store (`download_state.sqlite` in the output folder) instead
+        of scanning the download folder. The first time a store is created, the PDFs already in the download
+        folder are imported into it once.
 
         Returns:
-            List[str]: A list of existing PDF filenames (without the .pdf extension).
+            List[str]: A list of downloaded ids (the PDF filenames without the .pdf extension).
 
         Raises:
             PermissionError: If there are permission issues creating the folders.
@@ -30,27 +40,60 @@ class PreparePdfDownloader:
             self.output_folder.mkdir(parents=True, exist_ok=True)
             self.dwn_folder.mkdir(parents=True, exist_ok=True)
 
-            self.dwn_files = glob.glob(str(self.dwn_folder / "*.pdf"))
-            exist = [os.path.basename(f)[:-4] for f in self.dwn_files]
+            if self.state_store is None:
+                self.state_store = DownloadStateStore(self.output_folder / "download_state.sqlite")
+            if self.state_store.is_empty():
+                imported = self.state_store.import_folder(self.dwn_folder)
+                if imported:
+                    print(f"Imported {imported} existing PDF files into the download state store.")
 
-            return exist
+            return self.state_store.downloaded_ids()
 
         except PermissionError as pe:
             print(f"Error: Permission denied when creating folders - {pe}")
         except OSError as ose:
             print(f"Error: OS error during folder creation - {ose}")
+        except sqlite3.Error as se:
+            print(f"Error: Could not read the download state store - {se}")
         except Exception as e:
             print(f"Unexpected error in prepare_folders_and_list_downloaded_files(): {e}")
         
         return []
 
+    def find_downloaded_ids(self) -> list[str]:
+        """
+        Return the ids that are already downloaded without creating any folder or store, e.g. for a dry run.
+
+        The state store is opened read-only if it exists; otherwise the PDFs in the download folder are listed.
+
+        Returns:
+            List[str]: The downloaded ids, empty if nothing was downloaded yet.
+        """
+        path = self.output_folder / "download_state.sqlite"
+        try:
+            if path.exists():
+                conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+                try:
+                    placeholders = ", ".join("?" for _ in DONE_STATUSES)
+                    return [row[0] for row in conn.execute(f"SELECT brnum FROM downloads WHERE status IN ({placeholders})", DONE_STATUSES)]
+                finally:
+                    conn.close()
+            if self.dwn_folder.exists():
+                with os.scandir(self.dwn_folder) as entries:
+                    return [entry.name[:-4] for entry in entries if entry.name.endswith(".pdf")]
+        except sqlite3.Error as se:
+            print(f"Error: Could not read the download state store - {se}")
+        except OSError as ose:
+            print(f"Error: Could not list the download folder - {ose}")
+        return []
+
     def load_and_filter_excel_data(self, exist:list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
         """
         Load the Excel file into a DataFrame, validate required columns,
         filter out rows with missing values, and filter out already downloaded entries.
 
         Args:
-            exist (list[str]): List of existing PDF filenames (without extension) to filter out.
+            exist (list[str]): List of already downloaded ids to filter out.
 
         Raises:
             FileNotFoundError: If the Excel file does not exist.
@@ -61,6 +104,7 @@ class PreparePdfDownloader:
             Exception: For any other unexpected errors.
         """
         try:
+            start_time = time.perf_counter()
             if not os.path.isfile(self.list_path):
                 raise FileNotFoundError(f"The Excel file does not exist at: {self.list_path}")
 
@@ -75,8 +119,11 @@ class PreparePdfDownloader:
             df = df[df[self.main_col].notnull() & df[self.secondary_col].notnull()]
 
             self.df = df
-            self.df2 = df[~df.index.isin(exist)].copy()
+            self.df2 = df[~df.index.astype(str).isin(exist)].copy()
 
+            if self.metrics is not None:
+                self.metrics.observe("prepare_seconds", time.perf_counter() - start_time, stage="load")
+                self.metrics.emit("prepare", rows=len(df), pending=len(self.df2), skipped=len(df) - len(self.df2))
             return self.df, self.df2
         except FileNotFoundError as fnf_error:
             print(f"Error: Excel file not found - {fnf_error}")
@@ -90,3 +137,112 @@ class PreparePdfDownloader:
             print(f"Error: Invalid parameters when reading Excel - {ve}")
         except Exception as e:
             print(f"Unexpected error in load_and_filter_excel_data(): {e}")
+
+    def iter_filtered_batches(self, exist: list[str], batch_size: int = 500):
+        """
+        Read the list lazily and yield batches of rows that still need to be downloaded.
+
+        Unlike `load_and_filter_excel_data`, the list is never loaded into a DataFrame. Excel files are read
+        with openpyxl in read-only mode, CSV files with the csv module and Parquet files (which need pyarrow)
+        in record batches, so the first batch is ready as soon as its rows have been read and memory use does
+        not depend on the length of the list. Rows with a missing URL and rows in `exist` are skipped,
+        as in `load_and_filter_excel_data`.
+
+        Args:
+            exist (list[str]): List of already downloaded ids to filter out.
+            batch_size (int): Number of rows per batch.
+
+        Yields:
+            list[tuple[str, str, str]]: Batches of (BRnum, main_url, secondary_url).
+
+        Raises:
+            FileNotFoundError: If the list file does not exist.
+            KeyError: If required columns are missing in the list.
+            ImportError: If a Parquet list is read without pyarrow installed.
+            Exception: For any other unexpected errors.
+        """
+        exist = set(exist)
+        batch = []
+        skipped = 0
+        try:
+            if not os.path.isfile(self.list_path):
+                raise FileNotFoundError(f"The list file does not exist at: {self.list_path}")
+
+            for br_number, url_main, url_secondary in self._iter_rows():
+                if not url_main or not url_secondary or str(br_number) in exist:
+                    skipped += 1
+                    continue # same filter as load_and_filter_excel_data
+                batch.append((str(br_number), url_main, url_secondary))
+                if len(batch) >= batch_size:
+                    self._record_batch(batch, skipped)
+                    yield batch
+                    batch, skipped = [], 0
+            if batch or skipped:
+                self._record_batch(batch, skipped)
+            if batch:
+                yield batch
+        except FileNotFoundError as fnf_error:
+            print(f"Error: List file not found - {fnf_error}")
+        except KeyError as ke:
+            print(f"Error: Missing expected column in list - {ke}")
+        except ImportError as ie:
+            print(f"Error: Missing optional dependency for reading the list - {ie}")
+        except Exception as e:
+            print(f"Unexpected error in iter_filtered_batches(): {e}")
+
+    def _record_batch(self, batch: list, skipped: int) -> None:
+        """
+        Count the rows of a streamed batch and the rows skipped while reading it, if there are metrics.
+        """
+        if self.metrics is not None:
+            self.metrics.inc("rows_read_total", len(batch) + skipped)
+            self.metrics.inc("rows_skipped_total", skipped)
+            self.metrics.emit("prepare", rows=len(batch) + skipped, pending=len(batch), skipped=skipped)
+
+    def _iter_rows(self):
+        """
+        Yield (id, main_url, secondary_url) for every row of the list, in file order.
+        """
+        suffix = Path(self.list_path).suffix.lower()
+        columns = [self.id_col, self.main_col, self.secondary_col]
+
+        if suffix == ".csv":
+            with open(self.list_path, newline="", encoding="utf-8-sig") as f:
+                reader = csv.reader(f)
+                positions = self._column_positions(next(reader, []), columns)
+                for row in reader:
+                    yield tuple(row[i] if i < len(row) else None for i in positions)
+
+        elif suffix == ".parquet":
+            import pyarrow.parquet as pq # optional, only needed for Parquet lists
+
+            parquet_file = pq.ParquetFile(self.list_path)
+            self._column_positions(parquet_file.schema_arrow.names, columns)
+            for record_batch in parquet_file.iter_batches(columns=columns):
+                yield from zip(*(record_batch.column(name).to_pylist() for name in columns))
+
+        else:
+            import openpyxl # only needed for Excel lists, and slow to import
+
+            workbook = openpyxl.load_workbook(self.list_path, read_only=True, data_only=True)
+            try:
+                rows = workbook.worksheets[0].iter_rows(values_only=True)
+                positions = self._column_positions(next(rows, ()), columns)
+                for row in rows:
+                    yield tuple(row[i] if i < len(row) else None for i in positions)
+            finally:
+                workbook.close()
+
+    @staticmethod
+    def _column_positions(header, columns: list[str]) -> list[int]:
+        """
+        Return the position of each of `columns` in `header`.
+
+        Raises:
+            KeyError: If one of the columns is missing.
+        """
+        header = [str(name) if name is not None else "" for name in header]
+        for col in columns:
+            if col not in header:
+                raise KeyError(f"Missing required column: {col}")
+        return [header.index(col) for col in columns]
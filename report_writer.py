@@ -1,7 +1,142 @@
 import csv
 import os
+import queue
+import threading
+import time
+from pathlib import Path
 
 class ReportWriter:
+    def __init__(self, flush_interval: float = 1.0, batch_size: int = 500, metrics=None):
+        self.flush_interval = flush_interval # seconds the writer thread waits before flushing a partial batch
+        self.batch_size = batch_size # rows written per flush at most
+        self.metrics = metrics # Metrics that records the writer lag and queue depth, if any
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self, output_folder, filename: str = "Download_result_report.csv", sep: str = ";", extra_columns: tuple = ()) -> None:
+        """
+        Start the writer thread that appends submitted rows to the report in batches.
+
+        Download workers call `submit`, which only puts the row on a queue, so they never wait for the disk.
+        The writer thread flushes every `batch_size` rows or `flush_interval` seconds, whichever comes first,
+        and `stop` flushes the rest. Calling `start` while the writer is running does nothing.
+
+        Args:
+            output_folder (str): The folder the report is written to.
+            filename (str): The name of the CSV file to write the report to. Default is "Download_result_report.csv".
+            sep (str): The separator to use in the CSV file. Default is ";".
+            extra_columns (tuple[str]): Header of the extra values rows may carry after Name and Result, e.g. PDF metadata.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        report_path = Path(output_folder) / filename
+        header = ["Name", "Result", *extra_columns]
+        self._thread = threading.Thread(target=self._run, args=(report_path, sep, header), name="report-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, name: str, result: str, extra: tuple = ()) -> None:
+        """
+        Queue one report row for the writer thread. Never blocks on file I/O.
+
+        Args:
+            name (str): The name or identifier of the file being reported on.
+            result (str): The result of the download attempt (e.g., "Downloaded", "Unchanged", "Not a PDF", "Not downloaded").
+            extra (tuple): Values for the `extra_columns` given to `start`.
+
+        Raises:
+            RuntimeError: If the writer thread has not been started.
+        """
+        if self._thread is None:
+            raise RuntimeError("ReportWriter.start() must be called before submit()")
+        self._queue.put(((name, result, *extra), time.monotonic()))
+
+    def flush(self, timeout: float = None) -> None:
+        """
+        Block until every row submitted so far is written to the report, e.g. before a checkpoint is saved.
+        Does nothing if the writer thread is not running.
+        """
+        if self._thread is None:
+            return
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait(timeout)
+
+    def stop(self) -> None:
+        """
+        Flush every queued row and stop the writer thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None) # sentinel
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, report_path: Path, sep: str, header: list) -> None:
+        """
+        Writer thread loop: collect rows from the queue and append them to the report in batches.
+        """
+        rows = []
+        stopping = False
+        while not stopping:
+            flushed = None # Event of a `flush` call, set once the rows before it are written
+            try:
+                row = self._queue.get(timeout=self.flush_interval)
+                while True:
+                    if row is None:
+                        stopping = True
+                        break
+                    if isinstance(row, threading.Event):
+                        flushed = row
+                        break
+                    rows.append(row)
+                    if len(rows) >= self.batch_size:
+                        break
+                    row = self._queue.get_nowait() # drain what is already queued without waiting
+            except queue.Empty:
+                pass
+            if rows:
+                self._write_rows(report_path, rows, sep, header)
+                rows = []
+            if flushed is not None:
+                flushed.set()
+
+    def _write_rows(self, report_path: Path, rows: list, sep: str, header: list) -> None:
+        """
+        Append `rows` to the report with a single open, writing the header first if the file is empty.
+
+        With metrics, the lag of the batch (how long its oldest row waited in the queue) and the number
+        of rows still queued are recorded.
+        """
+        try:
+            with open(report_path, "a", newline="", encoding="utf-8") as csvfile: # Opens the file in append mode
+                writer = csv.writer(csvfile, delimiter=sep)
+                if csvfile.tell() == 0: # if file is empty
+                    writer.writerow(header) # Write header
+                writer.writerows(row for row, _ in rows)
+            if self.metrics is not None:
+                self.metrics.observe("report_writer_lag_seconds", time.monotonic() - rows[0][1])
+                self.metrics.set_gauge("report_queue_depth", self._queue.qsize())
+                self.metrics.inc("report_rows_total", len(rows))
+            print(f"Wrote {len(rows)} report rows")
+        except (OSError, IOError) as file_error:
+            print(f"File I/O error when writing report: {file_error}")
+        except Exception as e:
+            print(f"Unexpected error in report writer: {e}")
+
+    @staticmethod
+    def read_results(output_folder, filename: str = "Download_result_report.csv", sep: str = ";") -> dict:
+        """
+        Return {Name: Result} of the rows already in a report, e.g. to resume a run without reporting them twice.
+        An empty dict is returned if the report does not exist.
+        """
+        try:
+            with open(Path(output_folder) / filename, newline="", encoding="utf-8") as csvfile:
+                reader = csv.reader(csvfile, delimiter=sep)
+                next(reader, None) # header
+                return {row[0]: row[1] for row in reader if len(row) >= 2}
+        except FileNotFoundError:
+            return {}
+
     def write_to_report(self, name: str, result: str, output_folder: str, filename: str ="Download_result_report.csv", sep: str =";") -> None:
         """
         Write the download result to a report file.
@@ -11,7 +146,7 @@ class ReportWriter:
 
         Args:
             name (str): The name or identifier of the file being reported on.
-            result (str): The result of the download attempt (e.g., "Downloaded", "Not downloaded").
+            result (str): The result of the download attempt (e.g., "Downloaded", "Unchanged", "Not a PDF", "Not downloaded").
             filename (str): The name of the CSV file to write the report to. Default is "Download_result_report.csv".
             sep (str): The separator to use in the CSV file. Default is ";".
             clean (bool): If True, clears the contents of the file before writing. Default is False.
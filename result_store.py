@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+RESULTS = ("", "Downloaded", "Unchanged", "Not a PDF", "Not downloaded", "Corrupt PDF") # result codes; 0 is a row without a final result
+USED_MAIN, USED_SECONDARY = 1, 2 # codes of the column whose URL a row used; 0 if none
+
+class ResultStore:
+    def __init__(self, ids, main_urls=None):
+        self.ids = pd.Index(ids) # the rows of the run, in download order
+        self.position = {str(br_number): i for i, br_number in enumerate(self.ids)}
+        self.main_urls = np.asarray(main_urls if main_urls is not None else [None] * len(self.ids), dtype=object)
+        size = len(self.ids)
+        self.status = np.zeros(size, dtype=np.int8) # index into RESULTS
+        self.used = np.zeros(size, dtype=np.int8) # USED_MAIN, USED_SECONDARY or 0
+        self.http_status = np.zeros(size, dtype=np.int16) # of the last response, 0 if there was none
+        self.bytes = np.zeros(size, dtype=np.int64)
+        self.seconds = np.full(size, np.nan) # time to first byte plus transfer of the last attempt
+        self.errors = np.full(size, "", dtype=object)
+        self._codes = {result: code for code, result in enumerate(RESULTS)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def record(self, br_number, result: str, url: str = None, error: str = "", http_status: int = None,
+               size: int = None, seconds: float = None) -> bool:
+        """
+        Record the final outcome of a row in its slot.
+
+        Every row is finished by one thread only, so threads write to different slots and need no lock;
+        nothing is written to the DataFrame until `materialize`.
+
+        Args:
+            br_number: The id of the row.
+            result (str): One of RESULTS, e.g. "Downloaded".
+            url (str): The URL the result came from; the main URL counts as the main column, any other as the secondary.
+            error (str): The error message of the row.
+            http_status (int): The HTTP status of the last response.
+            size (int): The size of the file, or the bytes received for a failed row.
+            seconds (float): The time the last attempt took.
+
+        Returns:
+            bool: False if the row is not part of this run, e.g. a row of a streamed list.
+        """
+        i = self.position.get(str(br_number))
+        if i is None:
+            return False
+        self.status[i] = self._codes.get(result, self._codes["Not downloaded"])
+        if url is not None:
+            self.used[i] = USED_MAIN if url == self.main_urls[i] else USED_SECONDARY
+        self.http_status[i] = http_status or 0
+        self.bytes[i] = size or 0
+        self.seconds[i] = np.nan if seconds is None else seconds
+        self.errors[i] = error or ""
+        return True
+
+    def error_of(self, br_number) -> str:
+        """
+        Return the error recorded for a row, "" if it has none or is not part of this run.
+        """
+        i = self.position.get(str(br_number))
+        return "" if i is None else self.errors[i]
+
+    def to_frame(self, main_col: str = "main", secondary_col: str = "secondary") -> pd.DataFrame:
+        """
+        Return the rows that have a final result as a DataFrame indexed like the run's rows.
+
+        Columns: result, used_column (`main_col` or `secondary_col`), http_status, bytes, seconds and error.
+        """
+        done = self.status > 0
+        columns = np.array(["", main_col, secondary_col], dtype=object)
+        return pd.DataFrame({
+            "result": np.array(RESULTS, dtype=object)[self.status[done]],
+            "used_column": columns[self.used[done]],
+            "http_status": self.http_status[done],
+            "bytes": self.bytes[done],
+            "seconds": self.seconds[done],
+            "error": self.errors[done],
+        }, index=self.ids[done])
+
+    def materialize(self, df: pd.DataFrame, main_col: str = "main", secondary_col: str = "secondary") -> int:
+        """
+        Write the recorded outcomes into `df` in one go, one column at a time.
+
+        The result, used_column, http_status, bytes and seconds columns are set for every finished row.
+        The error column is only set where a row has an error, like the engines always did, so the error
+        of an earlier run is not wiped by an empty one.
+
+        Args:
+            df (DataFrame): The list the run's rows come from, indexed by BRnum.
+            main_col (str): The name written for rows that used the main URL.
+            secondary_col (str): The name written for rows that used the secondary URL.
+
+        Returns:
+            int: The number of rows written.
+        """
+        frame = self.to_frame(main_col, secondary_col)
+        if frame.empty:
+            return 0
+        for column in ("result", "used_column", "http_status", "bytes", "seconds"):
+            df.loc[frame.index, column] = frame[column].to_numpy()
+        failed = frame[frame["error"] != ""]
+        if not failed.empty:
+            if "error" not in df.columns or df["error"].dtype != object:
+                df["error"] = df["error"].astype(object) if "error" in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+            df.loc[failed.index, "error"] = failed["error"].to_numpy()
+        return len(frame)
@@ -0,0 +1,53 @@
+import random
+import threading
+
+RETRYABLE_STATUSES = (408, 425, 429, 500, 502, 503, 504) # HTTP statuses worth trying again later
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 3, run_budget: int = None, base_delay: float = 1.0,
+                 max_delay: float = 60.0, jitter: float = 0.5):
+        self.max_attempts = max_attempts # attempts per URL, including the first one
+        self.run_budget = run_budget # retries allowed for the whole run, None for no limit
+        self.base_delay = base_delay # seconds before the first retry
+        self.max_delay = max_delay # upper bound of the backoff
+        self.jitter = jitter # fraction of the delay that is randomized, 0 for none
+        self.retries_used = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_retryable_status(status_code: int) -> bool:
+        """
+        Return True if a response with this status code is a transient failure.
+        """
+        return status_code in RETRYABLE_STATUSES
+
+    def allow(self, attempt: int) -> bool:
+        """
+        Decide whether a URL that just failed its `attempt`-th try may be tried again.
+
+        A retry is allowed while the URL has attempts left and the run still has retry budget.
+        An allowed retry is taken from the run budget.
+
+        Args:
+            attempt (int): The number of the attempt that failed, starting at 1.
+
+        Returns:
+            bool: True if the URL should be retried.
+        """
+        if attempt >= self.max_attempts:
+            return False
+        with self.lock:
+            if self.run_budget is not None and self.retries_used >= self.run_budget:
+                return False
+            self.retries_used += 1
+            return True
+
+    def delay(self, attempt: int) -> float:
+        """
+        Return the seconds to wait before retrying a URL whose `attempt`-th try failed.
+
+        The delay doubles with every attempt up to `max_delay`, and the last `jitter` fraction of it is
+        random, so retries against the same host do not arrive in lockstep.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
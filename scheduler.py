@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+THROTTLE_STATUSES = (429, 503) # responses that mean the host wants us to slow down
+
+class HostScheduler:
+    def __init__(self, rate: float = 2.0, burst: int = 4, initial_concurrency: int = 2, min_concurrency: int = 1,
+                 max_concurrency: int = 8, latency_target: float = 5.0):
+        self.rate = rate # requests per second each host may receive on average
+        self.burst = burst # requests a host may receive back to back after being idle
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target # seconds; slower responses count as a sign of overload
+        self.condition = threading.Condition()
+        self.hosts = {}
+
+    @staticmethod
+    def host_of(url) -> str:
+        """
+        Return the lower-cased host of a URL, or "" if it has none.
+        """
+        try:
+            return urlsplit(str(url)).netloc.lower()
+        except ValueError:
+            return ""
+
+    @classmethod
+    def interleave(cls, ids, urls) -> list:
+        """
+        Order `ids` so that consecutive rows go to different hosts.
+
+        The rows are grouped by the host of their URL and then taken round-robin, one row per host at a
+        time, keeping the original order within each host. Idle hosts get work early instead of every worker
+        queueing up behind the one host that happens to fill the top of the list.
+
+        Args:
+            ids (Iterable): The row ids, in their original order.
+            urls (Iterable[str]): The URL of each row, used to find its host.
+
+        Returns:
+            list: The ids in interleaved order.
+        """
+        groups = OrderedDict()
+        for br_number, url in zip(ids, urls):
+            groups.setdefault(cls.host_of(url), []).append(br_number)
+        queues = [iter(group) for group in groups.values()]
+        ordered = []
+        while queues:
+            remaining = []
+            for q in queues:
+                br_number = next(q, None)
+                if br_number is not None:
+                    ordered.append(br_number)
+                    remaining.append(q)
+            queues = remaining
+        return ordered
+
+    def _state(self, host: str) -> dict:
+        state = self.hosts.get(host)
+        if state is None:
+            state = {"tokens": float(self.burst), "updated": time.monotonic(), "active": 0,
+                     "limit": self.initial_concurrency, "successes": 0, "throttled": 0, "timeouts": 0,
+                     "requests": 0, "latency": 0.0}
+            self.hosts[host] = state
+        return state
+
+    def _refill(self, state: dict) -> None:
+        now = time.monotonic()
+        state["tokens"] = min(float(self.burst), state["tokens"] + (now - state["updated"]) * self.rate)
+        state["updated"] = now
+
+    def acquire(self, host: str) -> None:
+        """
+        Block until a request to `host` is allowed by its token bucket and its concurrency limit.
+
+        Args:
+            host (str): The host that is about to be requested.
+        """
+        with self.condition:
+            state = self._state(host)
+            while True:
+                self._refill(state)
+                if state["active"] < state["limit"] and state["tokens"] >= 1:
+                    state["tokens"] -= 1
+                    state["active"] += 1
+                    state["requests"] += 1
+                    return
+                wait = None if state["active"] >= state["limit"] else (1 - state["tokens"]) / self.rate
+                self.condition.wait(timeout=wait)
+
+    def release(self, host: str, latency: float, http_status: int = None, timed_out: bool = False) -> None:
+        """
+        Give back a slot of `host` and adapt its concurrency limit to the outcome of the request.
+
+        The limit is halved and the token bucket emptied when the host answers 429/503 or times out,
+        reduced by one when the response was slower than `latency_target`, and raised by one after
+        `limit` fast responses in a row (additive increase, multiplicative decrease).
+
+        Args:
+            host (str): The host that was requested.
+            latency (float): Seconds the request took.
+            http_status (int): The HTTP status code of the response, if there was one.
+            timed_out (bool): True if the request timed out.
+        """
+        with self.condition:
+            state = self._state(host)
+            state["active"] -= 1
+            state["latency"] = latency if state["latency"] == 0.0 else 0.8 * state["latency"] + 0.2 * latency # moving average
+            if http_status in THROTTLE_STATUSES or timed_out:
+                if timed_out:
+                    state["timeouts"] += 1
+                else:
+                    state["throttled"] += 1
+                state["limit"] = max(self.min_concurrency, state["limit"] // 2)
+                state["tokens"] = 0.0
+                state["successes"] = 0
+            elif latency > self.latency_target:
+                state["limit"] = max(self.min_concurrency, state["limit"] - 1)
+                state["successes"] = 0
+            else:
+                state["successes"] += 1
+                if state["successes"] >= state["limit"]:
+                    state["limit"] = min(self.max_concurrency, state["limit"] + 1)
+                    state["successes"] = 0
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Return a snapshot of the per-host counters: concurrency limit, requests, throttles, timeouts and average latency.
+        """
+        with self.condition:
+            return {host: {key: state[key] for key in ("limit", "active", "requests", "throttled", "timeouts", "latency")}
+                    for host, state in self.hosts.items()}
@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DONE_STATUSES = ("downloaded", "unchanged") # statuses that mean the file is on disk and does not need to be downloaded again
+COLUMNS = ("brnum", "status", "url", "size", "sha256", "etag", "last_modified", "http_status", "error", "updated_at",
+           "pages", "title", "producer")
+METADATA_COLUMNS = {"pages": "INTEGER", "title": "TEXT", "producer": "TEXT"} # filled in by PDF validation, added to older stores
+
+class DownloadStateStore:
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.lock = threading.Lock() # one connection is shared by all worker threads
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                brnum TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                url TEXT,
+                size INTEGER,
+                sha256 TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                http_status INTEGER,
+                error TEXT,
+                updated_at REAL,
+                pages INTEGER,
+                title TEXT,
+                producer TEXT
+            )""")
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(downloads)")}
+        for column, sql_type in METADATA_COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE downloads ADD COLUMN {column} {sql_type}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS downloads_status ON downloads (status)")
+        self.conn.commit()
+
+    def record(self, brnum: str, status: str, url: str = None, size: int = None, sha256: str = None,
+               etag: str = None, last_modified: str = None, http_status: int = None, error: str = "", pages: int = None,
+               title: str = None, producer: str = None) -> None:
+        """
+        Insert or replace the state of one download.
+
+        Args:
+            brnum (str): The id of the row the file belongs to.
+            status (str): The outcome of the download, e.g. "downloaded", "unchanged" or "failed".
+            url (str): The URL the file was downloaded from.
+            size (int): The size of the file in bytes.
+            sha256 (str): The hex SHA-256 of the file content.
+            etag (str): The `ETag` header the server sent with the file.
+            last_modified (str): The `Last-Modified` header the server sent with the file.
+            http_status (int): The HTTP status code of the last response.
+            error (str): The error message of a failed download.
+            pages (int): The page count found by PDF validation.
+            title (str): The document title found by PDF validation.
+            producer (str): The producer found by PDF validation.
+
+        Raises:
+            sqlite3.Error: If the row could not be written.
+        """
+        with self.lock:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO downloads ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                (str(brnum), status, url, size, sha256, etag, last_modified, http_status, error, time.time(), pages, title, producer))
+            self.conn.commit()
+
+    def get(self, brnum: str) -> dict:
+        """
+        Return the stored state of `brnum` as a dict, or None if it has never been recorded.
+        """
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM downloads WHERE brnum = ?", (str(brnum),))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def downloaded_ids(self) -> list[str]:
+        """
+        Return the ids of every file that is recorded as downloaded.
+        """
+        placeholders = ", ".join("?" for _ in DONE_STATUSES)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT brnum FROM downloads WHERE status IN ({placeholders})", DONE_STATUSES).fetchall()
+        return [row[0] for row in rows]
+
+    def ids_with_status(self, statuses) -> list[str]:
+        """
+        Return the ids of every row whose status is one of `statuses`, e.g. ("failed", "corrupt").
+        """
+        statuses = tuple(statuses)
+        placeholders = ", ".join("?" for _ in statuses)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT brnum FROM downloads WHERE status IN ({placeholders})", statuses).fetchall()
+        return [row[0] for row in rows]
+
+    def sizes(self) -> dict:
+        """
+        Return {brnum: size} of every row with a known file size, e.g. to order the next run by size.
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT brnum, size FROM downloads WHERE size IS NOT NULL").fetchall()
+        return dict(rows)
+
+    def forget(self, brnums) -> None:
+        """
+        Remove the stored state of the given ids, e.g. after their files have been deleted.
+        """
+        with self.lock:
+            self.conn.executemany("DELETE FROM downloads WHERE brnum = ?", ((str(b),) for b in brnums))
+            self.conn.commit()
+
+    def is_empty(self) -> bool:
+        """
+        Return True if nothing has been recorded yet.
+        """
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM downloads LIMIT 1").fetchone() is None
+
+    def import_folder(self, folder: Path) -> int:
+        """
+        Record every `<BRnum>.pdf` already in `folder` as downloaded.
+
+        This is used once to seed a new store from a download folder that was filled before the
+        store existed. After that the store, not the folder, is the index of what has been downloaded.
+
+        Args:
+            folder (Path): The download folder to import.
+
+        Returns:
+            int: The number of files imported.
+        """
+        now = time.time()
+        with os.scandir(folder) as entries:
+            rows = [(entry.name[:-4], "downloaded", None, entry.stat().st_size, None, None, None, None, "", now)
+                    for entry in entries if entry.name.endswith(".pdf") and entry.is_file()]
+        with self.lock:
+            self.conn.executemany(f"INSERT OR IGNORE INTO downloads ({', '.join(COLUMNS[:10])}) VALUES ({', '.join('?' for _ in COLUMNS[:10])})", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        with self.lock:
+            self.conn.close()
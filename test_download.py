@@ -1,23 +1,189 @@
 import unittest
 import xmlrunner
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
 from unittest.mock import patch
 from unittest.mock import mock_open
+import pandas as pd
 from download_files import PDFDownloader
 from download_files import PreparePdfDownloader
 from report_writer import ReportWriter
+from state_store import DownloadStateStore
+from scheduler import HostScheduler
+from retry_policy import RetryPolicy
+from metrics import Metrics, JsonLinesExporter, PrometheusTextExporter, error_kind
+from pdf_validator import PdfValidator
+from blob_store import BlobStore
+from download_order import DownloadOrder
+from download_governor import DownloadGovernor
+from checkpoint import RunCheckpoint
+from result_store import ResultStore
+from preflight import Preflight
+import io
+import re
+import sqlite3
+from PyPDF2 import PdfWriter
+import benchmark
+import json
+import multiprocessing
+import os
 import requests
+import asyncio
+import hashlib
+import time
+import signal
+import subprocess
+import sys
+import cli
+
+PDF_BYTES = b"%PDF-1.4\n" + b"0" * 20000 + b"\n%%EOF\n"
+LARGE_PDF = b"%PDF-1.4\n" + bytes(range(256)) * (3 * 4096) + b"\n%%EOF\n" # about 3 MB
+
+def make_pdf(title: str = "Annual report") -> bytes:
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    writer.add_metadata({"/Title": title, "/Producer": "unit test"})
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+REAL_PDF = make_pdf()
+
+class MockPdfHandler(BaseHTTPRequestHandler):
+    # Serves /<name>.pdf with `pdf_body` (honouring Range and If-None-Match), /<name>.html with an HTML page
+    # linking to report/linked.pdf, /<name>.bin with a non-PDF body and 404 for everything else.
+    # The class attributes are hooks the tests set; `reset` puts them back before and after every test.
+    requests_seen = []
+    failures = {} # path -> number of 503 answers before the path works
+    content_types = {} # path -> Content-Type sent instead of the one of its extension
+    bodies = {} # path -> PDF bodies of its requests in turn, the last one is kept for all later requests
+    pdf_body = PDF_BYTES # body of every other .pdf path
+    delay = 0.0 # seconds before every answer
+    cut_after = None # close the connection after that many body bytes, although the full Content-Length was announced
+
+    @classmethod
+    def reset(cls):
+        cls.requests_seen = []
+        cls.failures = {}
+        cls.content_types = {}
+        cls.bodies = {}
+        cls.pdf_body = PDF_BYTES
+        cls.delay = 0.0
+        cls.cut_after = None
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, dict(self.headers)))
+        if self.delay:
+            time.sleep(self.delay)
+        if self.failures.get(self.path, 0) > 0:
+            self.failures[self.path] -= 1
+            self.send_error(503)
+            return
+        if self.path in self.bodies:
+            answers = self.bodies[self.path]
+            body = answers.pop(0) if len(answers) > 1 else answers[0]
+            content_type = "application/pdf"
+        elif self.path.endswith(".pdf"):
+            body, content_type = self.pdf_body, "application/pdf"
+        elif self.path.endswith(".html"):
+            body, content_type = b'<html><body><a href="report/linked.pdf">Report</a></body></html>', "text/html"
+        elif self.path.endswith(".bin"):
+            body, content_type = b"not a pdf at all", "application/octet-stream"
+        else:
+            self.send_error(404)
+            return
+        content_type = self.content_types.get(self.path, content_type)
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = int(self.headers["Range"][6:].split("-")[0]) if self.headers.get("Range") else 0
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("ETag", '"v1"')
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        if self.cut_after is not None:
+            self.wfile.write(body[start:start + self.cut_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+def start_mock_server(handler=MockPdfHandler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+class MockServerTestCase(unittest.TestCase):
+    # Starts a MockPdfHandler server and a temporary output folder for every test, and resets the handler's hooks.
+
+    def setUp(self):
+        MockPdfHandler.reset()
+        self.addCleanup(MockPdfHandler.reset)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup) # runs last, after everything registered later
+        self.server, self.base_url = start_mock_server()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def url(self, path):
+        """
+        Return the URL of `path` on the mock server; None and absolute URLs are returned as they are.
+        """
+        return path if path is None or "://" in path else f"{self.base_url}/{path}"
+
+    def frame(self, rows: dict) -> pd.DataFrame:
+        """
+        Return a list like `df2` from {BRnum: (main path, secondary path)}, with the paths on the mock server.
+        """
+        return pd.DataFrame([(self.url(main), self.url(secondary)) for main, secondary in rows.values()],
+                            columns=["Pdf_URL", "Report Html Address"], index=pd.Index(list(rows), name="BRnum"))
+
+    def make_store(self) -> DownloadStateStore:
+        """
+        Return a state store in the temporary folder, closed after the test.
+        """
+        store = DownloadStateStore(Path(self.tmp.name) / "state.sqlite")
+        self.addCleanup(store.close)
+        return store
+
+    def make_downloader(self, rows: dict = None, **kwargs) -> PDFDownloader:
+        """
+        Return a PDFDownloader that downloads into the temporary folder, with its dwn folder created.
+
+        Args:
+            rows (dict): Optional {BRnum: (main path, secondary path)} for its `df2`, see `frame`.
+            **kwargs: Keyword arguments for PDFDownloader, e.g. state_store or retry_policy.
+        """
+        downloader = PDFDownloader("unused.xlsx", self.tmp.name, "Pdf_URL", "Report Html Address", **kwargs)
+        downloader.dwn_folder.mkdir(parents=True, exist_ok=True)
+        if rows is not None:
+            downloader.df2 = self.frame(rows)
+        self.addCleanup(downloader.close_sessions)
+        return downloader
 
 class test_prepare_pdf(unittest.TestCase):
 
     def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory() # the folders and the state store are created here, not in the working directory
         mock_list_path = "C:/Users/SPAC-O-1/Projekter/uge-4/data/GRI_2017_2020 - Kopi.xlsx"
-        mock_output_folder = r"C:\Users\SPAC-O-1\Projekter\uge-5\PDFDownloader\output"
+        mock_output_folder = self.tmp.name
         mock_main_col = "Pdf_URL"
         mock_secondary_col = "Report Html Address"
         self.prepare_pdf = PreparePdfDownloader(mock_list_path, mock_output_folder, mock_main_col, mock_secondary_col)
 
     def tearDown(self):
+        if self.prepare_pdf.state_store is not None:
+            self.prepare_pdf.state_store.close()
         del self.prepare_pdf
+        self.tmp.cleanup()
 
     def test_prepare_and_find(self):
         with patch("glob.glob", return_value = [], side_effect=[PermissionError, OSError, Exception]):
@@ -31,35 +197,53 @@ class test_prepare_pdf(unittest.TestCase):
 class test_url_methods(unittest.TestCase):
 
     def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
         mock_list_path = "C:/Users/SPAC-O-1/Projekter/uge-4/data/GRI_2017_2020 - Kopi.xlsx"
-        mock_output_folder = r"C:\Users\SPAC-O-1\Projekter\uge-5\PDFDownloader\output"
+        mock_output_folder = self.tmp.name
         mock_main_col = "Pdf_URL"
         mock_secondary_col = "Report Html Address"
         self.downloader = PDFDownloader(mock_list_path, mock_output_folder, mock_main_col, mock_secondary_col)
 
     def tearDown(self):
         del self.downloader
+        self.tmp.cleanup()
 
     def test_download(self):
         mock_savepath = "C:/Users/SPAC-O-1/Projekter/uge-5/PDFDownloader/output"
         mock_url = "http://cdn12.a1.net/m/resources/media/pdf/A1-Umwelterkl-rung-2016-2017.pdf"
         response_success = requests.Response()
         response_success.status_code = 200
-        with patch("requests.get", return_value = response_success, side_effect = [response_success, requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.MissingSchema]) as mock_download:
+        with patch("requests.Session.get", return_value = response_success, side_effect = [response_success, requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.MissingSchema]) as mock_download:
             self.assertEqual(self.downloader.download_pdf(mock_url, mock_savepath), (True, ''))
 
     def test_threading(self):
         #self.assertEqual(self.downloader.process_downloads_threaded(10, 4), None)
         response_success = requests.Response()
         response_success.status_code = 200
-        with patch("requests.get", return_value = response_success, side_effect = [response_success, requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.MissingSchema]) as mock_threading:
+        with patch("requests.Session.get", return_value = response_success, side_effect = [response_success, requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.MissingSchema]) as mock_threading:
             self.downloader.process_downloads_threaded(10,4)
             with self.assertRaises(tuple([requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.MissingSchema])):
                 self.downloader.process_downloads_threaded(10,4)
     
+    def test_session_per_thread(self):
+        session = self.downloader._get_session()
+        self.assertIs(self.downloader._get_session(), session)
+        other = []
+        worker = threading.Thread(target=lambda: other.append(self.downloader._get_session()))
+        worker.start()
+        worker.join()
+        self.assertIsNot(other[0], session)
+        self.assertEqual(self.downloader._get_session().get_adapter("https://example.com")._pool_maxsize, 10)
+        self.downloader.close_sessions()
+        self.assertIsNot(self.downloader._get_session(), session)
+
     def test_deletion(self):
-        with patch("glob.glob", return_value = ["BR50050", "Downloaded"], side_effect = [FileNotFoundError, PermissionError, Exception]) as mock_deletion:
-            self.assertEqual(self.downloader.delete_downloaded_files(), None)
+        self.assertEqual(self.downloader.delete_downloaded_files(), None) # no download folder yet, only reported
+        self.downloader.dwn_folder.mkdir(parents=True)
+        for name in ("BR50050.pdf", "BR50051.pdf", "notes.txt"):
+            (self.downloader.dwn_folder / name).write_bytes(b"x")
+        self.assertEqual(self.downloader.delete_downloaded_files(), None)
+        self.assertEqual([path.name for path in self.downloader.dwn_folder.iterdir()], ["notes.txt"])
     
     def test_summary(self):
         self.assertIsInstance(self.downloader.summarize_downloads(), (list(dict(str, str))))
@@ -82,7 +266,1061 @@ class test_report_writer(unittest.TestCase):
         mock_result = f"Downloaded"
         with patch("builtins.open", new_callable=mock_open) as m:
             self.assertEqual(self.report_writer.write_to_report(mock_name, mock_result, mock_output_folder), None)
+
+    def test_buffered_writer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.report_writer.start(Path(tmp))
+            for i in range(5):
+                self.report_writer.submit(f"BR{i}", "Downloaded")
+            self.report_writer.stop()
+            lines = (Path(tmp) / "Download_result_report.csv").read_text(encoding="utf-8").splitlines()
+            self.assertEqual(lines, ["Name;Result"] + [f"BR{i};Downloaded" for i in range(5)])
     
+class test_async_engine(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store()
+        self.downloader = self.make_downloader({"BR1": ("a.pdf", "missing"), "BR2": ("missing", "b.pdf"), "BR3": ("missing", "missing")},
+                                               state_store=self.store)
+
+    def test_async_fallback_and_errors(self):
+        self.downloader.process_downloads_async(3, max_concurrency=10, per_host_limit=2)
+        self.assertEqual((self.downloader.dwn_folder / "BR1.pdf").read_bytes(), PDF_BYTES)
+        self.assertEqual((self.downloader.dwn_folder / "BR2.pdf").read_bytes(), PDF_BYTES)
+        self.assertFalse((self.downloader.dwn_folder / "BR3.pdf").exists())
+        self.assertIn("Failed to download: 404", self.downloader.df2.at["BR3", "error"])
+        self.assertEqual(sorted(self.store.downloaded_ids()), ["BR1", "BR2"])
+        self.assertEqual(self.store.get("BR2")["url"], f"{self.base_url}/b.pdf")
+        self.assertEqual(self.store.get("BR1")["size"], len(PDF_BYTES))
+        self.assertEqual(self.store.get("BR3")["http_status"], 404)
+
+    def test_unexpected_error_is_reported(self):
+        validators_for = PDFDownloader._validators_for
+        def broken_for_br2(downloader, br_number, *args):
+            if br_number == "BR2":
+                raise ValueError("broken")
+            return validators_for(downloader, br_number, *args)
+
+        for engine in ("async", "threaded"):
+            self.downloader.checkpoint = RunCheckpoint(Path(self.tmp.name) / f"{engine}.json")
+            with patch.object(PDFDownloader, "_validators_for", broken_for_br2), patch("builtins.print"):
+                if engine == "async":
+                    self.downloader.process_downloads_async(3)
+                else:
+                    self.downloader.process_downloads_threaded(3, max_workers=3)
+            self.assertEqual(ReportWriter.read_results(self.tmp.name)["BR2"], "Not downloaded")
+            self.assertEqual(self.store.get("BR2")["error"], "Unexpected error: broken")
+            self.assertEqual(self.downloader.df2.at["BR2", "error"], "Unexpected error: broken")
+            self.assertEqual(self.downloader.checkpoint.pending(), []) # not left pending for --resume
+
+class test_resumable_download(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.downloader = self.make_downloader()
+        self.savepath = Path(self.tmp.name) / "BR1.pdf"
+
+    def test_resume_with_range(self):
+        url = f"{self.base_url}/a.pdf"
+        Path(self.tmp.name, "BR1.pdf.part").write_bytes(PDF_BYTES[:5000])
+        Path(self.tmp.name, "BR1.pdf.part.url").write_text(url, encoding="utf-8")
+        self.assertEqual(self.downloader.download_pdf(url, self.savepath), (True, ""))
+        self.assertEqual(self.savepath.read_bytes(), PDF_BYTES)
+        self.assertEqual(MockPdfHandler.requests_seen[-1][1].get("Range"), "bytes=5000-")
+        self.assertFalse(Path(self.tmp.name, "BR1.pdf.part").exists())
+
+    def test_part_from_other_url_is_restarted(self):
+        Path(self.tmp.name, "BR1.pdf.part").write_bytes(b"garbage")
+        Path(self.tmp.name, "BR1.pdf.part.url").write_text(f"{self.base_url}/other.pdf", encoding="utf-8")
+        self.assertEqual(self.downloader.download_pdf(f"{self.base_url}/a.pdf", self.savepath), (True, ""))
+        self.assertEqual(self.savepath.read_bytes(), PDF_BYTES)
+        self.assertNotIn("Range", MockPdfHandler.requests_seen[-1][1])
+
+class test_state_store(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.prepare = PreparePdfDownloader("unused.xlsx", self.tmp.name, "Pdf_URL", "Report Html Address")
+
+    def tearDown(self):
+        if self.prepare.state_store is not None:
+            self.prepare.state_store.close()
+        self.tmp.cleanup()
+
+    def test_existing_files_are_imported_once(self):
+        dwn = Path(self.tmp.name) / "dwn"
+        dwn.mkdir()
+        (dwn / "BR1.pdf").write_bytes(PDF_BYTES)
+        (dwn / "BR2.pdf.part").write_bytes(PDF_BYTES[:10])
+        self.assertEqual(self.prepare.prepare_folders_and_find_pdf_duplicates(), ["BR1"])
+        (dwn / "BR3.pdf").write_bytes(PDF_BYTES) # not in the store, so not reported
+        with patch("glob.glob") as mock_glob:
+            self.assertEqual(self.prepare.prepare_folders_and_find_pdf_duplicates(), ["BR1"])
+            mock_glob.assert_not_called()
+
+    def test_record_and_forget(self):
+        store = DownloadStateStore(Path(self.tmp.name) / "state.sqlite")
+        store.record("BR1", "downloaded", url="http://x/a.pdf", size=3, sha256="abc", etag='"e1"', http_status=200)
+        store.record("BR2", "failed", url="http://x/b.pdf", http_status=404, error="Failed to download: 404 - Not Found")
+        self.assertEqual(store.downloaded_ids(), ["BR1"])
+        self.assertEqual(store.get("BR1")["etag"], '"e1"')
+        self.assertEqual(store.get("BR2")["status"], "failed")
+        store.forget(["BR1"])
+        self.assertIsNone(store.get("BR1"))
+        store.close()
+
+class test_incremental(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store()
+        self.downloader = self.make_downloader({"BR1": ("a.pdf", "a.html")}, state_store=self.store, incremental=True)
+
+    def test_second_run_is_unchanged(self):
+        self.downloader.process_downloads_threaded(1, 1)
+        self.assertEqual(self.store.get("BR1")["etag"], '"v1"')
+        MockPdfHandler.requests_seen.clear()
+        self.downloader.process_downloads_threaded(1, 1)
+        self.assertEqual(MockPdfHandler.requests_seen[-1][1].get("If-None-Match"), '"v1"')
+        state = self.store.get("BR1")
+        self.assertEqual((state["status"], state["http_status"], state["size"]), ("unchanged", 304, len(PDF_BYTES)))
+        report = (Path(self.tmp.name) / "Download_result_report.csv").read_text(encoding="utf-8").splitlines()
+        self.assertEqual(report[-2:], ["BR1;Downloaded", "BR1;Unchanged"])
+
+class test_streaming(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = [("BR1", "http://x/1.pdf", "http://x/1.html"), ("BR2", None, "http://x/2.html"),
+                     ("BR3", "http://x/3.pdf", "http://x/3.html"), ("BR4", "http://x/4.pdf", "http://x/4.html")]
+
+    def prepare_for(self, list_path):
+        return PreparePdfDownloader(str(list_path), self.tmp.name, "Pdf_URL", "Report Html Address")
+
+    def test_xlsx_batches(self):
+        list_path = Path(self.tmp.name) / "list.xlsx"
+        pd.DataFrame(self.rows, columns=["BRnum", "Pdf_URL", "Report Html Address"]).to_excel(list_path, index=False)
+        batches = list(self.prepare_for(list_path).iter_filtered_batches(["BR3"], batch_size=1))
+        self.assertEqual(batches, [[self.rows[0]], [self.rows[3]]])
+
+    def test_csv_batches(self):
+        list_path = Path(self.tmp.name) / "list.csv"
+        pd.DataFrame(self.rows, columns=["BRnum", "Pdf_URL", "Report Html Address"]).to_csv(list_path, index=False)
+        batches = list(self.prepare_for(list_path).iter_filtered_batches([], batch_size=10))
+        self.assertEqual(batches, [[self.rows[0], self.rows[2], self.rows[3]]])
+
+    def test_missing_column(self):
+        list_path = Path(self.tmp.name) / "list.csv"
+        list_path.write_text("BRnum,Pdf_URL\nBR1,http://x/1.pdf\n", encoding="utf-8")
+        self.assertEqual(list(self.prepare_for(list_path).iter_filtered_batches([])), [])
+
+    def test_stream_into_downloader(self):
+        downloader = self.make_downloader()
+        batches = iter([[("BR1", self.url("a.pdf"), self.url("a.html"))], [("BR2", self.url("missing"), self.url("b.pdf"))]])
+        downloader.process_download_stream(batches, max_workers=2, max_pending=1)
+        self.assertTrue((downloader.dwn_folder / "BR1.pdf").exists())
+        self.assertTrue((downloader.dwn_folder / "BR2.pdf").exists())
+
+class test_host_scheduler(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scheduler = HostScheduler(rate=1000, burst=10, initial_concurrency=2, max_concurrency=4)
+
+    def test_interleave(self):
+        ids = ["A1", "A2", "A3", "B1", "C1", "B2"]
+        urls = ["http://a/1", "http://a/2", "http://a/3", "http://b/1", "http://c/1", "http://B/2"]
+        self.assertEqual(self.scheduler.interleave(ids, urls), ["A1", "B1", "C1", "A2", "B2", "A3"])
+
+    def test_adapts_concurrency(self):
+        for _ in range(2):
+            self.scheduler.acquire("a")
+        self.assertEqual(self.scheduler.stats()["a"]["active"], 2)
+        self.scheduler.release("a", 0.1, 200)
+        self.scheduler.release("a", 0.1, 200)
+        self.assertEqual(self.scheduler.stats()["a"]["limit"], 3) # additive increase after `limit` fast responses
+        self.scheduler.acquire("a")
+        self.scheduler.release("a", 0.1, 429)
+        self.assertEqual(self.scheduler.stats()["a"]["limit"], 1) # multiplicative decrease
+        self.assertEqual(self.scheduler.stats()["a"]["throttled"], 1)
+
+    def test_blocks_at_limit(self):
+        self.scheduler.acquire("a")
+        self.scheduler.acquire("a")
+        acquired = threading.Event()
+        worker = threading.Thread(target=lambda: (self.scheduler.acquire("a"), acquired.set()))
+        worker.start()
+        self.assertFalse(acquired.wait(0.2))
+        self.scheduler.release("a", 0.1, 200)
+        self.assertTrue(acquired.wait(2))
+        worker.join()
+
+    def test_downloader_uses_scheduler(self):
+        downloader = self.make_downloader({f"BR{i}": (f"{i}.pdf", "x.html") for i in range(4)}, scheduler=self.scheduler)
+        downloader.process_downloads_threaded(4, 4)
+        host = self.base_url.split("//")[1]
+        self.assertEqual(self.scheduler.stats()[host]["requests"], 4)
+        self.assertEqual(self.scheduler.stats()[host]["active"], 0)
+
+    def test_slot_is_released_on_error(self):
+        downloader = self.make_downloader(scheduler=self.scheduler)
+        with patch.object(PDFDownloader, "download_pdf", side_effect=OSError("disk gone")):
+            with self.assertRaises(OSError):
+                downloader._fetch("http://a/1.pdf", Path(self.tmp.name) / "BR1.pdf", {})
+        self.assertEqual(self.scheduler.stats()["a"]["active"], 0)
+
+class test_retry_policy(MockServerTestCase):
+    def test_attempts_and_budget(self):
+        policy = RetryPolicy(max_attempts=3, run_budget=3)
+        self.assertTrue(policy.allow(1))
+        self.assertTrue(policy.allow(2))
+        self.assertFalse(policy.allow(3)) # out of attempts for this URL
+        self.assertTrue(policy.allow(1))
+        self.assertFalse(policy.allow(1)) # out of budget for the run
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=0.5)
+        for attempt, ceiling in ((1, 1.0), (2, 2.0), (3, 4.0), (6, 5.0)):
+            self.assertTrue(ceiling / 2 <= policy.delay(attempt) <= ceiling)
+        self.assertTrue(RetryPolicy.is_retryable_status(503))
+        self.assertFalse(RetryPolicy.is_retryable_status(404))
+
+    def test_engine_defers_transient_failures(self):
+        MockPdfHandler.failures["/flaky.pdf"] = 2
+        downloader = self.make_downloader({"BR1": ("flaky.pdf", "x.html"), "BR2": ("missing", "gone")},
+                                          retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01))
+        downloader.process_downloads_threaded(2, 2)
+        paths = [path for path, _ in MockPdfHandler.requests_seen]
+        self.assertEqual(paths.count("/flaky.pdf"), 3)
+        self.assertEqual(paths.count("/missing"), 1) # 404 is permanent
+        self.assertTrue((downloader.dwn_folder / "BR1.pdf").exists())
+        self.assertIn("Failed to download: 404", downloader.df2.at["BR2", "error"])
+
+class test_content_sniffing(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store()
+        self.downloader = self.make_downloader(state_store=self.store)
+        self.downloader.report_writer.start(self.tmp.name)
+        self.addCleanup(self.downloader.report_writer.stop)
+        self.savepath = self.downloader.dwn_folder / "BR1.pdf"
+
+    def test_html_is_rejected_before_writing(self):
+        info = {}
+        self.assertEqual(self.downloader.download_pdf(f"{self.base_url}/page.html", self.savepath, info), (False, "Not a PDF: text/html"))
+        self.assertTrue(info["not_pdf"])
+        self.assertNotIn("pdf_link", info) # the page is only searched when links are followed
+        self.assertEqual(list(self.downloader.dwn_folder.iterdir()), [])
+        self.downloader.follow_pdf_links = True
+        info = {}
+        self.downloader.download_pdf(f"{self.base_url}/page.html", self.savepath, info)
+        self.assertEqual(info["pdf_link"], f"{self.base_url}/report/linked.pdf")
+
+    def test_pdf_sent_as_html_is_accepted(self):
+        MockPdfHandler.content_types["/mislabelled.pdf"] = "text/html"
+        self.assertEqual(self.downloader.download_pdf(f"{self.base_url}/mislabelled.pdf", self.savepath, {}), (True, ""))
+        self.assertEqual(self.savepath.read_bytes(), PDF_BYTES)
+        self.savepath.unlink()
+
+        async def run():
+            import aiohttp
+            async with aiohttp.ClientSession() as session:
+                return await self.downloader.download_pdf_async(session, f"{self.base_url}/mislabelled.pdf", self.savepath, {})
+
+        self.assertEqual(asyncio.run(run()), (True, ""))
+        self.assertEqual(self.savepath.read_bytes(), PDF_BYTES)
+
+    def test_magic_bytes_are_checked(self):
+        info = {}
+        self.assertEqual(self.downloader.download_pdf(f"{self.base_url}/junk.bin", self.savepath, info), (False, "Not a PDF: application/octet-stream"))
+        self.assertFalse(info["retryable"])
+        self.assertEqual(list(self.downloader.dwn_folder.iterdir()), [])
+
+    def test_not_a_pdf_status(self):
+        self.assertEqual(self.downloader.download_row("BR1", f"{self.base_url}/missing", f"{self.base_url}/page.html")[0], "Not a PDF")
+        self.assertEqual(self.store.get("BR1")["status"], "not_pdf")
+
+    def test_follow_pdf_link(self):
+        self.downloader.follow_pdf_links = True
+        self.assertEqual(self.downloader.download_row("BR1", f"{self.base_url}/missing", f"{self.base_url}/page.html")[0], "Downloaded")
+        self.assertEqual(self.savepath.read_bytes(), PDF_BYTES)
+        self.assertEqual(self.store.get("BR1")["url"], f"{self.base_url}/report/linked.pdf")
+
+class test_summary_snapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.downloader = PDFDownloader("unused.xlsx", self.tmp.name, "Pdf_URL", "Report Html Address")
+        self.downloader.dwn_folder.mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_status_and_used_column(self):
+        for name in ("BR1.pdf", "BR2.pdf", "BR4.pdf.part"):
+            (self.downloader.dwn_folder / name).write_bytes(PDF_BYTES)
+        self.downloader.df2 = pd.DataFrame({"Pdf_URL": ["a"] * 4, "Report Html Address": ["b"] * 4,
+                                            "error": [None, "Request timed out: x", "Not a PDF: text/html", "Failed to download: 404 - Not Found"]},
+                                           index=pd.Index(["BR1", "BR2", "BR3", "BR4"], name="BRnum"))
+        summary = self.downloader.summarize_downloads(4)
+        self.assertEqual(summary[0], {"ID": "BR1", "Status": "Success", "UsedColumn": "Pdf_URL", "Error": ""})
+        self.assertEqual(summary[1], {"ID": "BR2", "Status": "Success", "UsedColumn": "Report Html Address", "Error": ""})
+        self.assertEqual(summary[2]["Status"], "Not a PDF")
+        self.assertEqual((summary[3]["Status"], summary[3]["Error"]), ("Failed", "Failed to download: 404 - Not Found"))
+
+    def test_large_frame(self):
+        ids = [f"BR{i}" for i in range(100000)]
+        for br_number in ids[:100]:
+            (self.downloader.dwn_folder / f"{br_number}.pdf").touch()
+        self.downloader.df2 = pd.DataFrame({"Pdf_URL": "a", "Report Html Address": "b"}, index=pd.Index(ids, name="BRnum"))
+        summary = self.downloader.summarize_downloads(len(ids), as_frame=True)
+        self.assertIsInstance(summary, pd.DataFrame)
+        self.assertEqual((summary["Status"] == "Success").sum(), 100)
+
+class test_benchmark(unittest.TestCase):
+    def test_run_benchmark(self):
+        ballast = b"x" * (200 * 2 ** 20) # resident, it raises the peak RSS of this process, not that of the cases
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / "bench.json"
+            report = benchmark.run_benchmark(6, engines=("threaded", "async"), workers=(2,), output=output,
+                                             sizes=(1000, 5000), chunked=True, redirect_rate=0.5)
+            self.assertEqual(json.loads(output.read_text(encoding="utf-8")), report)
+        if benchmark.peak_rss_mb() is not None:
+            self.assertTrue(all(r["peak_rss_mb"] < benchmark.peak_rss_mb() - 100 for r in report["results"]))
+        del ballast
+        self.assertEqual([r["engine"] for r in report["results"]], ["threaded", "async"])
+        for result in report["results"]:
+            self.assertEqual(result["downloaded"], 6)
+            self.assertGreater(result["files_per_s"], 0)
+            self.assertLessEqual(result["latency_p50"], result["latency_p99"])
+
+    def test_percentile(self):
+        self.assertEqual(benchmark.percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertAlmostEqual(benchmark.percentile([0, 10], 95), 9.5)
+        self.assertIsNone(benchmark.percentile([], 50))
+
+class test_metrics(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = []
+        self.metrics = Metrics([self.events.append, JsonLinesExporter(Path(self.tmp.name) / "metrics.jsonl"),
+                                PrometheusTextExporter(Path(self.tmp.name) / "metrics.prom")])
+        self.downloader = self.make_downloader({"BR1": ("a.pdf", "a.pdf"), "BR2": ("missing", "page.html")},
+                                               report_writer=ReportWriter(metrics=self.metrics), metrics=self.metrics)
+
+    def check_run(self):
+        attempts = [e for e in self.events if e["event"] == "attempt"]
+        self.assertEqual(len(attempts), 3)
+        self.assertTrue(any(e["dns"] is not None and e["connect"] is not None for e in attempts)) # first connection
+        success = next(e for e in attempts if e["success"])
+        self.assertEqual(success["bytes"], len(PDF_BYTES))
+        self.assertGreaterEqual(success["transfer"], 0)
+        self.assertGreater(success["ttfb"], 0)
+        self.assertEqual(sorted((e["id"], e["result"]) for e in self.events if e["event"] == "file"),
+                         [("BR1", "Downloaded"), ("BR2", "Not a PDF")])
+
+        counters = self.metrics.snapshot()["counters"]
+        host = self.base_url.split("//")[1]
+        self.assertEqual(counters[("requests_total", (("host", host),))], 3)
+        self.assertEqual(counters[("errors_total", (("host", host), ("kind", "http_404")))], 1)
+        self.assertEqual(counters[("errors_total", (("host", host), ("kind", "not_pdf")))], 1)
+        self.assertEqual(counters[("report_rows_total", ())], 2)
+        self.assertIn(("report_writer_lag_seconds", ()), self.metrics.snapshot()["summaries"])
+
+        self.metrics.close()
+        lines = (Path(self.tmp.name) / "metrics.jsonl").read_text(encoding="utf-8").splitlines()
+        self.assertEqual([json.loads(line)["event"] for line in lines], [e["event"] for e in self.events])
+        prom = (Path(self.tmp.name) / "metrics.prom").read_text(encoding="utf-8")
+        self.assertIn("# TYPE pdfdownloader_requests_total counter", prom)
+        self.assertIn(f'pdfdownloader_errors_total{{host="{host}",kind="http_404"}} 1', prom)
+        self.assertIn("pdfdownloader_ttfb_seconds_count 3", prom)
+
+    def test_threaded(self):
+        self.downloader.process_downloads_threaded(2, max_workers=1)
+        self.check_run()
+
+    def test_async(self):
+        self.downloader.process_downloads_async(2, max_concurrency=1)
+        self.check_run()
+
+    def test_retries_are_counted(self):
+        MockPdfHandler.failures["/flaky.pdf"] = 1
+        self.downloader.retry_policy = RetryPolicy(max_attempts=2, base_delay=0.01)
+        self.downloader.df2 = self.downloader.df2.iloc[:1].assign(Pdf_URL=f"{self.base_url}/flaky.pdf")
+        self.downloader.process_downloads_threaded(1, max_workers=1)
+        self.assertEqual([e["attempt"] for e in self.events if e["event"] == "retry"], [1])
+        self.assertEqual(self.metrics.snapshot()["counters"][("errors_total", (("host", self.base_url.split("//")[1]), ("kind", "http_503")))], 1)
+
+    def test_error_kind(self):
+        self.assertEqual(error_kind("Failed to download: 404 - Not Found"), "http_404")
+        self.assertEqual(error_kind("Request timed out: read timeout"), "timeout")
+        self.assertEqual(error_kind("Something else"), "other")
+
+    def test_failing_callback_does_not_fail_download(self):
+        def broken(event):
+            raise ValueError("broken")
+        self.metrics.add_exporter(broken)
+        with patch("builtins.print"):
+            self.downloader.process_downloads_threaded(2, max_workers=1)
+        self.assertTrue((self.downloader.dwn_folder / "BR1.pdf").exists())
+
+class test_sharded(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store()
+        rows = {f"BR{i}": (f"BR{i}.pdf", f"BR{i}.pdf") for i in range(5)}
+        self.downloader = self.make_downloader({**rows, "BR5": ("missing", "gone")}, state_store=self.store,
+                                               retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01))
+
+    def test_results_merge_into_one_report(self):
+        self.downloader.process_downloads_sharded(6, processes=2, max_workers=2, chunk_size=2)
+        self.assertEqual(ReportWriter.read_results(self.tmp.name), {**{f"BR{i}": "Downloaded" for i in range(5)}, "BR5": "Not downloaded"})
+        self.assertEqual(sorted(self.store.downloaded_ids()), [f"BR{i}" for i in range(5)])
+        self.assertTrue(self.downloader.df2.at["BR5", "error"].startswith("Failed to download: 404"))
+
+    def test_shards_are_stable(self):
+        rows = [(f"BR{i}", "a", "b") for i in range(20)]
+        chunks = PDFDownloader._shard_rows(rows, 3, 4)
+        self.assertEqual(sorted(row for chunk in chunks for row in chunk), sorted(rows))
+        self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+        shards = lambda rows: {frozenset(row[0] for row in chunk) for chunk in PDFDownloader._shard_rows(rows, 3, len(rows))} # one chunk per shard
+        self.assertEqual(shards(rows), shards(list(reversed(rows))))
+        self.assertEqual(len(shards(rows)), 3)
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork", "the patch only reaches forked processes")
+    def test_crashing_row_is_isolated(self):
+        download_row = PDFDownloader.download_row
+        def crash_on_br3(self, br_number, *args, **kwargs):
+            if br_number == "BR3":
+                os._exit(1) # like a segfault in a native PDF parser
+            return download_row(self, br_number, *args, **kwargs)
+
+        with patch.object(PDFDownloader, "download_row", crash_on_br3):
+            self.downloader.process_downloads_sharded(5, processes=2, max_workers=1, chunk_size=5)
+        report = ReportWriter.read_results(self.tmp.name)
+        self.assertEqual(report.pop("BR3"), "Not downloaded")
+        self.assertEqual(report, {f"BR{i}": "Downloaded" for i in (0, 1, 2, 4)})
+        self.assertEqual(self.downloader.df2.at["BR3", "error"], "Worker process crashed")
+        # BR0-BR2 share BR3's chunk and were done before it crashed; the re-run takes them from the state store
+        paths = [path for path, _ in MockPdfHandler.requests_seen]
+        self.assertEqual(sorted(paths), sorted(f"/BR{i}.pdf" for i in (0, 1, 2, 4)))
+
+class test_validation(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        truncated = REAL_PDF[:len(REAL_PDF) // 2]
+        MockPdfHandler.bodies.update({"/real.pdf": [REAL_PDF], "/broken.pdf": [truncated], "/flaky.pdf": [truncated, REAL_PDF]})
+        self.store = self.make_store()
+        self.downloader = self.make_downloader({"BR1": ("real.pdf", "missing"), "BR2": ("broken.pdf", "missing"), "BR3": ("flaky.pdf", "missing")},
+                                               state_store=self.store, validator=PdfValidator(workers=1, queue_size=2))
+
+    def test_validate(self):
+        path = Path(self.tmp.name) / "a.pdf"
+        path.write_bytes(REAL_PDF)
+        self.assertEqual(self.downloader.validator.validate(path),
+                         {"valid": True, "error": "", "warning": "", "pages": 1, "title": "Annual report", "producer": "unit test"})
+        path.write_bytes(REAL_PDF[:len(REAL_PDF) // 2])
+        verdict = self.downloader.validator.validate(path)
+        self.assertFalse(verdict["valid"])
+        self.assertIn("truncated", verdict["error"])
+        path.write_bytes(PDF_BYTES) # has %%EOF but no cross-reference table
+        self.assertFalse(self.downloader.validator.validate(path)["valid"])
+
+    def test_wrong_startxref_offset(self):
+        offset = re.search(rb"startxref\s+(\d+)", REAL_PDF).group(1)
+        shifted = REAL_PDF.replace(b"startxref\n" + offset, b"startxref\n" + str(int(offset) - 7).encode()) # PyPDF2 repairs it
+        path = Path(self.tmp.name) / "a.pdf"
+        path.write_bytes(shifted)
+        verdict = self.downloader.validator.validate(path)
+        self.assertTrue(verdict["valid"])
+        self.assertIn("does not point at a cross-reference table", verdict["warning"])
+        self.assertEqual((verdict["pages"], verdict["title"]), (1, "Annual report"))
+
+        MockPdfHandler.bodies["/shifted.pdf"] = [shifted]
+        downloader = self.make_downloader({"BR4": ("shifted.pdf", "missing")}, state_store=self.store, validator=PdfValidator(workers=1))
+        with patch("builtins.print"):
+            downloader.process_downloads_threaded(1, max_workers=1)
+        self.assertEqual(self.store.get("BR4")["status"], "downloaded")
+        self.assertEqual((downloader.dwn_folder / "BR4.pdf").read_bytes(), shifted) # kept, not downloaded again
+        self.assertEqual([path for path, _ in MockPdfHandler.requests_seen], ["/shifted.pdf"])
+
+    def check_run(self):
+        self.assertEqual(self.store.get("BR1")["pages"], 1)
+        self.assertEqual(self.store.get("BR1")["title"], "Annual report")
+        self.assertEqual(self.store.get("BR2")["status"], "corrupt")
+        self.assertEqual(self.store.get("BR3")["status"], "downloaded")
+        self.assertFalse((self.downloader.dwn_folder / "BR2.pdf").exists())
+        self.assertEqual([path for path, _ in MockPdfHandler.requests_seen].count("/broken.pdf"), 2) # requeued once
+        self.assertTrue(self.downloader.df2.at["BR2", "error"].startswith("Corrupt PDF"))
+        with open(Path(self.tmp.name) / "Download_result_report.csv", encoding="utf-8") as f:
+            report = sorted(line.strip() for line in f)
+        self.assertEqual(report, ["BR1;Downloaded;1;Annual report;unit test", "BR2;Corrupt PDF;;;",
+                                  "BR3;Downloaded;1;Annual report;unit test", "Name;Result;Pages;Title;Producer"])
+        self.assertEqual(self.downloader.summarize_downloads(3, as_frame=True)["Status"].tolist(), ["Success", "Corrupt PDF", "Success"])
+
+    def test_threaded(self):
+        self.downloader.process_downloads_threaded(3, max_workers=2)
+        self.check_run()
+
+    def test_async(self):
+        self.downloader.process_downloads_async(3, max_concurrency=2)
+        self.check_run()
+
+    def test_sharded(self):
+        self.downloader.process_downloads_sharded(3, processes=2, max_workers=1)
+        self.check_run()
+
+    def test_old_store_is_migrated(self):
+        path = Path(self.tmp.name) / "old.sqlite"
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE downloads (brnum TEXT PRIMARY KEY, status TEXT NOT NULL, url TEXT, size INTEGER, sha256 TEXT, "
+                     "etag TEXT, last_modified TEXT, http_status INTEGER, error TEXT, updated_at REAL)")
+        conn.execute("INSERT INTO downloads VALUES ('BR1', 'downloaded', NULL, 1, NULL, NULL, NULL, NULL, '', 0)")
+        conn.commit()
+        conn.close()
+        store = DownloadStateStore(path)
+        store.record("BR2", "downloaded", pages=3, title="t", producer="p")
+        self.assertEqual(store.get("BR1")["pages"], None)
+        self.assertEqual(store.get("BR2")["pages"], 3)
+        store.close()
+
+class test_dedup(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self.make_store()
+        self.blobs = BlobStore(Path(self.tmp.name) / "blobs")
+        shared = self.url("shared.pdf")
+        self.downloader = self.make_downloader({"BR1": (shared, "missing"), "BR2": (shared.replace("http://", "HTTP://") + "#page=2", "missing"),
+                                                "BR3": (shared, "missing"), "BR4": ("other.pdf", "missing")},
+                                               state_store=self.store, blob_store=self.blobs, dedup_urls=True)
+
+    def check_run(self):
+        self.assertEqual(sorted(path for path, _ in MockPdfHandler.requests_seen), ["/other.pdf", "/shared.pdf"])
+        files = [self.downloader.dwn_folder / f"BR{i}.pdf" for i in range(1, 5)]
+        self.assertTrue(all(f.read_bytes() == PDF_BYTES for f in files))
+        self.assertTrue(all(os.path.samefile(files[0], f) for f in files[1:])) # same content, one blob
+        self.assertEqual(len(list(self.blobs.root.rglob("*.pdf"))), 1)
+        self.assertEqual(self.store.get("BR2")["sha256"], self.store.get("BR1")["sha256"])
+        self.assertEqual(sorted(self.store.downloaded_ids()), ["BR1", "BR2", "BR3", "BR4"])
+
+    def test_threaded(self):
+        self.downloader.process_downloads_threaded(4, max_workers=4)
+        self.check_run()
+
+    def test_async(self):
+        self.downloader.process_downloads_async(4, max_concurrency=4)
+        self.check_run()
+
+    def test_delete_prunes_blobs(self):
+        self.downloader.process_downloads_threaded(4, max_workers=2)
+        self.downloader.delete_downloaded_files()
+        self.assertEqual(list(self.blobs.root.rglob("*.pdf")), [])
+
+    def test_normalize_url(self):
+        self.assertEqual(PDFDownloader._normalize_url(" HTTPS://Example.COM:443?a=1#x "), "https://example.com/?a=1")
+        self.assertEqual(PDFDownloader._normalize_url("http://example.com:8080/A.pdf"), "http://example.com:8080/A.pdf")
+
+class test_large_download(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        MockPdfHandler.pdf_body = LARGE_PDF
+        self.downloader = self.make_downloader()
+        self.savepath = Path(self.tmp.name) / "BR1.pdf"
+        self.part = Path(self.tmp.name, "BR1.pdf.part")
+        self.marker = Path(self.tmp.name, "BR1.pdf.part.url")
+
+    def test_chunk_size(self):
+        self.assertEqual(PDFDownloader._chunk_size(0), 256 * 1024)
+        self.assertEqual(PDFDownloader._chunk_size(100_000), 256 * 1024)
+        self.assertEqual(PDFDownloader._chunk_size(16 * 1024 * 1024), 1024 * 1024)
+        self.assertEqual(PDFDownloader._chunk_size(10 ** 9), 4 * 1024 * 1024)
+
+    def test_threaded(self):
+        info = {}
+        self.assertEqual(self.downloader.download_pdf(f"{self.base_url}/a.pdf", self.savepath, info), (True, ""))
+        self.assertEqual(self.savepath.read_bytes(), LARGE_PDF)
+        self.assertEqual(info["sha256"], hashlib.sha256(LARGE_PDF).hexdigest())
+        self.assertFalse(self.part.exists())
+
+    def test_async(self):
+        import aiohttp
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                info = {}
+                result = await self.downloader.download_pdf_async(session, f"{self.base_url}/a.pdf", self.savepath, info)
+                return result, info
+
+        (success, error), info = asyncio.run(run())
+        self.assertTrue(success, error)
+        self.assertEqual(self.savepath.read_bytes(), LARGE_PDF)
+        self.assertEqual(info["sha256"], hashlib.sha256(LARGE_PDF).hexdigest())
+
+    def test_interrupted_preallocated_download_resumes(self):
+        url = f"{self.base_url}/a.pdf"
+        MockPdfHandler.cut_after = 1_500_000
+        info = {}
+        success, _ = self.downloader.download_pdf(url, self.savepath, info)
+        self.assertFalse(success)
+        self.assertTrue(info["retryable"])
+        size = self.part.stat().st_size
+        self.assertTrue(0 < size <= 1_500_000) # cut back from the preallocated size to what was written
+        self.assertEqual(self.part.read_bytes(), LARGE_PDF[:size])
+        self.assertEqual(self.marker.read_text(encoding="utf-8"), url)
+
+        MockPdfHandler.cut_after = None
+        self.assertEqual(self.downloader.download_pdf(url, self.savepath), (True, ""))
+        self.assertEqual(self.savepath.read_bytes(), LARGE_PDF)
+
+    def test_part_left_preallocated_is_restarted(self):
+        url = f"{self.base_url}/a.pdf"
+        self.part.write_bytes(LARGE_PDF[:1000] + b"\0" * (len(LARGE_PDF) - 1000)) # a crash before the file was cut back
+        self.marker.write_text(url + "\npreallocated", encoding="utf-8")
+        self.assertEqual(self.downloader._resume_offset(url, self.savepath), 0)
+        self.assertEqual(self.downloader.download_pdf(url, self.savepath), (True, ""))
+        self.assertEqual(self.savepath.read_bytes(), LARGE_PDF)
+
+class test_download_order(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = pd.DataFrame({"Pdf_URL": ["http://a/1.pdf", "http://a/2.pdf", "http://b/3.pdf", "http://b/4.pdf", "http://c/5.pdf"],
+                                "Pub_Year": [2018, 2020, 2019, 2020, 2017],
+                                "Size": [None, None, None, 10, None]},
+                               index=pd.Index([f"BR{i}" for i in range(1, 6)], name="BRnum"))
+
+    def ids(self, order, number_of_files=None, known_sizes=None):
+        return list(order.select(self.df, number_of_files, "Pdf_URL", known_sizes).index)
+
+    def test_default_is_list_order(self):
+        self.assertEqual(self.ids(DownloadOrder(), 3), ["BR1", "BR2", "BR3"])
+
+    def test_columns(self):
+        self.assertEqual(self.ids(DownloadOrder("Pub_Year", ascending=False)), ["BR2", "BR4", "BR3", "BR1", "BR5"])
+
+    def test_size(self):
+        known = {"BR1": 500, "BR2": 100, "BR3": 300}
+        self.assertEqual(self.ids(DownloadOrder(size="smallest", size_column="Size"), known_sizes=known)[:3], ["BR4", "BR2", "BR5"])
+        # without the column, BR4 gets the size known for its host
+        self.assertEqual(self.ids(DownloadOrder(size="smallest"), known_sizes=known), ["BR2", "BR3", "BR4", "BR5", "BR1"])
+        # BR5's host has no known size, so it gets the median of all known sizes
+        self.assertEqual(self.ids(DownloadOrder(size="largest", size_column="Size"), known_sizes=known), ["BR1", "BR3", "BR5", "BR2", "BR4"])
+        self.assertEqual(self.ids(DownloadOrder(size="smallest")), ["BR1", "BR2", "BR3", "BR4", "BR5"]) # nothing known
+        self.assertRaises(ValueError, DownloadOrder, size="biggest")
+
+    def test_spread_hosts(self):
+        self.assertEqual(self.ids(DownloadOrder(spread_hosts=True)), ["BR1", "BR3", "BR5", "BR2", "BR4"])
+
+    def test_subsets_and_samples(self):
+        self.assertEqual(self.ids(DownloadOrder(ids=["BR4", "BR1", "BR9"])), ["BR4", "BR1"])
+        sample = self.ids(DownloadOrder(sample=3, seed=1))
+        self.assertEqual(len(sample), 3)
+        self.assertEqual(sample, sorted(sample)) # list order is kept
+        self.assertEqual(sample, self.ids(DownloadOrder(sample=0.6, seed=1)))
+
+    def test_downloader_follows_order(self):
+        downloader = self.make_downloader(order=DownloadOrder("Pub_Year", ids=["BR1", "BR2", "BR3", "BR5"]))
+        urls = [self.url(f"{i}.pdf") for i in self.df.index]
+        downloader.df2 = self.df.assign(**{"Pdf_URL": urls, "Report Html Address": urls})
+        with patch('builtins.print'):
+            downloader.process_downloads_threaded(3, max_workers=1)
+            summary = downloader.summarize_downloads(3)
+        self.assertEqual([path for path, _ in MockPdfHandler.requests_seen], ["/BR5.pdf", "/BR1.pdf", "/BR3.pdf"])
+        self.assertEqual([row["ID"] for row in summary], ["BR5", "BR1", "BR3"])
+        self.assertTrue(all(row["Status"] == "Success" for row in summary))
+
+class test_governor(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.savepath = Path(self.tmp.name) / "BR1.pdf"
+
+    def downloader(self, governor):
+        return self.make_downloader({i: (f"{i}.pdf", f"{i}.pdf") for i in ("BR1", "BR2")}, governor=governor)
+
+    def test_reserve(self):
+        governor = DownloadGovernor(max_bytes_per_second=1000)
+        self.assertEqual(governor.reserve(1000), 0.0)
+        self.assertAlmostEqual(governor.reserve(500), 0.5, places=2)
+        self.assertEqual(DownloadGovernor().reserve(10 ** 9), 0.0)
+
+    def test_bandwidth_cap_is_shared(self):
+        downloader = self.downloader(DownloadGovernor(max_bytes_per_second=100_000, burst_bytes=1))
+        start = time.perf_counter()
+        with patch('builtins.print'):
+            downloader.process_downloads_threaded(2, max_workers=2)
+        self.assertGreater(time.perf_counter() - start, 0.3) # 2 x 20 KB at 100 KB/s
+        self.assertTrue(Path(self.tmp.name, "dwn", "BR2.pdf").exists())
+
+    def test_free_space_hysteresis(self):
+        governor = DownloadGovernor(min_free_bytes=100, resume_free_bytes=200)
+        with patch('builtins.print'), patch('download_governor.shutil.disk_usage') as disk_usage:
+            for free, expected in ((150, True), (50, False), (150, False), (250, True)):
+                disk_usage.return_value.free = free
+                self.assertEqual(governor.has_space(self.tmp.name), expected)
+
+    def test_run_waits_for_space(self):
+        downloader = self.downloader(DownloadGovernor(min_free_bytes=100, check_interval=0.05))
+        answers = iter([0, 0, 0])
+        def disk_usage(folder):
+            return unittest.mock.Mock(free=next(answers, 1000))
+        with patch('builtins.print') as mock_print, patch('download_governor.shutil.disk_usage', disk_usage):
+            downloader.process_downloads_threaded(2, max_workers=2)
+        printed = [call.args[0] for call in mock_print.call_args_list]
+        self.assertTrue(any("pausing" in line for line in printed))
+        self.assertTrue(any("resuming" in line for line in printed))
+        self.assertTrue(Path(self.tmp.name, "dwn", "BR1.pdf").exists())
+
+    def test_max_file_size(self):
+        downloader = self.make_downloader(governor=DownloadGovernor(max_file_size=1000))
+        info = {}
+        success, error = downloader.download_pdf(f"{self.base_url}/a.pdf", self.savepath, info)
+        self.assertFalse(success)
+        self.assertTrue(error.startswith("File too large: 20016 bytes"))
+        self.assertFalse(info["retryable"])
+        self.assertEqual(error_kind(error), "too_large")
+
+        server = benchmark.MockPdfServer(chunked=True, sizes=(5000, 5000)) # no Content-Length
+        base_url = server.start()
+        try:
+            success, error = downloader.download_pdf(f"{base_url}/b.pdf", self.savepath)
+        finally:
+            server.stop()
+        self.assertFalse(success)
+        self.assertTrue(error.startswith("File too large: more than 1000 bytes"))
+        self.assertFalse(Path(self.tmp.name, "BR1.pdf.part").exists())
+
+class test_graceful_stop(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        MockPdfHandler.delay = 0.3
+        self.checkpoint_path = Path(self.tmp.name) / "checkpoint.json"
+
+    def downloader(self, checkpoint, **kwargs):
+        return self.make_downloader({f"BR{i}": (f"BR{i}.pdf", f"BR{i}.pdf") for i in range(6)}, checkpoint=checkpoint, **kwargs)
+
+    def report(self):
+        return ReportWriter.read_results(self.tmp.name)
+
+    def test_checkpoint_round_trip(self):
+        checkpoint = RunCheckpoint(self.checkpoint_path, interval=3600)
+        checkpoint.begin(["BR1", "BR2", "BR3"])
+        self.assertFalse(checkpoint.mark("BR1", "Downloaded"))
+        checkpoint.mark("BR2", "Not downloaded")
+        checkpoint.save()
+        data = json.loads(self.checkpoint_path.read_text(encoding="utf-8"))
+        self.assertEqual((data["done"], data["failed"], data["pending"], data["complete"]), (["BR1"], ["BR2"], ["BR3"], False))
+
+        loaded = RunCheckpoint(self.checkpoint_path)
+        self.assertTrue(loaded.load())
+        loaded.begin(["BR9"]) # a resumed run keeps the earlier selection
+        self.assertEqual(loaded.pending(), ["BR3"])
+        self.assertTrue(loaded.is_finished("BR2"))
+        self.assertFalse(RunCheckpoint(Path(self.tmp.name) / "missing.json").load())
+
+    def test_stop_drains_and_resume_finishes(self):
+        downloader = self.downloader(RunCheckpoint(self.checkpoint_path))
+        threading.Timer(0.1, downloader.request_stop).start()
+        with patch('builtins.print'):
+            downloader.process_downloads_threaded(6, max_workers=2)
+        self.assertEqual(self.report(), {"BR0": "Downloaded", "BR1": "Downloaded"}) # the two running rows finished
+        data = json.loads(self.checkpoint_path.read_text(encoding="utf-8"))
+        self.assertEqual(data["pending"], ["BR2", "BR3", "BR4", "BR5"])
+
+        MockPdfHandler.requests_seen.clear()
+        checkpoint = RunCheckpoint(self.checkpoint_path)
+        checkpoint.load()
+        with patch('builtins.print'):
+            self.downloader(checkpoint).process_downloads_threaded(6, max_workers=2)
+        self.assertEqual(sorted(path for path, _ in MockPdfHandler.requests_seen), ["/BR2.pdf", "/BR3.pdf", "/BR4.pdf", "/BR5.pdf"])
+        self.assertEqual(self.report(), {f"BR{i}": "Downloaded" for i in range(6)})
+        self.assertTrue(json.loads(self.checkpoint_path.read_text(encoding="utf-8"))["complete"])
+
+    def test_running_download_is_cancelled_after_timeout(self):
+        MockPdfHandler.delay = 0.0
+        MockPdfHandler.pdf_body = LARGE_PDF
+        downloader = self.downloader(RunCheckpoint(self.checkpoint_path), shutdown_timeout=0.1,
+                                     governor=DownloadGovernor(max_bytes_per_second=2 * 2 ** 20, burst_bytes=2 ** 18))
+        threading.Timer(0.3, downloader.request_stop).start()
+        with patch('builtins.print'):
+            downloader.process_downloads_threaded(1, max_workers=1)
+        part = Path(self.tmp.name, "dwn", "BR0.pdf.part")
+        self.assertTrue(0 < part.stat().st_size < len(LARGE_PDF)) # aborted, kept for the resumed run
+        self.assertEqual(self.report(), {})
+
+        checkpoint = RunCheckpoint(self.checkpoint_path)
+        checkpoint.load()
+        with patch('builtins.print'):
+            self.downloader(checkpoint).process_downloads_threaded(1, max_workers=1)
+        self.assertEqual(Path(self.tmp.name, "dwn", "BR0.pdf").read_bytes(), LARGE_PDF)
+
+    def test_async_stop(self):
+        import aiohttp # imported before the timer starts, the first import is slow
+        downloader = self.downloader(RunCheckpoint(self.checkpoint_path))
+        threading.Timer(0.1, downloader.request_stop).start()
+        with patch('builtins.print'):
+            downloader.process_downloads_async(6, max_concurrency=2, per_host_limit=2)
+        self.assertEqual(self.report(), {"BR0": "Downloaded", "BR1": "Downloaded"})
+        self.assertEqual(json.loads(self.checkpoint_path.read_text(encoding="utf-8"))["pending"], ["BR2", "BR3", "BR4", "BR5"])
+
+    def test_ctrl_c_stops_the_run(self):
+        downloader = self.downloader(RunCheckpoint(self.checkpoint_path))
+        threading.Timer(0.1, os.kill, (os.getpid(), signal.SIGINT)).start()
+        with patch('builtins.print'):
+            downloader.process_downloads_threaded(6, max_workers=2)
+        self.assertEqual(len(self.report()), 2)
+        self.assertIs(signal.getsignal(signal.SIGINT), signal.default_int_handler) # restored after the run
+
+    def test_checkpoint_is_saved_off_the_workers(self):
+        MockPdfHandler.delay = 0.0
+        for engine in ("threaded", "async"):
+            checkpoint = RunCheckpoint(Path(self.tmp.name) / f"{engine}.json", interval=0) # due after every row
+            saved_on = []
+            save = checkpoint.save
+            checkpoint.save = lambda: (saved_on.append(threading.current_thread()), save())
+            downloader = self.downloader(checkpoint)
+            with patch('builtins.print'):
+                if engine == "async":
+                    downloader.process_downloads_async(6, max_concurrency=2)
+                else:
+                    downloader.process_downloads_threaded(6, max_workers=2)
+            self.assertGreater(len(saved_on), 1) # during the run, not only when it ends
+            if engine == "threaded":
+                self.assertTrue(all(thread is threading.main_thread() for thread in saved_on)) # the dispatcher
+            else:
+                self.assertTrue(all(thread is not threading.main_thread() for thread in saved_on[:-1])) # not the event loop
+                self.assertIs(saved_on[-1], threading.main_thread()) # the final save, after the loop
+
+class test_fast_delete(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = DownloadStateStore(Path(self.tmp.name) / "state.sqlite")
+        self.downloader = PDFDownloader("unused.xlsx", self.tmp.name, "Pdf_URL", "Report Html Address", state_store=self.store)
+        self.downloader.dwn_folder.mkdir(parents=True)
+        for i in range(1200):
+            (self.downloader.dwn_folder / f"BR{i}.pdf").write_bytes(PDF_BYTES[:100])
+            self.store.record(f"BR{i}", "downloaded" if i % 3 else "corrupt")
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_parallel(self):
+        (self.downloader.dwn_folder / "keep.txt").write_text("not a pdf")
+        self.downloader.delete_downloaded_files(workers=4)
+        self.assertEqual(os.listdir(self.downloader.dwn_folder), ["keep.txt"])
+        self.assertEqual(self.store.downloaded_ids(), [])
+
+    def test_background(self):
+        leftover = self.downloader.dwn_folder.with_name("dwn.deleting-19700101-000000-1")
+        leftover.mkdir()
+        (leftover / "BR0.pdf").write_bytes(PDF_BYTES[:100])
+        self.downloader.delete_downloaded_files(background=True)
+        self.assertEqual(os.listdir(self.downloader.dwn_folder), []) # downloads can start right away
+        self.assertEqual(self.store.downloaded_ids(), [])
+        self.downloader.cleanup_thread.join(10)
+        self.assertEqual(list(self.downloader.dwn_folder.parent.glob("dwn.deleting-*")), [])
+
+    def test_by_status(self):
+        self.downloader.delete_downloaded_files(statuses=("corrupt",), background=True) # selective deletions do not go to the background
+        self.assertEqual(len(os.listdir(self.downloader.dwn_folder)), 800)
+        self.assertFalse((self.downloader.dwn_folder / "BR0.pdf").exists())
+        self.assertIsNone(self.store.get("BR0"))
+        self.assertEqual(len(self.store.downloaded_ids()), 800)
+
+    def test_by_report(self):
+        with open(Path(self.tmp.name) / "Download_result_report.csv", "w", encoding="utf-8") as f:
+            f.write("Name;Result\nBR1;Downloaded\nBR2;Corrupt PDF\nBR5000;Corrupt PDF\n")
+        self.downloader.delete_downloaded_files(report_results=("Corrupt PDF",))
+        self.assertTrue((self.downloader.dwn_folder / "BR1.pdf").exists())
+        self.assertFalse((self.downloader.dwn_folder / "BR2.pdf").exists())
+        self.assertEqual(len(os.listdir(self.downloader.dwn_folder)), 1199)
+
+class test_result_store(MockServerTestCase):
+    def test_record_and_materialize(self):
+        df = pd.DataFrame({"Pdf_URL": ["http://a/1.pdf", "http://a/2.pdf", "http://a/3.pdf"], "error": [None, None, "old error"]},
+                          index=pd.Index(["BR1", "BR2", "BR3"], name="BRnum"))
+        results = ResultStore(df.index[:2], df["Pdf_URL"].to_numpy()[:2])
+        self.assertTrue(results.record("BR1", "Downloaded", "http://a/1.pdf", "", 200, 1000, 0.5))
+        self.assertTrue(results.record("BR2", "Not downloaded", "http://b/2.pdf", "Failed to download: 404", 404))
+        self.assertFalse(results.record("BR9", "Downloaded"))
+        self.assertEqual(results.error_of("BR2"), "Failed to download: 404")
+        self.assertEqual(results.materialize(df, "Pdf_URL", "Report Html Address"), 2)
+        self.assertEqual(list(df["result"].fillna("")), ["Downloaded", "Not downloaded", ""])
+        self.assertEqual(list(df["used_column"].fillna("")), ["Pdf_URL", "Report Html Address", ""])
+        self.assertEqual(df.at["BR1", "bytes"], 1000)
+        self.assertEqual(df.at["BR2", "http_status"], 404)
+        self.assertTrue(pd.isna(df.at["BR1", "error"]))
+        self.assertEqual(df.at["BR2", "error"], "Failed to download: 404")
+        self.assertEqual(df.at["BR3", "error"], "old error") # not part of the run
+
+    def test_threads(self):
+        ids = [f"BR{i}" for i in range(10000)]
+        results = ResultStore(ids, [f"http://a/{i}.pdf" for i in range(10000)])
+        def work(part):
+            for i in part:
+                results.record(ids[i], "Downloaded", f"http://a/{i}.pdf", "", 200, i)
+        threads = [threading.Thread(target=work, args=(range(k, 10000, 8),)) for k in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        frame = results.to_frame()
+        self.assertEqual(len(frame), 10000)
+        self.assertEqual(int(frame["bytes"].sum()), sum(range(10000)))
+        self.assertTrue((frame["used_column"] == "main").all())
+
+    def test_threaded_run(self):
+        downloader = self.make_downloader({"BR1": ("a.pdf", "missing"), "BR2": ("missing", "b.pdf"), "BR3": ("missing", "gone")})
+        downloader.process_downloads_threaded(3, max_workers=3)
+        df = downloader.df2
+        self.assertIsNone(downloader.results)
+        self.assertEqual(list(df["result"]), ["Downloaded", "Downloaded", "Not downloaded"])
+        self.assertEqual(list(df["used_column"]), ["Pdf_URL", "Report Html Address", "Report Html Address"])
+        self.assertEqual(list(df["http_status"]), [200, 200, 404])
+        self.assertEqual(df.at["BR1", "bytes"], len(PDF_BYTES))
+        self.assertIn("Failed to download: 404", df.at["BR3", "error"])
+        summary = downloader.summarize_downloads(3, as_frame=True)
+        self.assertEqual(list(summary["UsedColumn"]), ["Pdf_URL", "Report Html Address", "Report Html Address"])
+
+class test_cli(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config = Path(self.tmp.name) / "pdfdownloader.toml"
+        self.config.write_text('list = "reports.xlsx"\noutput = "out"\nworkers = 4\n\n'
+                               '[profiles.cron]\nincremental = true\nfiles = 50\nengine = "async"\nmax-file-mb = 100\nvalidate = false\n',
+                               encoding="utf-8")
+
+    def test_profile(self):
+        settings = cli.parse_settings(["--config", str(self.config), "--profile", "cron", "--files", "5"])
+        self.assertEqual((settings.list_path, settings.output_folder, settings.workers), ("reports.xlsx", "out", 4))
+        self.assertEqual((settings.engine, settings.max_file_mb, settings.files), ("async", 100, 5)) # the command line wins
+        self.assertTrue(settings.incremental)
+        self.assertFalse(settings.validate)
+        settings = cli.parse_settings(["--config", str(self.config)])
+        self.assertEqual((settings.engine, settings.files, settings.incremental), ("threaded", 20, False))
+
+    def test_bad_settings(self):
+        with patch("sys.stderr", new_callable=io.StringIO):
+            with self.assertRaises(SystemExit):
+                cli.parse_settings(["--config", str(self.config), "--profile", "nightly"])
+            self.config.write_text('list = "a.xlsx"\noutput = "out"\nthreads = 4\n', encoding="utf-8")
+            with self.assertRaises(SystemExit):
+                cli.parse_settings(["--config", str(self.config)])
+            with self.assertRaises(SystemExit):
+                cli.parse_settings(["--list", "a.xlsx"])
+            self.config.write_text('list = "a.xlsx"\noutput = "out"\nengine = "bogus"\n', encoding="utf-8")
+            with self.assertRaises(SystemExit):
+                cli.parse_settings(["--config", str(self.config)])
+        self.assertEqual(cli.parse_settings(["--config", str(self.config), "--engine", "async"]).engine, "async")
+
+    def test_dry_run_is_lazy(self):
+        code = ("import sys, cli; cli.main(['--dry-run', '--list', 'a.xlsx', '--output', 'out']); "
+                "print(sorted(m for m in ('pandas', 'requests', 'numpy', 'download_files') if m in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).parent).stdout
+        self.assertIn("Dry run", output)
+        self.assertTrue(output.strip().endswith("[]"))
+        code = "import runpy, sys; sys.argv = ['download_files.py', '--help']; runpy.run_path('download_files.py', run_name='__main__')"
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                                cwd=Path(__file__).parent)
+        self.assertIn("usage: pdfdownloader", result.stdout)
+        self.assertNotIn("pandas", result.stderr) # -X importtime lists every imported module on stderr
+
+    def test_run(self):
+        list_path = Path(self.tmp.name) / "list.xlsx"
+        self.frame({"BR1": ("a.pdf", "a.html"), "BR2": ("missing", "b.pdf")}).reset_index().to_excel(list_path, index=False)
+        output = Path(self.tmp.name) / "out"
+        self.assertEqual(cli.main(["--list", str(list_path), "--output", str(output), "--files", "0", "--workers", "2",
+                                   "--no-metrics", "--no-validate", "--min-free-gb", "0"]), 0)
+        self.assertTrue((output / "dwn" / "BR1.pdf").exists())
+        self.assertTrue((output / "dwn" / "BR2.pdf").exists())
+        self.assertEqual(ReportWriter.read_results(output), {"BR1": "Downloaded", "BR2": "Downloaded"})
+
+class test_preflight(MockServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.df2 = self.frame({"BR1": ("a.pdf", "a.html"), "BR2": ("missing", "b.pdf"), "BR3": ("missing", "gone"),
+                               "BR4": ("x.html", "c.pdf"), "BR5": (None, "a.pdf")})
+
+    def make_plan(self):
+        probes = Preflight(workers=4).probe(self.df2, ["Pdf_URL", "Report Html Address"])
+        return probes, Preflight.plan(probes, "Pdf_URL", "Report Html Address")
+
+    def test_probe_and_plan(self):
+        probes, plan = self.make_plan()
+        paths = [path for path, _ in MockPdfHandler.requests_seen]
+        self.assertEqual(len(paths), len(set(paths))) # every URL once, with a GET after the rejected HEAD
+        self.assertTrue(all(headers.get("Range") == "bytes=0-0" for _, headers in MockPdfHandler.requests_seen))
+        self.assertEqual(probes.at["BR1", "Pdf_URL_content_type"], "application/pdf")
+        self.assertEqual(probes.at["BR2", "Pdf_URL_status"], 404)
+        self.assertEqual(list(plan["first"]), ["Pdf_URL", "Report Html Address", "", "Report Html Address", "Report Html Address"])
+        self.assertEqual(list(plan["dead"]), [False, False, True, False, False])
+        self.assertEqual(plan.at["BR1", "size"], len(PDF_BYTES))
+        summary = Preflight.summarize(plan, "Pdf_URL")
+        self.assertEqual((summary["dead"], summary["secondary_first"], summary["expected_bytes"]), (1, 3, 4 * len(PDF_BYTES)))
+        self.assertEqual(summary["hosts"]["rows"].tolist(), [4])
+
+        path = Path(self.tmp.name) / "preflight.csv"
+        Preflight.save(plan, path)
+        loaded = Preflight.load(path)
+        self.assertEqual(list(loaded["first"]), list(plan["first"]))
+        self.assertEqual(list(loaded["dead"]), list(plan["dead"]))
+        self.assertEqual(loaded.at["BR2", "size"], len(PDF_BYTES))
+
+    def test_run_by_plan(self):
+        _, plan = self.make_plan()
+        MockPdfHandler.requests_seen.clear()
+        downloader = self.make_downloader(plan=plan)
+        downloader.df2 = self.df2.copy()
+        downloader.process_downloads_threaded(5, max_workers=2)
+        paths = [path for path, _ in MockPdfHandler.requests_seen]
+        self.assertNotIn("/gone", paths) # dead, not requested again
+        self.assertNotIn("/missing", paths) # the secondary URL worked first
+        self.assertNotIn("/x.html", paths)
+        for br_number in ("BR1", "BR2", "BR4", "BR5"):
+            self.assertTrue((downloader.dwn_folder / f"{br_number}.pdf").exists())
+        self.assertEqual(downloader.df2.at["BR3", "error"], "Failed to download: 404 (preflight)")
+        self.assertEqual(downloader.df2.at["BR2", "used_column"], "Report Html Address")
+        self.assertEqual(ReportWriter.read_results(self.tmp.name)["BR3"], "Not downloaded")
+
+    def test_dead_fallback_is_not_requested(self):
+        self.df2 = self.frame({"BR2": ("missing", "b.pdf"), "BR6": ("e.pdf", "gone")})
+        _, plan = self.make_plan()
+        self.assertEqual(list(plan["main_dead"]), [True, False])
+        self.assertEqual(list(plan["secondary_dead"]), [False, True])
+        for engine in ("threaded", "async"):
+            MockPdfHandler.requests_seen.clear()
+            MockPdfHandler.failures.update({"/b.pdf": 1, "/e.pdf": 1}) # the live URL fails during the run
+            downloader = self.make_downloader(plan=plan)
+            downloader.df2 = self.df2.copy()
+            if engine == "async":
+                downloader.process_downloads_async(2)
+            else:
+                downloader.process_downloads_threaded(2, max_workers=2)
+            paths = [path for path, _ in MockPdfHandler.requests_seen]
+            self.assertEqual(sorted(paths), ["/b.pdf", "/e.pdf"])
+            self.assertNotIn("/missing", paths)
+            self.assertNotIn("/gone", paths)
+            self.assertTrue(downloader.df2.at["BR2", "error"].startswith("Failed to download: 503"))
+            self.assertEqual(list(downloader.df2["result"]), ["Not downloaded", "Not downloaded"])
+
+    def test_cli_dry_run(self):
+        list_path = Path(self.tmp.name) / "list.xlsx"
+        self.df2.reset_index().to_excel(list_path, index=False)
+        output = Path(self.tmp.name) / "out"
+        self.assertEqual(cli.main(["--list", str(list_path), "--output", str(output), "--files", "0", "--preflight", "--dry-run"]), 0)
+        self.assertEqual(os.listdir(output), [cli.PLAN_FILE]) # no dwn folder, state store, report or metrics
+        plan = Preflight.load(output / cli.PLAN_FILE)
+        self.assertEqual(list(plan["dead"]), [False, False, True, False]) # BR5 has no main URL, the list filter drops it
+
+        (output / "dwn").mkdir()
+        (output / "dwn" / "BR1.pdf").write_bytes(PDF_BYTES) # already downloaded, left out of the probes
+        self.assertEqual(cli.main(["--list", str(list_path), "--output", str(output), "--files", "0", "--preflight", "--dry-run"]), 0)
+        self.assertEqual(sorted(os.listdir(output)), ["dwn", cli.PLAN_FILE])
+        self.assertEqual(os.listdir(output / "dwn"), ["BR1.pdf"])
+        self.assertEqual(list(Preflight.load(output / cli.PLAN_FILE).index), ["BR2", "BR3", "BR4"])
+
+        store = DownloadStateStore(output / "download_state.sqlite") # a store wins over the folder and is only read
+        store.record("BR2", "downloaded")
+        store.close()
+        before = (output / "download_state.sqlite").read_bytes()
+        self.assertEqual(cli.main(["--list", str(list_path), "--output", str(output), "--files", "0", "--preflight", "--dry-run"]), 0)
+        self.assertEqual(list(Preflight.load(output / cli.PLAN_FILE).index), ["BR1", "BR3", "BR4"])
+        self.assertEqual((output / "download_state.sqlite").read_bytes(), before)
+
 if __name__ == "__main__":
     with open("test_results.txt", "w") as f:
         # Redirect the output to the file